@@ -0,0 +1,37 @@
+"""Added friend indexes
+
+Revision ID: 3f1c9a7d5e2b
+Revises: 8694fdac2847
+Create Date: 2026-10-17 10:12:31.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d5e2b'
+down_revision: Union[str, None] = '8694fdac2847'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_friend_recipient_id_status_created_at',
+        'friend',
+        ['recipient_id', 'status', 'created_at'],
+        unique=False,
+    )
+    op.create_index(
+        'ix_friend_sender_id_status_created_at',
+        'friend',
+        ['sender_id', 'status', 'created_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_friend_sender_id_status_created_at', table_name='friend')
+    op.drop_index('ix_friend_recipient_id_status_created_at', table_name='friend')
@@ -0,0 +1,25 @@
+"""Added user created_at id index
+
+Revision ID: 5a8e3c0f6d14
+Revises: b7e4d2a91c3f
+Create Date: 2026-10-17 13:05:48.930217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a8e3c0f6d14'
+down_revision: Union[str, None] = 'b7e4d2a91c3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_user_created_at_id', 'user', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_created_at_id', table_name='user')
@@ -0,0 +1,48 @@
+"""Added friendship and friend count
+
+Revision ID: 9d41b6e2c7a5
+Revises: c2d9f7e18a60
+Create Date: 2026-10-17 16:05:42.310874
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d41b6e2c7a5'
+down_revision: Union[str, None] = 'c2d9f7e18a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'friendship',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('friend_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['friend_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'friend_id')
+    )
+    op.add_column('user', sa.Column('friend_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill the friendships of accepted friends in both directions, then count them
+    op.execute(
+        'INSERT INTO friendship (user_id, friend_id, created_at) '
+        "SELECT sender_id, recipient_id, updated_at FROM friend WHERE status = 'Accepted' "
+        'UNION ALL '
+        "SELECT recipient_id, sender_id, updated_at FROM friend WHERE status = 'Accepted'"
+    )
+    op.execute(
+        'UPDATE "user" '
+        'SET friend_count = (SELECT count(*) FROM friendship WHERE friendship.user_id = "user".id)'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('user', 'friend_count')
+    op.drop_table('friendship')
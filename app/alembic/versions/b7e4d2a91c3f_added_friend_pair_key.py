@@ -0,0 +1,59 @@
+"""Added friend pair key
+
+Revision ID: b7e4d2a91c3f
+Revises: 3f1c9a7d5e2b
+Create Date: 2026-10-17 11:40:05.718342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4d2a91c3f'
+down_revision: Union[str, None] = '3f1c9a7d5e2b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('friend', sa.Column('low_user_id', sa.Integer(), nullable=True))
+    op.add_column('friend', sa.Column('high_user_id', sa.Integer(), nullable=True))
+
+    # backfill the pair key of existing rows
+    op.execute(
+        'UPDATE friend '
+        'SET low_user_id = least(sender_id, recipient_id), '
+        'high_user_id = greatest(sender_id, recipient_id)'
+    )
+
+    # the check-then-insert of create_friend was racy, so a pair may have several rows, in either
+    # direction. Keep the accepted row, otherwise the earliest one, and delete the others
+    op.execute(
+        'DELETE FROM friend WHERE id IN ('
+        'SELECT id FROM ('
+        'SELECT id, row_number() OVER ('
+        'PARTITION BY low_user_id, high_user_id '
+        "ORDER BY status = 'Accepted' DESC, created_at, id"
+        ') AS position FROM friend'
+        ') AS ranked WHERE position > 1'
+        ')'
+    )
+
+    op.alter_column('friend', 'low_user_id', nullable=False)
+    op.alter_column('friend', 'high_user_id', nullable=False)
+
+    # unordered user pair, (a, b) and (b, a) share the same key
+    op.create_unique_constraint(
+        'uq_friend_low_user_id_high_user_id',
+        'friend',
+        ['low_user_id', 'high_user_id'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_friend_low_user_id_high_user_id', 'friend', type_='unique')
+    op.drop_column('friend', 'high_user_id')
+    op.drop_column('friend', 'low_user_id')
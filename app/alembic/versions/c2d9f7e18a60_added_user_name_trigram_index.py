@@ -0,0 +1,33 @@
+"""Added user name trigram index
+
+Revision ID: c2d9f7e18a60
+Revises: 5a8e3c0f6d14
+Create Date: 2026-10-17 14:22:17.051396
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2d9f7e18a60'
+down_revision: Union[str, None] = '5a8e3c0f6d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_user_name_trgm',
+        'user',
+        ['name'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'name': 'gin_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_name_trgm', table_name='user')
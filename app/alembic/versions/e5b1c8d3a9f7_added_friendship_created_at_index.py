@@ -0,0 +1,27 @@
+"""Added friendship created at index
+
+Revision ID: e5b1c8d3a9f7
+Revises: 9d41b6e2c7a5
+Create Date: 2026-10-17 18:42:10.512307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b1c8d3a9f7'
+down_revision: Union[str, None] = '9d41b6e2c7a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_friendship_user_id_created_at_friend_id', 'friendship', ['user_id', 'created_at', 'friend_id'], unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_friendship_user_id_created_at_friend_id', table_name='friendship')
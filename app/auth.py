@@ -1,9 +1,13 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, Callable
 
 import jwt
 from passlib.context import CryptContext
 
+from app import metrics
 from app.config import settings
 
 password_context = CryptContext(
@@ -68,3 +72,143 @@ def get_password_hash(password: str) -> str:
     :return: The hashed password.
     """
     return password_context.hash(password)
+
+
+def _timed_call(fn: Callable[..., Any], *args: Any) -> tuple[Any, float, float]:
+    """
+    Calls fn with args and records when the call started and finished.
+    This runs inside the worker, so it must stay a module level function to be picklable.
+    :return: the result of fn, start and end time of the call
+    """
+    started_at = time.monotonic()
+    result = fn(*args)
+    return result, started_at, time.monotonic()
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the password hasher queue is full
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__('Password hasher is busy')
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a bounded thread or process pool,
+    so it never blocks the event loop. Once max_queue_size jobs are waiting
+    for a worker, new jobs are rejected with PasswordHasherBusy.
+    """
+
+    def __init__(
+            self,
+            executor_type: str,
+            max_workers: int,
+            max_queue_size: int,
+            retry_after: int,
+    ):
+        self.executor_type = executor_type
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+        self._executor: Executor | None = None
+
+        # number of jobs submitted and not yet completed
+        self.in_flight = 0
+
+        # metrics
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        # the pool is created lazily, so importing this module never forks processes
+        if self._executor is None:
+            if self.executor_type == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='password-hasher',
+                )
+
+        return self._executor
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.in_flight >= self.max_workers + self.max_queue_size:
+            self.rejected += 1
+            metrics.password_hasher_rejected_total.inc()
+            raise PasswordHasherBusy(retry_after=self.retry_after)
+
+        self.in_flight += 1
+        submitted_at = time.monotonic()
+        try:
+            result, started_at, finished_at = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(),
+                _timed_call,
+                fn,
+                *args,
+            )
+        finally:
+            self.in_flight -= 1
+
+        queue_wait = max(started_at - submitted_at, 0.0)
+        self.completed += 1
+        self.queue_wait_seconds += queue_wait
+        self.hash_seconds += finished_at - started_at
+        self.max_queue_wait_seconds = max(self.max_queue_wait_seconds, queue_wait)
+        metrics.password_hash_seconds.observe(finished_at - started_at, fn.__name__)
+
+        return result
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Verify the given plain_password matches the given hashed_password on the worker pool.
+        :param plain_password: The plaintext password.
+        :param hashed_password: The hashed password.
+        :return: True if the given plain_password matches the given hashed_password else False.
+        """
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        """
+        Hashes the given password on the worker pool.
+        :param password: The password.
+        :return: The hashed password.
+        """
+        return await self._run(get_password_hash, password)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns the hasher metrics, queue wait and hash time are reported separately
+        so saturation can be told apart from slow hashing.
+        """
+        return {
+            'executor': self.executor_type,
+            'max_workers': self.max_workers,
+            'max_queue_size': self.max_queue_size,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'queue_wait_seconds_total': self.queue_wait_seconds,
+            'queue_wait_seconds_max': self.max_queue_wait_seconds,
+            'hash_seconds_total': self.hash_seconds,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    executor_type=settings.PASSWORD_HASHER_EXECUTOR,
+    max_workers=settings.PASSWORD_HASHER_WORKERS,
+    max_queue_size=settings.PASSWORD_HASHER_MAX_QUEUE,
+    retry_after=settings.PASSWORD_HASHER_RETRY_AFTER,
+)
+metrics.password_hasher_in_flight.set_function(lambda: password_hasher.in_flight)
@@ -0,0 +1,6 @@
+"""
+Benchmarks run against a scratch database, e.g.
+python -m app.benchmarks.friend_suggestions --database-url postgresql://...
+python -m app.benchmarks.endpoints --database-url postgresql://... > report.json
+The synthetic datasets they write are generated by app.benchmarks.dataset
+"""
@@ -0,0 +1,161 @@
+"""
+Synthetic social graphs for the benchmarks, written straight to the database with
+the bulk inserts of app.seed instead of going through the services.
+"""
+import itertools
+import random
+from datetime import datetime
+from typing import Iterator
+
+from sqlmodel import select
+
+from app.models import Friend, FriendStatus, Friendship, User
+from app.seed import insert_rows, update_friend_counts
+
+
+def generate_edges(users: int, edges: int, seed: int) -> Iterator[tuple[int, int]]:
+    """
+    Generates distinct friendships between user indexes, every user befriends about the same number of others.
+    A user only befriends users less than half the ring ahead of it, so no pair is generated twice
+    :param users: number of users
+    :param edges: number of friendships
+    :param seed: random seed
+    :return: iterator of user index pairs
+    """
+    rng = random.Random(seed)
+    per_user, remainder = divmod(edges, users)
+    max_offset = (users - 1) // 2
+    for user in range(users):
+        degree = min(per_user + (1 if user < remainder else 0), max_offset)
+        for offset in rng.sample(range(1, max_offset + 1), degree):
+            yield user, (user + offset) % users
+
+
+def generate_power_law_edges(
+        users: int,
+        edges: int,
+        seed: int,
+        exponent: float = 1.0,
+) -> Iterator[tuple[int, int]]:
+    """
+    Generates distinct friendships between user indexes with a power law degree distribution, like
+    social graphs have: the user at index i is picked with a weight of (i + 1) ** -exponent, so the
+    first users are hubs with many friends and most users have a few.
+    Generation stops early when the pairs left to pick are too unlikely, so fewer edges may be generated
+    :param users: number of users
+    :param edges: number of friendships
+    :param seed: random seed
+    :param exponent: skew of the distribution, 0 gives every user the same weight
+    :return: iterator of user index pairs
+    """
+    rng = random.Random(seed)
+    edges = min(edges, users * (users - 1) // 2)
+    cum_weights = list(itertools.accumulate((index + 1) ** -exponent for index in range(users)))
+    population = range(users)
+
+    seen = set()
+    attempts = edges * 20
+    while len(seen) < edges and attempts > 0:
+        batch = min(edges - len(seen), attempts)
+        attempts -= batch
+        senders = rng.choices(population, cum_weights=cum_weights, k=batch)
+        recipients = rng.choices(population, cum_weights=cum_weights, k=batch)
+        for a, b in zip(senders, recipients):
+            # the hubs are picked by most pairs, so either of them sends the request
+            if a == b or (min(a, b), max(a, b)) in seen:
+                continue
+            seen.add((min(a, b), max(a, b)))
+            yield (a, b) if rng.random() < 0.5 else (b, a)
+
+
+def chunks(rows: Iterator[dict], size: int) -> Iterator[list[dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def create_graph(
+        engine,
+        users: int,
+        edges: int,
+        seed: int,
+        chunk_size: int = 10000,
+        exponent: float | None = None,
+        status_weights: dict[FriendStatus, float] | None = None,
+        hashed_password: str = '!',
+) -> list[int]:
+    """
+    Writes users and friends between them, with the friendships and friend counts of the accepted ones
+    :param engine: database engine
+    :param users: number of users
+    :param edges: number of friends
+    :param seed: random seed
+    :param chunk_size: rows per insert
+    :param exponent: skew of a power law graph, see generate_power_law_edges, None for a uniform one
+    :param status_weights: weights of the friend statuses, defaults to every friend being accepted
+    :param hashed_password: password hash of every user, the default one matches no password
+    :return: ids of the users
+    """
+    rng = random.Random(seed)
+    statuses = list(status_weights or {FriendStatus.Accepted: 1})
+    weights = [status_weights[status] for status in statuses] if status_weights else None
+
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        for chunk in chunks(
+                ({
+                    'name': f'User {index}',
+                    'username': f'user{index}@benchmark.io',
+                    'email': f'user{index}@benchmark.io',
+                    'hashed_password': hashed_password,
+                    'status': '',
+                    'is_active': True,
+                    'is_superuser': False,
+                    'friend_count': 0,
+                    'created_at': now,
+                    'updated_at': now,
+                } for index in range(users)),
+                chunk_size,
+        ):
+            insert_rows(connection, User.__table__, chunk)
+
+        user_ids = list(connection.execute(select(User.id).order_by(User.id)).scalars())
+
+        if exponent is None:
+            pairs = generate_edges(users, edges, seed)
+        else:
+            pairs = generate_power_law_edges(users, edges, seed, exponent=exponent)
+
+        def friends() -> Iterator[dict]:
+            for a, b in pairs:
+                sender_id, recipient_id = user_ids[a], user_ids[b]
+                yield {
+                    'sender_id': sender_id,
+                    'recipient_id': recipient_id,
+                    'low_user_id': min(sender_id, recipient_id),
+                    'high_user_id': max(sender_id, recipient_id),
+                    'status': rng.choices(statuses, weights)[0] if weights else statuses[0],
+                    'created_at': now,
+                    'updated_at': now,
+                }
+
+        for chunk in chunks(friends(), chunk_size):
+            insert_rows(connection, Friend.__table__, chunk)
+
+            insert_rows(connection, Friendship.__table__, [
+                row
+                for friend in chunk if friend['status'] == FriendStatus.Accepted
+                for row in (
+                    {'user_id': friend['sender_id'], 'friend_id': friend['recipient_id'], 'created_at': now},
+                    {'user_id': friend['recipient_id'], 'friend_id': friend['sender_id'], 'created_at': now},
+                )
+            ])
+
+        update_friend_counts(connection)
+
+    return user_ids
@@ -0,0 +1,271 @@
+"""
+Drives the app in process through TestClient against a synthetic dataset, and reports the
+throughput, latency percentiles and queries per request of its main endpoints as JSON, so
+reports of two commits can be diffed. The app is pointed at the scratch database given,
+which must not contain users yet, e.g.
+python -m app.benchmarks.endpoints --database-url sqlite:////tmp/benchmark.db > report.json
+"""
+import argparse
+import contextlib
+import json
+import random
+import re
+import statistics
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, SQLModel, create_engine, func, select
+
+from app import auth, database, deps
+from app.benchmarks.dataset import create_graph
+from app.benchmarks.stats import summary
+from app.config import settings, get_database_url, get_async_database_url
+from app.main import app
+from app.models import Friend, FriendStatus, User
+from app.services import user_service
+
+# password of every user of the dataset
+PASSWORD = 'BenchmarkPassword'
+
+# query count of the Server-Timing header set by main.add_db_stats_header
+_QUERIES_PATTERN = re.compile(r'desc="(\d+) queries"')
+
+
+class Recorder:
+    """
+    Records the latency and query count of the requests of one scenario. Requests are
+    sent one at a time, so the throughput is the inverse of the mean latency
+    """
+
+    def __init__(self, client: TestClient):
+        self.client = client
+        self.latencies: list[float] = []
+        self.queries: list[int] = []
+
+    def request(self, method: str, url: str, expected_status: int = 200, **kwargs) -> httpx.Response:
+        started_at = time.perf_counter()
+        response = self.client.request(method, url, **kwargs)
+        self.latencies.append(time.perf_counter() - started_at)
+
+        if response.status_code != expected_status:
+            raise RuntimeError(f'{method} {url} returned {response.status_code}: {response.text}')
+
+        match = _QUERIES_PATTERN.search(response.headers.get('server-timing', ''))
+        self.queries.append(int(match.group(1)) if match else 0)
+        return response
+
+    def report(self) -> dict:
+        if not self.latencies:
+            return {'requests': 0}
+
+        return {
+            'requests': len(self.latencies),
+            'requests_per_second': len(self.latencies) / sum(self.latencies),
+            **summary(self.latencies),
+            'queries_per_request': statistics.fmean(self.queries),
+        }
+
+
+def _headers(user_id: int) -> dict[str, str]:
+    return {'Authorization': f'Bearer {auth.create_access_token(subject=user_id)}'}
+
+
+def _register(client: TestClient, requests: int) -> dict:
+    recorder = Recorder(client)
+    for index in range(requests):
+        recorder.request('POST', '/users/register', expected_status=201, json={
+            'name': f'Registered {index}',
+            'email': f'registered{index}@benchmark.io',
+            'password': PASSWORD,
+        })
+    return recorder.report()
+
+
+def _login(client: TestClient, requests: int, users: int, rng: random.Random) -> dict:
+    recorder = Recorder(client)
+    for _ in range(requests):
+        recorder.request('POST', '/auth/login', data={
+            'username': f'user{rng.randrange(users)}@benchmark.io',
+            'password': PASSWORD,
+        })
+    return recorder.report()
+
+
+def _get(client: TestClient, requests: int, user_ids: list[int], rng: random.Random, url) -> dict:
+    recorder = Recorder(client)
+    for _ in range(requests):
+        recorder.request('GET', url() if callable(url) else url, headers=_headers(rng.choice(user_ids)))
+    return recorder.report()
+
+
+def _transition(client: TestClient, friends: list[tuple[int, int]], action: str) -> dict:
+    recorder = Recorder(client)
+    for friend_id, recipient_id in friends:
+        recorder.request('PUT', f'/friends/{friend_id}/{action}', headers=_headers(recipient_id))
+    return recorder.report()
+
+
+def _websocket_fanout(client: TestClient, requests: int, user_id: int, sockets: int) -> dict:
+    """
+    Updates the status of a user whose friends are connected, and measures both the
+    request and the time until every friend received the event
+    """
+    with Session(database.engine) as db:
+        friend_ids = user_service.get_friend_ids(db=db, user_id=user_id)[:sockets]
+
+    recorder = Recorder(client)
+    deliveries = []
+    with contextlib.ExitStack() as stack:
+        websockets = [
+            stack.enter_context(client.websocket_connect(
+                f'/ws/{friend_id}?token={auth.create_access_token(subject=friend_id)}'
+            ))
+            for friend_id in friend_ids
+        ]
+
+        headers = _headers(user_id)
+        for index in range(requests):
+            started_at = time.perf_counter()
+            recorder.request('PUT', '/users/me/update-status', headers=headers, json={
+                'new_status': f'Status {index}',
+            })
+            for websocket in websockets:
+                # the status changed event
+                websocket.receive_json()
+            deliveries.append(time.perf_counter() - started_at)
+
+    return {
+        'sockets': len(friend_ids),
+        **recorder.report(),
+        'delivery': summary(deliveries) if deliveries else None,
+    }
+
+
+def _use_database(database_url: str) -> None:
+    """
+    Points the app at the scratch database instead of the one it is configured with.
+    The engines are created with the same options as in app.database
+    :param database_url: scratch database url
+    """
+    settings.DATABASE_URL = database_url
+    engine = create_engine(get_database_url(), **database.get_engine_options(get_database_url()))
+    async_engine = create_async_engine(
+        get_async_database_url(),
+        **database.get_engine_options(get_async_database_url()),
+    ) if settings.DATABASE_ASYNC else None
+
+    # deps imports the engines by name, the other modules read them from app.database
+    for module in (database, deps):
+        module.engine = engine
+        module.async_engine = async_engine
+
+
+def run(
+        database_url: str,
+        users: int,
+        edges: int,
+        exponent: float,
+        pending: float,
+        declined: float,
+        requests: int,
+        sockets: int,
+        seed: int,
+) -> dict:
+    _use_database(database_url)
+    engine = database.engine
+    if engine.url.get_backend_name() == 'sqlite' and engine.url.database in (None, '', ':memory:'):
+        # every connection to an in-memory database gets a database of its own
+        raise SystemExit('The benchmark needs a sqlite file or a server database')
+
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as db:
+        if db.exec(select(func.count()).select_from(User)).one():
+            raise SystemExit('The benchmark needs a database without users')
+
+    started_at = time.perf_counter()
+    user_ids = create_graph(
+        engine,
+        users=users,
+        edges=edges,
+        seed=seed,
+        exponent=exponent,
+        status_weights={
+            FriendStatus.Accepted: 1 - pending - declined,
+            FriendStatus.Pending: pending,
+            FriendStatus.Declined: declined,
+        },
+        hashed_password=auth.get_password_hash(PASSWORD),
+    )
+    setup_seconds = time.perf_counter() - started_at
+
+    with Session(engine) as db:
+        friends = db.exec(select(func.count()).select_from(Friend)).one()
+        pending_friends = db.exec(
+            select(Friend.id, Friend.recipient_id).where(
+                Friend.status == FriendStatus.Pending,
+            ).order_by(Friend.id).limit(requests * 2)
+        ).all()
+
+    rng = random.Random(seed)
+    # the first users are the hubs of the power law graph
+    hub_id = user_ids[0]
+
+    with TestClient(app) as client:
+        scenarios = {
+            'register': _register(client, requests=requests),
+            'login': _login(client, requests=requests, users=users, rng=rng),
+            'users_list': _get(client, requests, user_ids, rng, '/users/list'),
+            'users_search': _get(
+                client, requests, user_ids, rng,
+                lambda: f'/users/list?query=User {rng.randrange(users)}',
+            ),
+            'friends_list': _get(client, requests, user_ids, rng, '/friends/list'),
+            'friends_list_hub': _get(client, requests, [hub_id], rng, '/friends/list'),
+            'accept': _transition(client, friends=pending_friends[::2], action='accept'),
+            'decline': _transition(client, friends=pending_friends[1::2], action='decline'),
+            'websocket_fanout': _websocket_fanout(client, requests=requests, user_id=hub_id, sockets=sockets),
+        }
+
+    return {
+        'database': engine.url.get_backend_name(),
+        'database_async': settings.DATABASE_ASYNC,
+        'users': users,
+        'friends': friends,
+        'exponent': exponent,
+        'seed': seed,
+        'setup_seconds': setup_seconds,
+        'scenarios': scenarios,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True, help='scratch database, it is written to')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--edges', type=int, default=100_000)
+    parser.add_argument('--exponent', type=float, default=1.0, help='skew of the power law friend graph')
+    parser.add_argument('--pending', type=float, default=0.1, help='share of pending friends')
+    parser.add_argument('--declined', type=float, default=0.1, help='share of declined friends')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--sockets', type=int, default=50, help='websockets receiving the fan-out')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report = run(
+        database_url=args.database_url,
+        users=args.users,
+        edges=args.edges,
+        exponent=args.exponent,
+        pending=args.pending,
+        declined=args.declined,
+        requests=args.requests,
+        sockets=args.sockets,
+        seed=args.seed,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmarks friend suggestions against a synthetic friendship graph.
+The graph is written to the database given, which must not contain users yet.
+"""
+import argparse
+import json
+import random
+import time
+
+from sqlmodel import Session, SQLModel, create_engine, func, select
+
+from app.benchmarks.dataset import create_graph
+from app.benchmarks.stats import summary
+from app.cache import friend_suggestion_cache
+from app.config import get_database_url
+from app.models import User
+from app.services import friend_service
+
+
+def run(database_url: str, users: int, edges: int, samples: int, seed: int) -> dict:
+    engine = create_engine(database_url)
+    SQLModel.metadata.create_all(engine)
+
+    with Session(engine) as db:
+        if db.exec(select(func.count()).select_from(User)).one():
+            raise SystemExit('The benchmark needs a database without users')
+
+    started_at = time.perf_counter()
+    user_ids = create_graph(engine, users=users, edges=edges, seed=seed)
+    setup_seconds = time.perf_counter() - started_at
+
+    rng = random.Random(seed)
+    sample_ids = [rng.choice(user_ids) for _ in range(samples)]
+
+    cold, cached = [], []
+    with Session(engine) as db:
+        for user_id in sample_ids:
+            # the first call queries the graph, the second one is served from the cache
+            friend_suggestion_cache.delete(user_id)
+            started_at = time.perf_counter()
+            friend_service.get_friend_suggestions(db=db, user_id=user_id)
+            cold.append(time.perf_counter() - started_at)
+
+            started_at = time.perf_counter()
+            friend_service.get_friend_suggestions(db=db, user_id=user_id)
+            cached.append(time.perf_counter() - started_at)
+
+    return {
+        'users': users,
+        'edges': edges,
+        'samples': samples,
+        'setup_seconds': setup_seconds,
+        'cold': summary(cold),
+        'cached': summary(cached),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url', default=None, help='scratch database, defaults to DATABASE_URL')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--edges', type=int, default=5_000_000)
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report = run(
+        database_url=args.database_url or get_database_url(),
+        users=args.users,
+        edges=args.edges,
+        samples=args.samples,
+        seed=args.seed,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
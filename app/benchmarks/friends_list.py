@@ -0,0 +1,125 @@
+"""
+Benchmarks the CPU time of the response path of a /friends/list page: returning the page for
+FastAPI to validate against the response model and encode with JSONResponse, like before,
+or with ORJSONResponse, against serialization.json_response.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.benchmarks.dataset import create_graph
+from app.models import FriendPublic, Page, User
+from app.serialization import json_response
+from app.services import friend_service
+
+
+def create_app(page: Page[FriendPublic]) -> FastAPI:
+    # both endpoints return the same page, fetched once, so only the response path is measured
+    app = FastAPI()
+    adapter = TypeAdapter(Page[FriendPublic])
+
+    @app.get('/validated', response_model=Page[FriendPublic])
+    async def validated():
+        return page
+
+    @app.get('/validated-orjson', response_model=Page[FriendPublic], response_class=ORJSONResponse)
+    async def validated_orjson():
+        return page
+
+    @app.get('/adapter', response_model=Page[FriendPublic])
+    async def adapter_serialized():
+        return json_response(adapter, page)
+
+    return app
+
+
+async def _get(app: FastAPI, path: str) -> int:
+    # calls the ASGI app directly, so client overhead is not measured
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [],
+        'client': ('benchmark', 0),
+        'server': ('benchmark', 80),
+    }
+    response = {}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+
+    await app(scope, receive, send)
+    return response['status']
+
+
+def _measure(app: FastAPI, path: str, requests: int) -> dict[str, float]:
+    async def serve():
+        for _ in range(requests):
+            assert await _get(app, path) == 200
+
+    started_at = time.process_time()
+    asyncio.run(serve())
+    cpu_seconds = time.process_time() - started_at
+
+    return {
+        'cpu_ms_per_request': cpu_seconds / requests * 1000,
+    }
+
+
+def run(limit: int, requests: int) -> dict:
+    engine = create_engine('sqlite://', poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+
+    # every user sends limit friend requests, so every user has at least limit friends
+    users = limit * 4
+    user_ids = create_graph(engine, users=users, edges=users * limit, seed=0)
+
+    with Session(engine) as db:
+        page = friend_service.get_user_friends(db=db, user=User(id=user_ids[0]), limit=limit)
+
+    app = create_app(page)
+    client = TestClient(app)
+    assert client.get('/validated').json() == client.get('/adapter').json()
+
+    # warm up both paths
+    for path in ('/validated', '/validated-orjson', '/adapter'):
+        _measure(app, path, requests=20)
+
+    return {
+        'limit': limit,
+        'requests': requests,
+        'validated': _measure(app, '/validated', requests=requests),
+        'validated_orjson': _measure(app, '/validated-orjson', requests=requests),
+        'adapter': _measure(app, '/adapter', requests=requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(json.dumps(run(limit=args.limit, requests=args.requests), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import statistics
+
+
+def percentile(samples: list[float], percentile: float) -> float:
+    samples = sorted(samples)
+    index = min(int(len(samples) * percentile / 100), len(samples) - 1)
+    return samples[index]
+
+
+def summary(samples: list[float]) -> dict[str, float]:
+    """
+    Summarizes durations in seconds as milliseconds
+    :param samples: durations in seconds
+    :return: mean, percentiles and max
+    """
+    return {
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': max(samples) * 1000,
+    }
@@ -0,0 +1,97 @@
+"""
+Benchmarks a page of the users list selected as User entities, like before
+user_service selected UserPublic columns, against the current column projection.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, col, create_engine, func, select
+
+from app.benchmarks.dataset import create_graph
+from app.models import User, UserPublic
+from app.services import user_service
+
+
+def _entity_page(db: Session, limit: int) -> list[UserPublic]:
+    statement = select(User).where(
+        User.is_active == True,
+    ).order_by(col(User.created_at).desc(), col(User.id).desc()).limit(limit + 1)
+
+    # the entities are serialized to UserPublic by the endpoint
+    return [UserPublic.model_validate(user) for user in db.exec(statement).all()[:limit]]
+
+
+def _projection_page(db: Session, limit: int) -> list[UserPublic]:
+    return user_service.get_active_users(db=db, limit=limit).items
+
+
+def _measure(engine, page: Callable[[Session, int], list[UserPublic]], limit: int, pages: int) -> dict[str, float]:
+    # every page gets its own session, like every request does
+    started_at = time.perf_counter()
+    for _ in range(pages):
+        with Session(engine) as db:
+            page(db, limit)
+    seconds = time.perf_counter() - started_at
+
+    tracemalloc.start()
+    with Session(engine) as db:
+        page(db, limit)
+        _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'rows_per_second': limit * pages / seconds,
+        'ms_per_page': seconds / pages * 1000,
+        'peak_kib_per_page': peak / 1024,
+    }
+
+
+def run(database_url: str | None, users: int, limit: int, pages: int) -> dict:
+    if database_url:
+        engine = create_engine(database_url)
+    else:
+        engine = create_engine('sqlite://', poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+
+    with Session(engine) as db:
+        if db.exec(select(func.count()).select_from(User)).one():
+            raise SystemExit('The benchmark needs a database without users')
+
+    create_graph(engine, users=users, edges=0, seed=0)
+
+    # warm up the statement caches of both queries
+    _measure(engine, _entity_page, limit=limit, pages=10)
+    _measure(engine, _projection_page, limit=limit, pages=10)
+
+    return {
+        'users': users,
+        'limit': limit,
+        'pages': pages,
+        'entities': _measure(engine, _entity_page, limit=limit, pages=pages),
+        'projection': _measure(engine, _projection_page, limit=limit, pages=pages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url', default=None, help='scratch database, defaults to an in-memory sqlite')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=1000)
+    args = parser.parse_args()
+
+    report = run(
+        database_url=args.database_url,
+        users=args.users,
+        limit=args.limit,
+        pages=args.pages,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
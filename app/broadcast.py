@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Sequence
+
+from .config import settings, get_database_url
+
+logger = logging.getLogger(__name__)
+
+# called with the client ids and message of every published message
+MessageHandler = Callable[[Sequence[int], str], Awaitable[None]]
+
+# postgres rejects notification payloads of 8000 bytes or more
+_MAX_PAYLOAD_SIZE = 7999
+# larger payloads are split in parts, sent as #<payload id>:<index>:<count>:<part>
+_PART_PREFIX = '#'
+
+
+def split_payload(payload: str, max_size: int = _MAX_PAYLOAD_SIZE) -> list[str]:
+    """
+    Splits a payload in notifications shorter than max_size bytes
+    :param payload: ascii payload
+    :param max_size: largest notification size
+    :return: the payload itself when it fits, else its parts
+    """
+    if len(payload) <= max_size:
+        return [payload]
+
+    payload_id = uuid.uuid4().hex
+    # room for the header of the part
+    size = max_size - len(payload_id) - 32
+    pieces = [payload[start:start + size] for start in range(0, len(payload), size)]
+    return [
+        f'{_PART_PREFIX}{payload_id}:{index}:{len(pieces)}:{piece}'
+        for index, piece in enumerate(pieces)
+    ]
+
+
+class BroadcastBackend(ABC):
+    """
+    Pub/sub backend delivering websocket messages to every subscribed connection manager,
+    whichever worker process they are running in
+    """
+
+    def __init__(self):
+        self._handlers: list[MessageHandler] = []
+
+    def subscribe(self, handler: MessageHandler) -> None:
+        """
+        Registers a handler called with every message published on the backend
+        :param handler: message handler
+        """
+        self._handlers.append(handler)
+
+    async def _dispatch(self, client_ids: Sequence[int], message: str) -> None:
+        results = await asyncio.gather(
+            *(handler(client_ids, message) for handler in self._handlers),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error('Broadcast handler failed', exc_info=result)
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, client_ids: Sequence[int], message: str) -> None:
+        """
+        Publishes a message for some clients to every subscriber
+        :param client_ids: ids of the clients the message is for
+        :param message: message
+        """
+
+
+class InMemoryBroadcastBackend(BroadcastBackend):
+    """
+    Delivers messages to subscribers of the same process only,
+    so it only suits a single worker
+    """
+
+    async def publish(self, client_ids: Sequence[int], message: str) -> None:
+        await self._dispatch(client_ids, message)
+
+
+class PostgresBroadcastBackend(BroadcastBackend):
+    """
+    Delivers messages through postgres LISTEN/NOTIFY, to the subscribers of every
+    worker connected to the same database. Postgres limits a notification payload
+    to 8000 bytes, so larger messages, like an event for the thousands of friends of
+    a user, are split in parts notified in one transaction and joined by the listeners.
+    When the LISTEN connection is lost, e.g. on a failover, it is reopened with an exponential
+    backoff. Messages published until it is back are not delivered to this worker
+    """
+
+    def __init__(self, dsn: str, channel: str, reconnect_delay: float = 0.5, max_reconnect_delay: float = 30):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._listen_connection = None
+        self._publish_pool = None
+        self._reconnect_task: asyncio.Task | None = None
+        # keeps a reference to dispatch tasks until they are done
+        self._tasks: set[asyncio.Task] = set()
+        # parts received of the payloads split in several notifications, by payload id
+        self._parts: dict[str, list[str | None]] = {}
+
+    async def connect(self) -> None:
+        import asyncpg
+
+        await self._listen()
+        self._publish_pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+
+    async def disconnect(self) -> None:
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+
+        if self._listen_connection is not None:
+            # cleared first, so closing it is not taken for a lost connection
+            connection, self._listen_connection = self._listen_connection, None
+            await connection.close()
+
+        if self._publish_pool is not None:
+            await self._publish_pool.close()
+            self._publish_pool = None
+
+    async def _listen(self) -> None:
+        import asyncpg
+
+        connection = await asyncpg.connect(self.dsn)
+        try:
+            await connection.add_listener(self.channel, self._on_notification)
+        except BaseException:
+            await connection.close()
+            raise
+
+        connection.add_termination_listener(self._on_connection_lost)
+        self._listen_connection = connection
+        # parts of payloads that were being received on the lost connection never complete
+        self._parts.clear()
+
+    def _on_connection_lost(self, connection) -> None:
+        if connection is not self._listen_connection:
+            # closed by disconnect
+            return
+
+        logger.warning('Broadcast LISTEN connection lost, reconnecting')
+        self._listen_connection = None
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = self.reconnect_delay
+        while True:
+            try:
+                await self._listen()
+            except Exception as e:
+                logger.warning('Broadcast LISTEN reconnection failed, retrying in %.1fs: %r', delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            else:
+                logger.info('Broadcast LISTEN connection restored')
+                self._reconnect_task = None
+                return
+
+    def _join_part(self, part: str) -> str | None:
+        payload_id, index, count, piece = part[len(_PART_PREFIX):].split(':', 3)
+        parts = self._parts.setdefault(payload_id, [None] * int(count))
+        parts[int(index)] = piece
+        if any(piece is None for piece in parts):
+            return None
+
+        del self._parts[payload_id]
+        return ''.join(parts)
+
+    def _on_notification(self, _connection, _pid: int, _channel: str, payload: str) -> None:
+        if payload.startswith(_PART_PREFIX):
+            payload = self._join_part(payload)
+            if payload is None:
+                # more parts to come
+                return
+
+        data = json.loads(payload)
+        task = asyncio.create_task(self._dispatch(data['client_ids'], data['message']))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def publish(self, client_ids: Sequence[int], message: str) -> None:
+        # one notification for all the clients, the json is ascii so its length is its size in bytes
+        payload = json.dumps({'client_ids': list(client_ids), 'message': message})
+        notifications = split_payload(payload)
+        if len(notifications) == 1:
+            await self._publish_pool.execute('SELECT pg_notify($1, $2)', self.channel, payload)
+            return
+
+        # the notifications of a transaction are delivered together, in order, once it commits
+        async with self._publish_pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.executemany(
+                    'SELECT pg_notify($1, $2)',
+                    [(self.channel, notification) for notification in notifications],
+                )
+
+
+def create_broadcast_backend() -> BroadcastBackend:
+    """
+    Creates the broadcast backend selected by the BROADCAST_BACKEND setting
+    :return: broadcast backend
+    """
+    if settings.BROADCAST_BACKEND == 'postgres':
+        return PostgresBroadcastBackend(
+            dsn=get_database_url(),
+            channel=settings.BROADCAST_CHANNEL,
+        )
+
+    return InMemoryBroadcastBackend()
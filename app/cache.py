@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+
+from .config import settings
+from .models import CurrentUser, FriendSuggestion
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Thread safe in-process LRU cache whose entries expire after a time to live.
+    Once max_size entries are cached, the least recently used one is evicted
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: K) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SharedCacheBackend(ABC):
+    """
+    Cache shared by every worker, e.g. redis
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> str | None:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+
+class RedisCacheBackend(SharedCacheBackend):
+    """
+    Shared cache backed by redis, it needs the redis package to be installed
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio
+
+        self._client = redis.asyncio.Redis.from_url(url)
+
+    async def get(self, key: str) -> str | None:
+        value = await self._client.get(key)
+        return value.decode() if value is not None else None
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self._client.set(key, value, px=max(int(ttl * 1000), 1))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(key)
+
+
+class PrincipalCache:
+    """
+    Cache of authenticated users keyed by access token, so authenticated requests
+    usually skip both decoding the token and fetching the user from the database.
+    Entries are invalidated when the user changes, see invalidate_user.
+    Without a shared backend, invalidations only reach the cache of this worker.
+    With a shared backend, users are cached by id across workers, and a token only maps
+    to the user id locally, so an invalidation on any worker reaches every worker
+    """
+
+    def __init__(self, max_size: int, ttl: float, shared_backend: SharedCacheBackend | None = None):
+        self.ttl = ttl
+        self.shared_backend = shared_backend
+        # token -> (user id, user version, principal)
+        self._tokens: TTLCache[str, tuple[int, int, CurrentUser]] = TTLCache(max_size=max_size, ttl=ttl)
+        # user id -> (expires at, version), the version is bumped on every invalidation of a user,
+        # entries cached with another version are stale. Versions are never evicted early, or entries
+        # cached before an invalidation would be valid again. A version only has to outlive them, so
+        # it expires after ttl, and as every version lives for ttl the dict is in expiry order
+        self._user_versions: OrderedDict[int, tuple[float, int]] = OrderedDict()
+        # versions are unique across users and expiries, so an expired version is never reused
+        self._last_version = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _shared_key(user_id: int) -> str:
+        return f'principal:{user_id}'
+
+    def _get_version(self, user_id: int) -> int:
+        entry = self._user_versions.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return 0
+
+        return entry[1]
+
+    async def get_by_token(self, token: str) -> CurrentUser | None:
+        """
+        Gets the user cached for an access token
+        :param token: access token
+        :return: user if cached else None
+        """
+        entry = self._tokens.get(token)
+        if entry is None:
+            return None
+
+        user_id, version, principal = entry
+        if self.shared_backend is not None:
+            # the shared entry is deleted by invalidate_user, whichever worker calls it
+            return await self.get_by_user_id(user_id)
+
+        if version != self._get_version(user_id):
+            self._tokens.delete(token)
+            return None
+
+        return principal
+
+    async def get_by_user_id(self, user_id: int) -> CurrentUser | None:
+        """
+        Gets a user cached in the shared backend
+        :param user_id: user id
+        :return: user if cached else None
+        """
+        if self.shared_backend is None:
+            return None
+
+        try:
+            value = await self.shared_backend.get(self._shared_key(user_id))
+        except Exception:
+            logger.exception('Failed to read principal from shared cache')
+            return None
+
+        if value is None:
+            return None
+
+        return CurrentUser.model_validate_json(value)
+
+    async def set(self, token: str, principal: CurrentUser, expires_at: float | None = None) -> None:
+        """
+        Caches the user authenticated with an access token
+        :param token: access token
+        :param principal: authenticated user
+        :param expires_at: unix time the token expires at, the entry never outlives the token
+        """
+        ttl = self.ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+
+        version = self._get_version(principal.id)
+        self._tokens.set(token, (principal.id, version, principal), ttl=ttl)
+
+        if self.shared_backend is not None:
+            try:
+                await self.shared_backend.set(
+                    self._shared_key(principal.id),
+                    principal.model_dump_json(),
+                    ttl=self.ttl,
+                )
+            except Exception:
+                logger.exception('Failed to write principal to shared cache')
+
+    async def invalidate_user(self, user_id: int) -> None:
+        """
+        Removes every cached entry of a user, it must be called when the user changes
+        :param user_id: user id
+        """
+        with self._lock:
+            # drop the expired versions, the oldest come first
+            now = time.monotonic()
+            while self._user_versions and next(iter(self._user_versions.values()))[0] <= now:
+                self._user_versions.popitem(last=False)
+
+            self._last_version += 1
+            self._user_versions.pop(user_id, None)
+            self._user_versions[user_id] = (now + self.ttl, self._last_version)
+
+        if self.shared_backend is not None:
+            try:
+                await self.shared_backend.delete(self._shared_key(user_id))
+            except Exception:
+                logger.exception('Failed to delete principal from shared cache')
+
+    def clear(self) -> None:
+        self._tokens.clear()
+        with self._lock:
+            self._user_versions.clear()
+
+
+def create_shared_cache_backend() -> SharedCacheBackend | None:
+    """
+    Creates the shared cache backend configured with AUTH_CACHE_REDIS_URL
+    :return: shared cache backend or None when not configured
+    """
+    if settings.AUTH_CACHE_REDIS_URL:
+        return RedisCacheBackend(url=settings.AUTH_CACHE_REDIS_URL)
+
+    return None
+
+
+principal_cache = PrincipalCache(
+    max_size=settings.AUTH_CACHE_MAX_SIZE,
+    ttl=settings.AUTH_CACHE_TTL,
+    shared_backend=create_shared_cache_backend(),
+)
+
+
+# friend suggestions by user id, see friend_service.get_friend_suggestions
+friend_suggestion_cache: TTLCache[int, list[FriendSuggestion]] = TTLCache(
+    max_size=settings.FRIEND_SUGGESTIONS_CACHE_MAX_SIZE,
+    ttl=settings.FRIEND_SUGGESTIONS_CACHE_TTL,
+)
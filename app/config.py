@@ -1,5 +1,6 @@
 import secrets
 # from functools import lru_cache
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -20,6 +21,77 @@ class Settings(BaseSettings):
     # 60 minutes * 24 hours * 8 days = 8 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
     SECURE_SSL_REDIRECT: bool = False
+    # when enabled, requests use an AsyncSession backed by an async driver
+    # (asyncpg for postgres, aiosqlite for sqlite), otherwise the blocking psycopg2
+    # session is used, with its queries run on the threadpool
+    DATABASE_ASYNC: bool = False
+    # connection pool of the database engine, sqlite keeps the SQLAlchemy defaults.
+    # connections idle for RECYCLE seconds are replaced, and pre-ping replaces
+    # connections the server has closed before handing them out
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30
+    DATABASE_POOL_RECYCLE: int = 1800
+    DATABASE_POOL_PRE_PING: bool = True
+    # milliseconds a postgres statement may run before it is cancelled, 0 disables it
+    DATABASE_STATEMENT_TIMEOUT: int = 0
+    # the demo users are created on startup when the database has no users yet,
+    # larger datasets are imported with python -m app.seed
+    DATABASE_SEED_ON_STARTUP: bool = True
+    # records the statements of every request, see app.profiler. Selects slower than
+    # SLOW_QUERY_MS are explained, and statements repeated THRESHOLD times are flagged as N+1
+    SQL_PROFILER: bool = False
+    SQL_PROFILER_SLOW_QUERY_MS: float = 100
+    SQL_PROFILER_REPEATED_QUERY_THRESHOLD: int = 3
+    # the lag of the event loop is measured every INTERVAL seconds, and the stack of the loop
+    # is captured when it is blocked for THRESHOLD_MS, see app.loop_monitor
+    LOOP_MONITOR: bool = False
+    LOOP_MONITOR_INTERVAL: float = 0.1
+    LOOP_MONITOR_THRESHOLD_MS: float = 100
+    LOOP_MONITOR_MAX_SITES: int = 50
+    # token the prometheus scraper sends as a bearer token to /internal/metrics/prometheus,
+    # the endpoint is disabled while it is not set
+    METRICS_SCRAPE_TOKEN: str | None = None
+    # bcrypt runs on a bounded worker pool instead of the event loop,
+    # requests are rejected with 503 once MAX_QUEUE jobs are waiting
+    PASSWORD_HASHER_EXECUTOR: Literal['thread', 'process'] = 'thread'
+    PASSWORD_HASHER_WORKERS: int = 4
+    PASSWORD_HASHER_MAX_QUEUE: int = 64
+    PASSWORD_HASHER_RETRY_AFTER: int = 1
+    # largest page size accepted by list endpoints
+    PAGINATION_MAX_LIMIT: int = 100
+    # most user ids accepted by the friend relationships endpoint
+    FRIEND_RELATIONSHIPS_MAX_IDS: int = 100
+    # seconds to wait for a websocket send before dropping the connection
+    WEBSOCKET_SEND_TIMEOUT: float = 5
+    # messages queued per websocket connection, slower clients are disconnected
+    WEBSOCKET_SEND_BUFFER_SIZE: int = 100
+    # the oldest connection of a user is closed when they open one more
+    WEBSOCKET_MAX_CONNECTIONS_PER_USER: int = 5
+    # protocol level pings sent by uvicorn every PING_INTERVAL seconds, connections that do not
+    # answer within PING_TIMEOUT seconds are closed, see app.worker
+    WEBSOCKET_PING_INTERVAL: float = 20
+    WEBSOCKET_PING_TIMEOUT: float = 20
+    # clients connecting with heartbeat=true are also sent a ping message every interval,
+    # and reaped after idle timeout seconds without a frame
+    WEBSOCKET_HEARTBEAT_INTERVAL: float = 20
+    WEBSOCKET_IDLE_TIMEOUT: float = 60
+    # backend relaying websocket messages between workers, the memory
+    # backend only reaches sockets connected to the same worker
+    BROADCAST_BACKEND: Literal['memory', 'postgres'] = 'memory'
+    BROADCAST_CHANNEL: str = 'websocket_broadcast'
+    # authenticated users are cached by access token for AUTH_CACHE_TTL seconds,
+    # and across workers in redis when AUTH_CACHE_REDIS_URL is set
+    AUTH_CACHE_TTL: int = 60
+    AUTH_CACHE_MAX_SIZE: int = 10000
+    AUTH_CACHE_REDIS_URL: str | None = None
+    # friend suggestions of a user are cached for TTL seconds, and dropped when
+    # a friendship of the user or of one of their friends changes
+    FRIEND_SUGGESTIONS_CACHE_TTL: int = 300
+    FRIEND_SUGGESTIONS_CACHE_MAX_SIZE: int = 10000
+    FRIEND_SUGGESTIONS_MAX_LIMIT: int = 50
+    # events waiting to be pushed over websocket, new events are dropped once full
+    EVENT_QUEUE_MAX_SIZE: int = 10000
 
 
 settings = Settings()
@@ -36,6 +108,22 @@ def get_database_url() -> str:
     return database_url
 
 
+def get_async_database_url() -> str:
+    """
+    Returns the database url with the async driver of its dialect,
+    e.g. postgresql://... becomes postgresql+asyncpg://...
+    :return: async database url
+    """
+    database_url = get_database_url()
+
+    if database_url.startswith('postgresql://'):
+        database_url = database_url.replace('postgresql://', 'postgresql+asyncpg://', 1)
+    elif database_url.startswith('sqlite://'):
+        database_url = database_url.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+
+    return database_url
+
+
 # @lru_cache
 # def get_settings():
 #     """
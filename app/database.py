@@ -1,7 +1,17 @@
-from sqlmodel import create_engine, Session
+import time
+from typing import Any, Awaitable, Callable, TypeVar
 
-from . import auth
-from .config import get_database_url
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.util import await_only
+from sqlmodel import create_engine, Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from anyio import from_thread
+from starlette.concurrency import run_in_threadpool
+
+from . import auth, metrics, profiler
+from .config import settings, get_database_url, get_async_database_url
 
 # make sure all SQLModel models are imported (app.models) before initializing DB
 # otherwise, SQLModel might fail to initialize relationships properly
@@ -9,13 +19,228 @@ from .config import get_database_url
 from .models import *
 
 
+_T = TypeVar('_T')
+
+
+def get_engine_options(database_url: str) -> dict[str, Any]:
+    """
+    Builds the pool and connection options of an engine from the settings
+    :param database_url: database url of the engine
+    :return: keyword arguments for create_engine
+    """
+    if database_url.startswith('sqlite'):
+        # sqlite pools are picked by SQLAlchemy, and in-memory ones take no sizing
+        return {}
+
+    options: dict[str, Any] = {
+        'pool_size': settings.DATABASE_POOL_SIZE,
+        'max_overflow': settings.DATABASE_MAX_OVERFLOW,
+        'pool_timeout': settings.DATABASE_POOL_TIMEOUT,
+        'pool_recycle': settings.DATABASE_POOL_RECYCLE,
+        'pool_pre_ping': settings.DATABASE_POOL_PRE_PING,
+    }
+
+    if settings.DATABASE_STATEMENT_TIMEOUT and database_url.startswith('postgresql'):
+        if '+asyncpg' in database_url:
+            options['connect_args'] = {
+                'server_settings': {'statement_timeout': str(settings.DATABASE_STATEMENT_TIMEOUT)},
+            }
+        else:
+            options['connect_args'] = {
+                'options': f'-c statement_timeout={settings.DATABASE_STATEMENT_TIMEOUT}',
+            }
+
+    return options
+
+
+def get_pool_stats(engine: Engine) -> dict[str, Any]:
+    """
+    Returns the connection counts of the engine pool, pools that do not keep connections report none
+    :param engine: database engine
+    :return: pool stats
+    """
+    pool = engine.pool
+    stats: dict[str, Any] = {'pool': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        # SingletonThreadPool has a size attribute rather than a method
+        value = getattr(pool, name, None)
+        if callable(value):
+            stats[name] = value()
+
+    return stats
+
+
 # create database engine
-engine = create_engine(get_database_url())
+engine = create_engine(get_database_url(), **get_engine_options(get_database_url()))
+
+# create async database engine, only when enabled so the async driver
+# is not required for the default sync setup
+async_engine = create_async_engine(
+    get_async_database_url(),
+    **get_engine_options(get_async_database_url()),
+) if settings.DATABASE_ASYNC else None
+
+# pools without a checkout count, like the NullPool of sqlite files, report 0
+metrics.db_pool_checked_out.set_function(
+    lambda: get_pool_stats(async_engine.sync_engine if async_engine is not None else engine).get('checkedout', 0)
+)
+
+
+class SessionStats:
+    """
+    Database usage of a request session
+    """
+
+    def __init__(self):
+        # connections checked out from the pool, and seconds spent waiting for them
+        self.checkouts = 0
+        self.checkout_wait = 0.0
+        # statements executed, and seconds spent executing them
+        self.queries = 0
+        self.db_time = 0.0
+        # every statement, when the profiler is enabled
+        self.profile = profiler.create_profile()
+
+    def server_timing(self) -> str:
+        """
+        Formats the stats as a Server-Timing header value
+        :return: header value
+        """
+        return (
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+            f'db-checkout;dur={self.checkout_wait * 1000:.1f};desc="{self.checkouts} checkouts"'
+        )
+
+
+class RequestSession(Session):
+    """
+    Session of a request. Like any session it only checks out a connection from the pool
+    on its first query, and release() hands the connection back as soon as the work is done
+    instead of holding it until the response is sent. Objects are not expired on release,
+    so they can still be serialized without checking out the connection again.
+    Database usage is recorded in stats
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        kwargs.setdefault('expire_on_commit', False)
+        super().__init__(*args, **kwargs)
+        self.stats = SessionStats()
+        self._bind_requested_at: float | None = None
+
+    def get_bind(self, *args: Any, **kwargs: Any):
+        # called right before a connection is checked out for the transaction
+        self._bind_requested_at = time.perf_counter()
+        return super().get_bind(*args, **kwargs)
+
+    def release(self) -> None:
+        """
+        Ends the transaction left open by reads, which returns its connection to the pool.
+        A transaction with pending changes is left alone
+        """
+        if self.in_transaction() and not (self.new or self.dirty or self.deleted):
+            self.commit()
+
+
+@event.listens_for(RequestSession, 'after_begin')
+def _on_session_begin(session: RequestSession, _transaction, connection):
+    stats = session.stats
+    stats.checkouts += 1
+    if session._bind_requested_at is not None:
+        wait = time.perf_counter() - session._bind_requested_at
+        stats.checkout_wait += wait
+        metrics.db_checkout_wait_seconds.observe(wait)
+        session._bind_requested_at = None
+
+    # statements executed on the connection are counted in the stats of the session
+    connection.info['session_stats'] = stats
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _on_before_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany):
+    if 'session_stats' in conn.info:
+        conn.info['query_started_at'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _on_after_cursor_execute(conn, _cursor, statement, parameters, _context, executemany):
+    stats = conn.info.get('session_stats')
+    started_at = conn.info.pop('query_started_at', None)
+    if stats is not None and started_at is not None:
+        duration = time.perf_counter() - started_at
+        stats.queries += 1
+        stats.db_time += duration
+        if stats.profile is not None and not executemany:
+            stats.profile.record(conn, statement, parameters, duration)
+
+
+@event.listens_for(Engine, 'engine_connect')
+def _on_engine_connect(conn):
+    # connection info outlives the checkout, so it must not carry the stats of a previous session
+    conn.info.pop('session_stats', None)
+    conn.info.pop('query_started_at', None)
+
+
+def _run_and_release(session: Session, fn: Callable[..., _T], kwargs: dict[str, Any]) -> _T:
+    try:
+        result = fn(db=session, **kwargs)
+    except BaseException:
+        # work flushed before the error must not be committed by a later release
+        session.rollback()
+        raise
+
+    if isinstance(session, RequestSession):
+        session.release()
+    return result
+
+
+async def run_in_session(
+        db: Session | AsyncSession,
+        fn: Callable[..., _T],
+        **kwargs: Any,
+) -> _T:
+    """
+    Runs a sync service function against the given session without blocking the event loop.
+    For an AsyncSession, the function runs through run_sync, so every query it issues is
+    awaited on the async driver. For a sync session, it runs on the threadpool.
+    :param db: sync or async database session
+    :param fn: service function accepting the session as the db keyword argument
+    :param kwargs: other keyword arguments passed to fn
+    :return: the result of fn
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(_run_and_release, fn, kwargs)
+
+    return await run_in_threadpool(_run_and_release, db, fn, kwargs)
+
+
+def wait_in_session(db: Session | AsyncSession, fn: Callable[..., Awaitable[_T]]) -> Callable[..., _T]:
+    """
+    Wraps a coroutine function, so a service function run with run_in_session can call it
+    and wait for its result. The connection left open by reads is released before waiting.
+    :param db: sync or async database session given to run_in_session
+    :param fn: coroutine function
+    :return: sync function returning the result of fn
+    """
+    session = db.sync_session if isinstance(db, AsyncSession) else db
+
+    def wait(*args: Any) -> _T:
+        if isinstance(session, RequestSession):
+            session.release()
+
+        if isinstance(db, AsyncSession):
+            # run_sync functions run in a greenlet on the event loop
+            return await_only(fn(*args))
+
+        # run_in_threadpool functions run in a worker thread
+        return from_thread.run(fn, *args)
+
+    return wait
 
 
 def init_db() -> None:
     with Session(engine) as session:
-        if session.query(User).count() == 0:
+        # an existence check, counting the users scans the whole table
+        if session.exec(select(User.id).limit(1)).first() is None:
             bob = User(
                 name='Jose',
                 email='jose@getwheel.io',
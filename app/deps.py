@@ -1,14 +1,21 @@
-from collections.abc import Generator
-from typing import Annotated, Type
+import secrets
+from collections.abc import AsyncGenerator, Generator
+from typing import Annotated
 
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import Depends, HTTPException, Query, status
+from fastapi.requests import HTTPConnection
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordBearer
 from jwt import InvalidTokenError
 from pydantic import ValidationError
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .database import engine
-from .models import User, TokenPayload
+from .cache import principal_cache
+from .config import settings
+from .database import RequestSession, engine, async_engine
+from .models import CurrentUser, TokenPayload
+from .pagination import Cursor, decode_cursor
+from .services import async_user_service
 
 from . import auth
 
@@ -17,27 +24,60 @@ oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl='/auth/access-token',
 )
 
+scrape_token_scheme = HTTPBearer(
+    auto_error=False,
+)
+
 
-def get_db() -> Generator[Session, None, None]:
+def get_db(request: HTTPConnection) -> Generator[Session, None, None]:
     """
     Creates an instance of the db session and yields the session object.
+    No connection is checked out until the session is first queried,
+    and its database usage is recorded in request.state.db_stats.
+    :param request: current request or websocket
     :return: a generator yielding the session object.
     """
-    with Session(engine) as session:
+    with RequestSession(engine) as session:
+        request.state.db_stats = session.stats
+        yield session
+
+
+async def get_async_db(request: HTTPConnection) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Creates an instance of the async db session and yields the session object.
+    Objects are not expired on commit, so they can be serialized without implicit IO.
+    Like get_db, its database usage is recorded in request.state.db_stats.
+    :param request: current request or websocket
+    :return: an async generator yielding the session object.
+    """
+    async with AsyncSession(async_engine, sync_session_class=RequestSession, expire_on_commit=False) as session:
+        request.state.db_stats = session.sync_session.stats
         yield session
 
 
 DatabaseDep = Annotated[Session, Depends(get_db)]
+AsyncDatabaseDep = Annotated[AsyncSession, Depends(get_async_db)]
+
+# session dependency used by the routers, selected by the DATABASE_ASYNC setting
+SessionDep = AsyncDatabaseDep if settings.DATABASE_ASYNC else DatabaseDep
+
 TokenDep = Annotated[str, Depends(oauth2_scheme)]
 
 
-def get_current_user(db: DatabaseDep, token: TokenDep) -> Type[User]:
+async def get_principal(db: Session | AsyncSession, token: str) -> CurrentUser:
     """
-    Gets and returns the current user using the authorization token provided
+    Gets and returns the active user an access token was issued to. Used by get_current_user,
+    and by websocket handshakes, which cannot send the authorization header
     :param db: database session
-    :param token: authorization token
-    :return: the current user
+    :param token: access token
+    :return: the user of the token
+    :raises HTTPException: if the token is invalid, or its user is missing or inactive
     """
+    # only active users are cached, so a cached user is good to go
+    principal = await principal_cache.get_by_token(token)
+    if principal:
+        return principal
+
     try:
         # decode access token
         payload = auth.decode_access_token(
@@ -47,23 +87,31 @@ def get_current_user(db: DatabaseDep, token: TokenDep) -> Type[User]:
         # create token payload with decoded data
         token_data = TokenPayload(**payload)
 
-        # retrieve user from db using the sub
-        user = db.get(User, token_data.sub)
-
-        if not user:
-            # raise a not found exception if the user was not found
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail='User not found',
+        # retrieve user from the shared cache, or from db using the sub
+        principal = await principal_cache.get_by_user_id(token_data.sub)
+        if not principal:
+            user = await async_user_service.get_user_by_id(
+                db=db,
+                user_id=token_data.sub,
             )
 
-        if not user.is_active:
+            if not user:
+                # raise a not found exception if the user was not found
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail='User not found',
+                )
+
+            principal = CurrentUser.model_validate(user)
+
+        if not principal.is_active:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail='User is inactive',
             )
 
-        return user
+        await principal_cache.set(token, principal, expires_at=payload.get('exp'))
+        return principal
     except (InvalidTokenError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -71,4 +119,96 @@ def get_current_user(db: DatabaseDep, token: TokenDep) -> Type[User]:
         )
 
 
-CurrentUserDep = Annotated[User, Depends(get_current_user)]
+async def get_current_user(db: SessionDep, token: TokenDep) -> CurrentUser:
+    """
+    Gets and returns the current user using the authorization token provided
+    :param db: database session
+    :param token: authorization token
+    :return: the current user
+    """
+    return await get_principal(db=db, token=token)
+
+
+# the current user is a CurrentUser rather than a User, so it is the same whether it comes
+# from the cache or the database. Services updating the user take its id
+CurrentUserDep = Annotated[CurrentUser, Depends(get_current_user)]
+
+
+def get_current_superuser(user: CurrentUserDep) -> CurrentUser:
+    """
+    Gets and returns the current user, if they are a superuser
+    :param user: current user
+    :return: the current user
+    """
+    if not user.is_superuser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Superuser privileges required',
+        )
+
+    return user
+
+
+SuperUserDep = Annotated[CurrentUser, Depends(get_current_superuser)]
+
+
+def verify_scrape_token(
+        credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(scrape_token_scheme)],
+) -> None:
+    """
+    Checks that the request comes from the metrics scraper, which authenticates with
+    the METRICS_SCRAPE_TOKEN setting instead of a user access token
+    :param credentials: bearer token of the request
+    """
+    if not settings.METRICS_SCRAPE_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Not Found',
+        )
+
+    if credentials is None or not secrets.compare_digest(
+            credentials.credentials.encode(),
+            settings.METRICS_SCRAPE_TOKEN.encode(),
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Invalid scrape token',
+        )
+
+
+ScrapeTokenDep = Annotated[None, Depends(verify_scrape_token)]
+
+
+class Pagination:
+    """
+    Keyset pagination parameters of list endpoints
+    """
+
+    def __init__(self, cursor: Cursor | None, limit: int):
+        self.cursor = cursor
+        self.limit = limit
+
+
+def get_pagination(
+        cursor: str | None = Query(
+            default=None,
+            description='next_cursor returned with the previous page, omit it to get the first page',
+        ),
+        limit: int = Query(
+            default=50,
+            ge=1,
+            le=settings.PAGINATION_MAX_LIMIT,
+            description='Page size',
+        ),
+) -> Pagination:
+    """
+    Reads and decodes the pagination query parameters. A malformed cursor raises InvalidCursor,
+    answered with 400 by the app, like a cursor of another list rejected by the services
+    :param cursor: encoded cursor
+    :param limit: page size
+    :return: pagination parameters
+    """
+    return Pagination(cursor=decode_cursor(cursor) if cursor else None, limit=limit)
+
+
+PaginationDep = Annotated[Pagination, Depends(get_pagination)]
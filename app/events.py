@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from typing import Sequence
+
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from . import database
+from .config import settings
+from .models import Event, EventType, Friend, FriendPublic, User, UserPublic
+from .services import async_user_service, user_service
+from .websocket import manager
+
+logger = logging.getLogger(__name__)
+
+
+def create_friend_event(event_type: EventType, friend: Friend) -> Event:
+    """
+    Creates a friend event
+    :param event_type: one of the friend event types
+    :param friend: friend record the event is about
+    :return: event
+    """
+    return Event(
+        type=event_type,
+        data=FriendPublic.model_validate(friend).model_dump(mode='json'),
+    )
+
+
+def create_status_changed_event(user: User) -> Event:
+    """
+    Creates a status changed event
+    :param user: user whose status changed
+    :return: event
+    """
+    return Event(
+        type=EventType.StatusChanged,
+        data=UserPublic.model_validate(user).model_dump(mode='json'),
+    )
+
+
+def _get_friend_ids_sync(user_id: int) -> list[int]:
+    with Session(database.engine) as db:
+        return user_service.get_friend_ids(db=db, user_id=user_id)
+
+
+async def _get_friend_ids(user_id: int) -> list[int]:
+    if database.async_engine is not None:
+        async with AsyncSession(database.async_engine) as db:
+            return await async_user_service.get_friend_ids(db=db, user_id=user_id)
+
+    return await run_in_threadpool(_get_friend_ids_sync, user_id)
+
+
+class EventPublisher:
+    """
+    Pushes events to the websocket connections of users. Events are queued by the
+    request handlers once their changes are committed, and are delivered by a
+    background task, so the response is never delayed by the fan-out
+    """
+
+    def __init__(self, max_queue_size: int):
+        self._queue: asyncio.Queue[tuple[Event, Sequence[int], int | None]] = asyncio.Queue(
+            maxsize=max_queue_size,
+        )
+        self._task: asyncio.Task | None = None
+        self.dropped = 0
+
+    def _put(self, event: Event, user_ids: Sequence[int], friends_of: int | None) -> None:
+        try:
+            self._queue.put_nowait((event, user_ids, friends_of))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning('Event queue is full, dropping %s event', event.type.value)
+
+    def publish(self, event: Event, user_ids: Sequence[int]) -> None:
+        """
+        Queues an event for the given users
+        :param event: event
+        :param user_ids: ids of the users to push the event to
+        """
+        self._put(event, user_ids, None)
+
+    def publish_to_friends(self, event: Event, user_id: int) -> None:
+        """
+        Queues an event for the friends of a user, they are looked up off the request path
+        :param event: event
+        :param user_id: id of the user whose friends the event is pushed to
+        """
+        self._put(event, (), user_id)
+
+    async def _deliver(self, event: Event, user_ids: Sequence[int], friends_of: int | None) -> None:
+        if friends_of is not None:
+            user_ids = await _get_friend_ids(friends_of)
+
+        await manager.broadcast_many(user_ids, event.model_dump_json())
+
+    async def _run(self) -> None:
+        while True:
+            event, user_ids, friends_of = await self._queue.get()
+            try:
+                await self._deliver(event, user_ids, friends_of)
+            except Exception:
+                logger.exception('Failed to deliver %s event', event.type.value)
+            finally:
+                self._queue.task_done()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+publisher = EventPublisher(
+    max_queue_size=settings.EVENT_QUEUE_MAX_SIZE,
+)
@@ -0,0 +1,194 @@
+"""
+Event loop lag monitor. A task on the loop measures how late its timer fires, and a sidecar
+thread snapshots the stack of the loop thread while it is blocked, so blocking calls made by
+async handlers, like sync database queries or bcrypt, can be ranked by call site.
+"""
+import asyncio
+import logging
+import os
+import selectors
+import sys
+import threading
+import time
+import traceback
+from typing import Any
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# frames of the app are the call sites stalls are attributed to, the monitor itself excluded
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_DIR = os.path.dirname(_APP_DIR)
+
+
+def _is_app_frame(frame: traceback.FrameSummary) -> bool:
+    return frame.filename.startswith(_APP_DIR) and frame.filename != __file__
+
+
+def _format_frame(frame: traceback.FrameSummary) -> str:
+    # paths relative to the project, or to the import path of libraries
+    path = frame.filename
+    if path.startswith(_PROJECT_DIR + os.sep):
+        path = os.path.relpath(path, _PROJECT_DIR)
+    else:
+        for entry in sorted(filter(None, sys.path), key=len, reverse=True):
+            if path.startswith(entry + os.sep):
+                path = os.path.relpath(path, entry)
+                break
+
+    return f'{path}:{frame.lineno} in {frame.name}'
+
+
+class BlockingSite:
+    """
+    Call site of the app the loop was blocked in, with the stalls attributed to it
+    """
+
+    def __init__(self, site: str, blocked_in: str, stack: list[str]):
+        self.site = site
+        # innermost frame and whole stack of the latest stall, the innermost frame is usually in a library
+        self.blocked_in = blocked_in
+        self.stack = stack
+        self.stalls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'site': self.site,
+            'blocked_in': self.blocked_in,
+            'stalls': self.stalls,
+            'total_seconds': self.total_seconds,
+            'max_seconds': self.max_seconds,
+            'stack': self.stack,
+        }
+
+
+class LoopMonitor:
+    """
+    Measures the lag of the event loop every interval seconds. When the loop has not run
+    the monitor task for threshold seconds past the interval, the sidecar thread snapshots
+    the stack of the loop thread with sys._current_frames, and once the loop runs again the
+    whole stall is attributed to the innermost app frame of that stack
+    """
+
+    def __init__(self, interval: float, threshold: float, max_sites: int = 50, stack_depth: int = 30):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_sites = max_sites
+        self.stack_depth = stack_depth
+
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._sites: dict[str, BlockingSite] = {}
+        # site captured by the sidecar thread during the current stall
+        self._pending_site: BlockingSite | None = None
+        self._last_tick = time.monotonic()
+        # tick after which the stack was last captured, it is captured once per stall
+        self._captured_tick: float | None = None
+        self._loop_thread_id: int | None = None
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self._sidecar: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    async def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._sidecar = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+        self._sidecar.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self._sidecar is not None:
+            self._sidecar.join(timeout=1)
+            self._sidecar = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                lag = max(now - self._last_tick - self.interval, 0.0)
+                self._last_tick = now
+                site, self._pending_site = self._pending_site, None
+
+                self.max_lag = max(self.max_lag, lag)
+                if site is not None:
+                    site.total_seconds += lag
+                    site.max_seconds = max(site.max_seconds, lag)
+
+            metrics.event_loop_lag_seconds.observe(lag)
+            if site is not None:
+                logger.warning(
+                    'Event loop was blocked for %.0fms at %s, in %s',
+                    lag * 1000,
+                    site.site,
+                    site.blocked_in,
+                )
+
+    def _watch(self):
+        # polls often enough to catch stalls of about threshold seconds
+        while not self._stopped.wait(self.threshold / 2):
+            with self._lock:
+                stalled = time.monotonic() - self._last_tick - self.interval >= self.threshold
+                if stalled and self._captured_tick != self._last_tick:
+                    self._captured_tick = self._last_tick
+                    self._capture()
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+
+        stack = traceback.extract_stack(frame, limit=self.stack_depth)
+        del frame
+        if not stack or stack[-1].filename == selectors.__file__:
+            # the loop is waiting for IO, it was late because other threads held the GIL
+            return
+
+        app_frames = [summary for summary in stack if _is_app_frame(summary)]
+        site = _format_frame(app_frames[-1] if app_frames else stack[-1])
+
+        blocking_site = self._sites.get(site)
+        if blocking_site is None:
+            if len(self._sites) >= self.max_sites:
+                # keep the sites that blocked the longest
+                least = min(self._sites.values(), key=lambda s: s.total_seconds)
+                del self._sites[least.site]
+            blocking_site = self._sites[site] = BlockingSite(site=site, blocked_in='', stack=[])
+
+        blocking_site.blocked_in = _format_frame(stack[-1])
+        blocking_site.stack = [_format_frame(summary) for summary in stack]
+        blocking_site.stalls += 1
+        self.stalls += 1
+        self._pending_site = blocking_site
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns the lag of the loop and the sites it was blocked in, the longest blocking first
+        """
+        with self._lock:
+            sites = sorted(self._sites.values(), key=lambda s: s.total_seconds, reverse=True)
+            return {
+                'interval_seconds': self.interval,
+                'threshold_seconds': self.threshold,
+                'stalls': self.stalls,
+                'max_lag_seconds': self.max_lag,
+                'sites': [site.to_dict() for site in sites],
+            }
+
+
+loop_monitor = LoopMonitor(
+    interval=settings.LOOP_MONITOR_INTERVAL,
+    threshold=settings.LOOP_MONITOR_THRESHOLD_MS / 1000,
+    max_sites=settings.LOOP_MONITOR_MAX_SITES,
+)
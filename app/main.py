@@ -1,14 +1,25 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 
-from . import database
+from . import auth, database, profiler
+from .events import publisher
+from .loop_monitor import loop_monitor
+from .middleware import MetricsMiddleware
+from .pagination import InvalidCursor
+from .websocket import manager
 from .config import settings
-from .routers import user_router, auth_router, friend_router, websocket_router
+from .routers import user_router, auth_router, friend_router, websocket_router, internal_router
 
 # fast API instance
-app = FastAPI(title='Friend Connection Backend')
+# responses are encoded with orjson, list endpoints bypass it and the response
+# model validation with precompiled type adapters, see serialization.json_response
+app = FastAPI(
+    title='Friend Connection Backend',
+    default_response_class=ORJSONResponse,
+)
 
 cors_allowed_origins = [
     'http://localhost',
@@ -42,11 +53,81 @@ app.include_router(user_router)
 app.include_router(auth_router)
 app.include_router(friend_router)
 app.include_router(websocket_router)
+app.include_router(internal_router)
+
+
+@app.middleware('http')
+async def add_db_stats_header(request: Request, call_next):
+    response = await call_next(request)
+
+    # database usage of the request, set by the session dependency when the request used one
+    db_stats = getattr(request.state, 'db_stats', None)
+    if db_stats is not None:
+        response.headers['Server-Timing'] = db_stats.server_timing()
+
+        if db_stats.profile is not None:
+            response.headers['X-Query-Profile'] = db_stats.profile.summary()
+            route = request.scope.get('route')
+            profiler.report(f'{request.method} {route.path if route else request.url.path}', db_stats.profile)
+
+    return response
+
+
+# added last so it is the outermost middleware, and times the others too
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(auth.PasswordHasherBusy)
+async def password_hasher_busy_handler(_: Request, exc: auth.PasswordHasherBusy):
+    # password hasher is saturated, ask the client to back off instead of queueing forever
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={'detail': 'Server is busy, please try again later'},
+        headers={'Retry-After': str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(_: Request, exc: InvalidCursor):
+    # malformed, or issued by another list
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={'detail': 'Invalid cursor'},
+    )
 
 
 @app.on_event('startup')
 def on_startup():
-    database.init_db()
+    if settings.DATABASE_SEED_ON_STARTUP:
+        database.init_db()
+
+
+@app.on_event('startup')
+async def start_websocket_manager():
+    await manager.start()
+    await publisher.start()
+
+
+@app.on_event('startup')
+async def start_loop_monitor():
+    if settings.LOOP_MONITOR:
+        await loop_monitor.start()
+
+
+@app.on_event('shutdown')
+async def stop_loop_monitor():
+    await loop_monitor.stop()
+
+
+@app.on_event('shutdown')
+def on_shutdown():
+    auth.password_hasher.shutdown()
+
+
+@app.on_event('shutdown')
+async def stop_websocket_manager():
+    await publisher.stop()
+    await manager.stop()
 
 
 @app.get('/')
@@ -0,0 +1,295 @@
+import bisect
+import threading
+from typing import Any, Callable, Iterator, Sequence
+
+# latency buckets in seconds, shared by the request and password hashing histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+
+    labels = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + labels + '}'
+
+
+def _render_histogram(
+        name: str,
+        label_names: Sequence[str],
+        label_values: Sequence[str],
+        buckets: Sequence[float],
+        counts: Sequence[int],
+        count: int,
+        total: float,
+) -> Iterator[str]:
+    bucket_names = (*label_names, 'le')
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        yield f'{name}_bucket{_format_labels(bucket_names, (*label_values, _format_value(bound)))} {cumulative}'
+    yield f'{name}_bucket{_format_labels(bucket_names, (*label_values, "+Inf"))} {count}'
+
+    labels = _format_labels(label_names, label_values)
+    yield f'{name}_sum{labels} {_format_value(total)}'
+    yield f'{name}_count{labels} {count}'
+
+
+class Histogram:
+    """
+    Thread safe histogram of observed values, counted in cumulative buckets
+    like prometheus histograms
+    """
+    type = 'histogram'
+
+    def __init__(self, buckets: Sequence[float], name: str = '', documentation: str = ''):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = sorted(buckets)
+        self._counts = [0] * len(self.buckets)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self._counts):
+                self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Returns the cumulative count of every bucket, keyed by its upper bound
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count = self._count
+            total = self._sum
+
+        buckets = {}
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        buckets['+Inf'] = count
+
+        return {
+            'buckets': buckets,
+            'count': count,
+            'sum': total,
+        }
+
+    def render(self) -> Iterator[str]:
+        with self._lock:
+            counts = list(self._counts)
+            count = self._count
+            total = self._sum
+
+        yield from _render_histogram(self.name, (), (), self.buckets, counts, count, total)
+
+
+class Counter:
+    """
+    Prometheus counter, with one value per combination of label values.
+    It is updated without a lock to stay cheap on the request path, so it must
+    only be updated from the event loop thread
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        for label_values, value in list(self._values.items()):
+            yield f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}'
+
+
+class Gauge(Counter):
+    """
+    Prometheus gauge, either updated like a counter or read from a function when rendered
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._function: Callable[[], float] | None = None
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) - amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Reads the unlabeled value of the gauge from function when it is rendered
+        """
+        self._function = function
+
+    def render(self) -> Iterator[str]:
+        if self._function is not None:
+            yield f'{self.name} {_format_value(self._function())}'
+            return
+
+        yield from super().render()
+
+
+class LabeledHistogram:
+    """
+    Prometheus histogram with one series per combination of label values.
+    Like Counter it is updated without a lock, so it must only be updated from the event loop thread
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = sorted(buckets)
+        self.label_names = tuple(label_names)
+        # label values -> bucket counts, followed by the count and the sum of the series
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        for label_values, series in list(self._series.items()):
+            series = list(series)
+            yield from _render_histogram(
+                self.name,
+                self.label_names,
+                label_values,
+                self.buckets,
+                series[:-2],
+                int(series[-2]),
+                series[-1],
+            )
+
+
+class Registry:
+    """
+    Metrics exposed in the prometheus text format
+    """
+
+    def __init__(self):
+        self._metrics: list[Histogram | Counter | LabeledHistogram] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# seconds request sessions waited for a connection from the pool, observed on the threads running the sessions
+db_checkout_wait_seconds = registry.register(Histogram(
+    buckets=LATENCY_BUCKETS,
+    name='db_checkout_wait_seconds',
+    documentation='Seconds request sessions waited for a database connection',
+))
+
+# the metrics below are updated from the event loop only, see MetricsMiddleware
+http_requests_total = registry.register(Counter(
+    name='http_requests_total',
+    documentation='HTTP requests by route and status code',
+    label_names=('method', 'route', 'status'),
+))
+http_request_duration_seconds = registry.register(LabeledHistogram(
+    name='http_request_duration_seconds',
+    documentation='Seconds spent handling HTTP requests',
+    buckets=LATENCY_BUCKETS,
+    label_names=('method', 'route'),
+))
+http_requests_in_progress = registry.register(Gauge(
+    name='http_requests_in_progress',
+    documentation='HTTP requests being handled',
+))
+http_request_db_queries = registry.register(LabeledHistogram(
+    name='http_request_db_queries',
+    documentation='Database queries per HTTP request',
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+    label_names=('method', 'route'),
+))
+http_request_db_seconds_total = registry.register(Counter(
+    name='http_request_db_seconds_total',
+    documentation='Seconds HTTP requests spent in database queries',
+    label_names=('method', 'route'),
+))
+db_pool_checked_out = registry.register(Gauge(
+    name='db_pool_checked_out',
+    documentation='Database connections checked out of the pool',
+))
+
+password_hash_seconds = registry.register(LabeledHistogram(
+    name='password_hash_seconds',
+    documentation='Seconds spent hashing or verifying a password, queue wait excluded',
+    buckets=LATENCY_BUCKETS,
+    label_names=('operation',),
+))
+password_hasher_rejected_total = registry.register(Counter(
+    name='password_hasher_rejected_total',
+    documentation='Password hashing jobs rejected because the queue was full',
+))
+password_hasher_in_flight = registry.register(Gauge(
+    name='password_hasher_in_flight',
+    documentation='Password hashing jobs running or waiting for a worker',
+))
+
+event_loop_lag_seconds = registry.register(LabeledHistogram(
+    name='event_loop_lag_seconds',
+    documentation='Seconds the event loop ran the lag monitor late',
+    buckets=LATENCY_BUCKETS,
+))
+
+websocket_connections = registry.register(Gauge(
+    name='websocket_connections',
+    documentation='Open websocket connections',
+))
+websocket_connections_opened_total = registry.register(Counter(
+    name='websocket_connections_opened_total',
+    documentation='Websocket connections opened',
+))
+websocket_connections_dropped_total = registry.register(Counter(
+    name='websocket_connections_dropped_total',
+    documentation='Websocket connections closed by the server, by close code',
+    label_names=('code',),
+))
+websocket_messages_sent_total = registry.register(Counter(
+    name='websocket_messages_sent_total',
+    documentation='Websocket messages written to clients',
+))
+websocket_messages_received_total = registry.register(Counter(
+    name='websocket_messages_received_total',
+    documentation='Websocket messages received from clients',
+))
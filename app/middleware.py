@@ -0,0 +1,51 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import metrics
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, status code and database usage of every HTTP request by route.
+    It is a plain ASGI middleware rather than an http middleware, so it adds no task or
+    request object to the request path
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        metrics.http_requests_in_progress.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started_at
+            metrics.http_requests_in_progress.dec()
+
+            # the route template rather than the path, so ids do not become labels
+            route = scope.get('route')
+            route_path = route.path if route is not None else 'unmatched'
+            method = scope['method']
+
+            metrics.http_requests_total.inc(method, route_path, str(status_code))
+            metrics.http_request_duration_seconds.observe(duration, method, route_path)
+
+            # database usage of the request, set by the session dependency when the request used one
+            db_stats = scope.get('state', {}).get('db_stats')
+            if db_stats is not None:
+                metrics.http_request_db_queries.observe(db_stats.queries, method, route_path)
+                metrics.http_request_db_seconds_total.inc(method, route_path, amount=db_stats.db_time)
@@ -1,9 +1,12 @@
 from sqlmodel import SQLModel
 
 from .user_model import User, UserBase, CurrentUser, UserPublic
-from .friend_model import FriendBase, Friend, FriendStatus, FriendRequest
+from .friend_model import FriendBase, Friend, FriendStatus, FriendRequest, FriendRelationship, get_pair_key
+from .friendship_model import Friendship, FriendCount, FriendSuggestion
 from .token_model import Token, TokenPayload, TokenType
 from .auth_model import AuthResponse, AuthResponseOut
+from .page_model import Page
+from .event_model import Event, EventType
 
 
 # this has been placed here to prevent circular imports, at least for now
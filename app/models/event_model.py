@@ -0,0 +1,25 @@
+from datetime import datetime
+from enum import Enum
+from typing import Any
+
+from sqlmodel import Field, SQLModel
+
+
+class EventType(str, Enum):
+    """
+    Enum defining the real time events pushed to users over websocket
+    """
+    StatusChanged = 'status_changed'
+    FriendRequested = 'friend_requested'
+    FriendAccepted = 'friend_accepted'
+    FriendDeclined = 'friend_declined'
+
+
+class Event(SQLModel):
+    """
+    Real time event. data holds the UserPublic of the user for status_changed,
+    and the FriendPublic of the friend record for friend events
+    """
+    type: EventType
+    data: dict[str, Any]
+    created_at: datetime = Field(default_factory=datetime.utcnow)
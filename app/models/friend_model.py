@@ -2,6 +2,7 @@ from datetime import datetime
 from enum import Enum
 from typing import TYPE_CHECKING
 
+from sqlalchemy import Index, UniqueConstraint, event
 from sqlmodel import Field, Relationship, SQLModel
 
 if TYPE_CHECKING:
@@ -23,13 +24,25 @@ class FriendBase(SQLModel):
 
 
 class Friend(FriendBase, table=True):
+    """
+    Database Friend model. The sender and recipient are not loaded with the friend,
+    queries that return them load them explicitly, see friend_service
+    """
+    __table_args__ = (
+        # friends listing of a user, filtered by status and ordered by created_at
+        Index('ix_friend_recipient_id_status_created_at', 'recipient_id', 'status', 'created_at'),
+        Index('ix_friend_sender_id_status_created_at', 'sender_id', 'status', 'created_at'),
+        # only one friend record may exist between two users, whichever sent the request.
+        # this also serves friendship lookups between two users in one query
+        UniqueConstraint('low_user_id', 'high_user_id', name='uq_friend_low_user_id_high_user_id'),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
 
     sender_id: int = Field(foreign_key='user.id')
     sender: 'User' = Relationship(
         sa_relationship_kwargs={
             'foreign_keys': 'Friend.sender_id',
-            'lazy': 'joined',  # eager load the data
         },
         back_populates='friends_sent',
     )
@@ -38,12 +51,41 @@ class Friend(FriendBase, table=True):
     recipient: 'User' = Relationship(
         sa_relationship_kwargs={
             'foreign_keys': 'Friend.recipient_id',
-            'lazy': 'joined',  # eager load the data
         },
         back_populates='friends_received',
     )
 
+    # canonical pair key, the lower and higher of sender_id and recipient_id.
+    # set automatically on insert, see get_pair_key
+    low_user_id: int | None = Field(default=None, nullable=False)
+    high_user_id: int | None = Field(default=None, nullable=False)
+
+
+def get_pair_key(user_a_id: int, user_b_id: int) -> tuple[int, int]:
+    """
+    Returns the canonical pair key of two users, which is the same whichever order they are given in
+    :param user_a_id: id of the first user
+    :param user_b_id: id of the second user
+    :return: tuple of the lower and higher user id
+    """
+    return min(user_a_id, user_b_id), max(user_a_id, user_b_id)
+
+
+@event.listens_for(Friend, 'before_insert')
+def _set_pair_key(_mapper, _connection, friend: Friend) -> None:
+    friend.low_user_id, friend.high_user_id = get_pair_key(friend.sender_id, friend.recipient_id)
+
 
 class FriendRequest(SQLModel):
     recipient_id: int
     message: str | None = None
+
+
+class FriendRelationship(SQLModel):
+    """
+    Relationship between the current user and another user, friend fields are None when there is no friend record
+    """
+    user_id: int
+    friend_id: int | None = None
+    sender_id: int | None = None
+    status: FriendStatus | None = None
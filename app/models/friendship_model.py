@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from sqlalchemy import Index
+from sqlmodel import Field, SQLModel
+
+from .user_model import UserPublic
+
+
+class Friendship(SQLModel, table=True):
+    """
+    Accepted friendships, stored once in each direction so the friends of a user
+    are a range of the primary key. It is maintained by friend_service when
+    friend requests are accepted or declined
+    """
+    __table_args__ = (
+        # friends of a user paged by the time they became friends, which never changes
+        Index('ix_friendship_user_id_created_at_friend_id', 'user_id', 'created_at', 'friend_id'),
+    )
+
+    user_id: int = Field(foreign_key='user.id', primary_key=True)
+    friend_id: int = Field(foreign_key='user.id', primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class FriendCount(SQLModel):
+    user_id: int
+    friend_count: int
+
+
+class FriendSuggestion(SQLModel):
+    user: UserPublic
+    mutual_friend_count: int
@@ -0,0 +1,14 @@
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar('T')
+
+
+class Page(BaseModel, Generic[T]):
+    """
+    Paginated response envelope. next_cursor should be passed as the cursor
+    query parameter to get the next page, it is None on the last page
+    """
+    items: list[T]
+    next_cursor: str | None = None
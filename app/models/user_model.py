@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import TYPE_CHECKING
 
 from pydantic import EmailStr
+from sqlalchemy import DDL, Index, event
 from sqlmodel import Field, Relationship, SQLModel
 
 if TYPE_CHECKING:
@@ -23,6 +24,18 @@ class User(UserBase, table=True):
     """
     Database User model
     """
+    __table_args__ = (
+        # keyset pagination of the users list
+        Index('ix_user_created_at_id', 'created_at', 'id'),
+        # trigram index for searching users by name, see user_service.search_users
+        Index(
+            'ix_user_name_trgm',
+            'name',
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'},
+        ).ddl_if(dialect='postgresql'),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     username: str = Field(unique=True, index=True, max_length=255)
     email: EmailStr = Field(unique=True, index=True, max_length=255)
@@ -30,6 +43,8 @@ class User(UserBase, table=True):
     hashed_password: str
     is_active: bool = Field(default=True)
     is_superuser: bool = Field(default=False)
+    # number of accepted friends, kept in sync with the friendship table
+    friend_count: int = Field(default=0, sa_column_kwargs={'server_default': '0'})
     friends_sent: list['Friend'] | None = Relationship(
         back_populates='sender',
         sa_relationship_kwargs={
@@ -44,6 +59,14 @@ class User(UserBase, table=True):
     )
 
 
+# the trigram index needs the pg_trgm extension
+event.listen(
+    User.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
+
+
 class UserRegister(SQLModel):
     name: str = Field(max_length=255)
     bio: str | None = None
@@ -0,0 +1,106 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Sequence, TypeVar
+
+from sqlalchemy import tuple_
+from sqlalchemy.sql.elements import ColumnElement
+
+from .models import Page
+
+T = TypeVar('T')
+
+# keyset pagination cursor, the sort column values and id of the last row of a page,
+# e.g. (created_at, id). Sort values are datetimes or numbers
+Cursor = tuple[Any, ...]
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor cannot be decoded
+    """
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    """
+    Encodes a cursor into an opaque url safe string
+    :param cursor: sort column values and id of the last row of a page
+    :return: encoded cursor
+    """
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in cursor]
+    raw = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value: str) -> Cursor:
+    """
+    Decodes a cursor encoded with encode_cursor. Whether the cursor has the sort values
+    of the list it is used with is checked by check_cursor
+    :param value: encoded cursor
+    :return: sort column values and id of the last row of a page
+    """
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) < 2 or not isinstance(values[-1], int):
+            raise ValueError('Expected sort values and an id')
+
+        cursor = []
+        for sort_value in values:
+            if isinstance(sort_value, str):
+                sort_value = datetime.fromisoformat(sort_value)
+            elif not isinstance(sort_value, (int, float)):
+                raise ValueError('Expected a datetime or a number')
+            cursor.append(sort_value)
+        return tuple(cursor)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+
+
+def check_cursor(cursor: Cursor, *types: type | tuple[type, ...]) -> Cursor:
+    """
+    Checks that a cursor has the sort values of the list it is used with, a cursor
+    of another list is rejected
+    :param cursor: decoded cursor
+    :param types: expected type of each value of the cursor
+    :return: the cursor
+    :raises InvalidCursor: if the cursor does not have the expected values
+    """
+    if len(cursor) != len(types) or not all(isinstance(value, t) for value, t in zip(cursor, types)):
+        raise InvalidCursor('Invalid cursor')
+
+    return cursor
+
+
+def after_cursor(sort_column: Any, id_column: Any, cursor: Cursor) -> ColumnElement[bool]:
+    """
+    Returns the filter selecting rows after the cursor, for a query ordered by
+    sort_column and id_column in descending order. Ties on the sort column are
+    broken by the id, so no row is skipped or repeated across pages
+    :param sort_column: column the query is ordered by
+    :param id_column: primary key column
+    :param cursor: cursor of the last row of the previous page
+    :raises InvalidCursor: if the cursor is not a sort value and an id
+    """
+    return tuple_(sort_column, id_column) < tuple_(*check_cursor(cursor, datetime, int))
+
+
+def build_page(
+        rows: Sequence[T],
+        limit: int,
+        cursor_of: Callable[[T], Cursor],
+) -> Page[T]:
+    """
+    Builds a page out of rows queried with limit + 1, the extra row only tells
+    whether there is a next page and is not returned
+    :param rows: rows queried with limit + 1
+    :param limit: page size
+    :param cursor_of: returns the cursor of a row
+    :return: page of at most limit rows
+    """
+    items = list(rows[:limit])
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(cursor_of(items[-1]))
+
+    return Page(items=items, next_cursor=next_cursor)
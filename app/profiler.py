@@ -0,0 +1,166 @@
+"""
+SQL profiler of request sessions, enabled with the SQL_PROFILER setting. Every statement of a
+request is recorded with its duration, slow ones are explained, and statements repeated with the
+same shape, usually lazy loads in a loop (N+1), are flagged. A summary of every request is sent in
+the X-Query-Profile header, and slow and repeated statements are logged
+"""
+import logging
+import re
+from collections import Counter
+from typing import Any, Callable
+
+from sqlalchemy.engine import Connection
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# placeholders of the dialects, qmark for sqlite, pyformat for psycopg2 and numeric for asyncpg
+_PLACEHOLDER = r'(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)'
+# expanded IN lists, collapsed so their statements have one shape whatever the number of values
+_IN_LIST_PATTERN = re.compile(rf'\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)')
+# bound parameters, which differ between the statements of one shape
+_PLACEHOLDER_PATTERN = re.compile(_PLACEHOLDER)
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    """
+    Normalizes a statement so statements differing only by their parameters have the same shape
+    :param statement: SQL statement
+    :return: shape of the statement
+    """
+    shape = _WHITESPACE_PATTERN.sub(' ', statement).strip()
+    shape = _IN_LIST_PATTERN.sub('(?)', shape)
+    return _PLACEHOLDER_PATTERN.sub('?', shape)
+
+
+def explain(connection: Connection, statement: str, parameters: Any) -> str:
+    """
+    Gets the query plan of a statement, on a cursor of its own so the results
+    of the statement are not consumed
+    :param connection: connection the statement was executed on
+    :param statement: SQL statement
+    :param parameters: parameters the statement was executed with
+    :return: query plan
+    """
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except Exception as e:
+        return f'EXPLAIN failed: {e!r}'
+    finally:
+        cursor.close()
+
+
+class ProfiledQuery:
+    """
+    Statement executed by a request session
+    """
+
+    def __init__(self, statement: str, duration: float, plan: str | None = None):
+        self.statement = statement
+        self.duration = duration
+        # query plan, only for slow queries
+        self.plan = plan
+
+
+class QueryProfile:
+    """
+    Statements executed by a request session
+    """
+
+    def __init__(self, slow_query_seconds: float, repeated_query_threshold: int):
+        self.slow_query_seconds = slow_query_seconds
+        self.repeated_query_threshold = repeated_query_threshold
+        self.queries: list[ProfiledQuery] = []
+
+    def record(self, connection: Connection, statement: str, parameters: Any, duration: float) -> None:
+        """
+        Records a statement, and explains it when it is a slow select
+        :param connection: connection the statement was executed on
+        :param statement: SQL statement
+        :param parameters: parameters the statement was executed with
+        :param duration: seconds the statement took
+        """
+        plan = None
+        if duration >= self.slow_query_seconds and statement.lstrip().upper().startswith('SELECT'):
+            plan = explain(connection, statement, parameters)
+
+        self.queries.append(ProfiledQuery(statement=statement, duration=duration, plan=plan))
+
+    def slow_queries(self) -> list[ProfiledQuery]:
+        return [query for query in self.queries if query.duration >= self.slow_query_seconds]
+
+    def repeated_queries(self) -> dict[str, int]:
+        """
+        Gets the statement shapes executed at least repeated_query_threshold times, likely N+1 queries
+        :return: number of executions by statement shape
+        """
+        counts = Counter(statement_shape(query.statement) for query in self.queries)
+        return {
+            shape: count
+            for shape, count in counts.most_common()
+            if count >= self.repeated_query_threshold
+        }
+
+    def summary(self) -> str:
+        """
+        Formats the profile as an X-Query-Profile header value
+        :return: header value
+        """
+        db_time = sum(query.duration for query in self.queries)
+        return (
+            f'queries={len(self.queries)}; time={db_time * 1000:.1f}ms; '
+            f'slow={len(self.slow_queries())}; repeated={len(self.repeated_queries())}'
+        )
+
+
+def create_profile() -> QueryProfile | None:
+    """
+    Creates the profile of a request session
+    :return: profile or None when the profiler is disabled
+    """
+    if not settings.SQL_PROFILER:
+        return None
+
+    return QueryProfile(
+        slow_query_seconds=settings.SQL_PROFILER_SLOW_QUERY_MS / 1000,
+        repeated_query_threshold=settings.SQL_PROFILER_REPEATED_QUERY_THRESHOLD,
+    )
+
+
+# called with the request and the profile of every profiled request, e.g. by the query_budget test fixture
+_listeners: list[Callable[[str, QueryProfile], None]] = []
+
+
+def add_listener(listener: Callable[[str, QueryProfile], None]) -> None:
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[str, QueryProfile], None]) -> None:
+    _listeners.remove(listener)
+
+
+def report(request: str, profile: QueryProfile) -> None:
+    """
+    Logs the slow and repeated statements of a request, and passes its profile to the listeners
+    :param request: method and route of the request
+    :param profile: profile of the request session
+    """
+    for shape, count in profile.repeated_queries().items():
+        logger.warning('%s ran a statement %s times, likely N+1 queries: %s', request, count, shape)
+
+    for query in profile.slow_queries():
+        logger.warning(
+            '%s ran a slow statement in %.1fms: %s\n%s',
+            request,
+            query.duration * 1000,
+            query.statement,
+            query.plan or '',
+        )
+
+    for listener in list(_listeners):
+        listener(request, profile)
@@ -2,3 +2,4 @@ from .user_router import router as user_router
 from .auth_router import router as auth_router
 from .friend_router import router as friend_router
 from .websocket_router import router as websocket_router
+from .internal_router import router as internal_router
@@ -3,9 +3,9 @@ from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 
-from app.deps import DatabaseDep
+from app.deps import SessionDep
 from app.models import AuthResponseOut, AuthResponse, Token
-from app.services import auth_service
+from app.services import auth_service, async_auth_service
 
 
 router = APIRouter(
@@ -22,15 +22,18 @@ router = APIRouter(
     responses={
         status.HTTP_400_BAD_REQUEST: {
             'description': 'Invalid credentials',
-        }
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            'description': 'Password hasher busy',
+        },
     }
 )
 async def login(
-        db: DatabaseDep,
+        db: SessionDep,
         form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> AuthResponse:
     # authenticate user
-    user = auth_service.authenticate(
+    user = await async_auth_service.authenticate(
         db=db,
         username=form_data.username,
         password=form_data.password,
@@ -57,15 +60,18 @@ async def login(
     responses={
         status.HTTP_400_BAD_REQUEST: {
             'description': 'Invalid credentials',
-        }
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            'description': 'Password hasher busy',
+        },
     }
 )
 async def access_token(
-        db: DatabaseDep,
+        db: SessionDep,
         form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> Token:
     # authenticate user
-    user = auth_service.authenticate(
+    user = await async_auth_service.authenticate(
         db=db,
         username=form_data.username,
         password=form_data.password,
@@ -1,10 +1,15 @@
-from typing import Sequence
-
-from fastapi import APIRouter, status, HTTPException, Query
-
-from app.deps import DatabaseDep, CurrentUserDep
-from app.models import FriendRequest, FriendPublic, FriendBase, FriendStatus, Friend
-from app.services import friend_service, user_service
+from fastapi import APIRouter, Response, status, HTTPException, Query
+from pydantic import TypeAdapter
+
+from app.config import settings
+from app.deps import SessionDep, CurrentUserDep, PaginationDep
+from app.events import publisher, create_friend_event
+from app.models import (
+    FriendRequest, FriendPublic, FriendBase, Friend, FriendRelationship, FriendSuggestion, Page, EventType,
+)
+from app.serialization import json_response
+from app.services import async_friend_service, async_user_service
+from app.services.friend_service import FriendNotFound, FriendTransitionNotAllowed
 
 
 router = APIRouter(
@@ -12,6 +17,11 @@ router = APIRouter(
     tags=['friends'],
 )
 
+# list endpoints serialize the response models built by the services with these adapters
+_friend_page_adapter = TypeAdapter(Page[FriendPublic])
+_relationships_adapter = TypeAdapter(list[FriendRelationship])
+_suggestions_adapter = TypeAdapter(list[FriendSuggestion])
+
 
 @router.post(
     path='/request',
@@ -37,12 +47,12 @@ router = APIRouter(
     }
 )
 async def request_friend(
-        db: DatabaseDep,
+        db: SessionDep,
         current_user: CurrentUserDep,  # user needs to be authenticated
         data: FriendRequest
 ) -> FriendBase:
     # validate that the recipient id provided indeed belongs to a user
-    recipient_user = user_service.get_user_by_id(db=db, user_id=data.recipient_id)
+    recipient_user = await async_user_service.get_user_by_id(db=db, user_id=data.recipient_id)
 
     if not recipient_user or not recipient_user.is_active:
         raise HTTPException(
@@ -57,7 +67,7 @@ async def request_friend(
             detail='You cannot send a friend request to yourself',
         )
 
-    friend = friend_service.create_friend(
+    friend = await async_friend_service.create_friend(
         db=db,
         current_user=current_user,
         data=data,
@@ -70,9 +80,13 @@ async def request_friend(
             detail='You already have an existing friendship with this user.',
         )
 
-    # created successfully
+    # created successfully, notify both users
+    publisher.publish(
+        event=create_friend_event(EventType.FriendRequested, friend),
+        user_ids=[friend.sender_id, friend.recipient_id],
+    )
 
-    # TODO: send email/notification to recipient
+    # TODO: send email to recipient
 
     return friend
 
@@ -101,37 +115,34 @@ _accept_decline_friend_responses = {
     responses=_accept_decline_friend_responses
 )
 async def accept_friend(
-        db: DatabaseDep,
+        db: SessionDep,
         friend_id: int,
         current_user: CurrentUserDep,  # user needs to be authenticated
 ) -> FriendBase:
-    # get friend record with id
-    friend = friend_service.get_friend_by_id(
-        db=db,
-        friend_id=friend_id,
-    )
-
-    if not friend:
-        # raise exception if friend is None
+    # the friend is accepted only if it is pending and current user is the recipient
+    try:
+        friend, changed = await async_friend_service.accept_friend(
+            db=db,
+            friend_id=friend_id,
+            recipient_id=current_user.id,
+        )
+    except FriendNotFound:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='No friend record was found',
         )
-
-    # validate that friend is pending
-    if friend.status != FriendStatus.Pending or friend.recipient_id != current_user.id:
+    except FriendTransitionNotAllowed:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='This friend request cannot be accepted',
         )
 
-    # all good
-    friend = friend_service.accept_friend(
-        db=db,
-        friend=friend,
-    )
-
-    # TODO: send email/notification to recipient
+    if changed:
+        # notify both users, a repeated accept was already notified
+        publisher.publish(
+            event=create_friend_event(EventType.FriendAccepted, friend),
+            user_ids=[friend.sender_id, friend.recipient_id],
+        )
 
     return friend
 
@@ -144,37 +155,34 @@ async def accept_friend(
     responses=_accept_decline_friend_responses
 )
 async def decline_friend(
-        db: DatabaseDep,
+        db: SessionDep,
         friend_id: int,
         current_user: CurrentUserDep,  # user needs to be authenticated
 ) -> FriendBase:
-    # get friend record with id
-    friend = friend_service.get_friend_by_id(
-        db=db,
-        friend_id=friend_id,
-    )
-
-    if not friend:
-        # raise exception if friend is None
+    # the friend is declined only if it is pending and current user is the recipient
+    try:
+        friend, changed = await async_friend_service.decline_friend(
+            db=db,
+            friend_id=friend_id,
+            recipient_id=current_user.id,
+        )
+    except FriendNotFound:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='No friend record was found',
         )
-
-    # validate that friend is pending
-    if friend.status != FriendStatus.Pending or friend.recipient_id != current_user.id:
+    except FriendTransitionNotAllowed:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail='This friend request cannot be accepted',
+            detail='This friend request cannot be declined',
         )
 
-    # all good
-    friend = friend_service.decline_friend(
-        db=db,
-        friend=friend,
-    )
-
-    # TODO: send email/notification to recipient
+    if changed:
+        # notify both users, a repeated decline was already notified
+        publisher.publish(
+            event=create_friend_event(EventType.FriendDeclined, friend),
+            user_ids=[friend.sender_id, friend.recipient_id],
+        )
 
     return friend
 
@@ -184,8 +192,11 @@ async def decline_friend(
     name='Get Current User Friends',
     description='This endpoint returns all current user friends. '
                 'It only only returns those pending or accepted',
-    response_model=list[FriendPublic],
+    response_model=Page[FriendPublic],
     responses={
+        status.HTTP_400_BAD_REQUEST: {
+            'description': 'Invalid cursor',
+        },
         status.HTTP_401_UNAUTHORIZED: {
             'description': 'Unauthorized',
         },
@@ -195,24 +206,17 @@ async def decline_friend(
     }
 )
 async def get_friends(
-        db: DatabaseDep,
+        db: SessionDep,
         current_user: CurrentUserDep,
-
-        # using seek based pagination as it offers more performance benefits compared to offset
-        seek_id: int = Query(
-            0,
-            description='This value should be the last id of the most recent data that was fetched'
-        ),
-        limit: int = 50,
-) -> Sequence[Friend]:
-    friends = friend_service.get_user_friends(
+        pagination: PaginationDep,
+) -> Response:
+    page = await async_friend_service.get_user_friends(
         db=db,
         user=current_user,
-        seek_id=seek_id,
-        limit=limit,
+        cursor=pagination.cursor,
+        limit=pagination.limit,
     )
-
-    return friends
+    return json_response(_friend_page_adapter, page)
 
 
 @router.get(
@@ -233,14 +237,14 @@ async def get_friends(
     }
 )
 async def get_friend_with_other_user(
-        db: DatabaseDep,
+        db: SessionDep,
         current_user: CurrentUserDep,
         other_user_id: int = Query(
             0,
             description='id of the other user'
         ),
 ) -> Friend:
-    friend = friend_service.get_friend_between_users(
+    friend = await async_friend_service.get_friend_between_users(
         db=db,
         user_a_id=current_user.id,
         user_b_id=other_user_id,
@@ -253,3 +257,67 @@ async def get_friend_with_other_user(
         )
 
     return friend
+
+
+@router.get(
+    path='/relationships',
+    name='Get Relationships With Users',
+    description='This endpoint returns the relationship between current user and each of the users given, '
+                'in one request. Users without a friend record with current user have no friend fields.',
+    response_model=list[FriendRelationship],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            'description': 'Unauthorized',
+        },
+        status.HTTP_403_FORBIDDEN: {
+            'description': 'Credentials validation failed',
+        },
+    }
+)
+async def get_relationships_with_users(
+        db: SessionDep,
+        current_user: CurrentUserDep,
+        user_ids: list[int] = Query(
+            max_length=settings.FRIEND_RELATIONSHIPS_MAX_IDS,
+            description='ids of the other users',
+        ),
+) -> Response:
+    relationships = await async_friend_service.get_relationships_with_users(
+        db=db,
+        user_id=current_user.id,
+        other_user_ids=user_ids,
+    )
+    return json_response(_relationships_adapter, relationships)
+
+
+@router.get(
+    path='/suggestions',
+    name='Get Friend Suggestions',
+    description='This endpoint returns friends of current user friends that current user has no friend record with, '
+                'ranked by the number of mutual friends.',
+    response_model=list[FriendSuggestion],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            'description': 'Unauthorized',
+        },
+        status.HTTP_403_FORBIDDEN: {
+            'description': 'Credentials validation failed',
+        },
+    }
+)
+async def get_friend_suggestions(
+        db: SessionDep,
+        current_user: CurrentUserDep,
+        limit: int = Query(
+            default=20,
+            ge=1,
+            le=settings.FRIEND_SUGGESTIONS_MAX_LIMIT,
+            description='Number of suggestions',
+        ),
+) -> Response:
+    suggestions = await async_friend_service.get_friend_suggestions(
+        db=db,
+        user_id=current_user.id,
+        limit=limit,
+    )
+    return json_response(_suggestions_adapter, suggestions)
@@ -0,0 +1,49 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app import auth, database, metrics
+from app.loop_monitor import loop_monitor
+from app.deps import ScrapeTokenDep, SuperUserDep
+
+
+router = APIRouter(
+    prefix='/internal',
+    tags=['internal'],
+)
+
+
+@router.get(
+    path='/metrics',
+    description='Database pool and password hasher metrics of this worker, for superusers only.',
+)
+async def get_metrics(_: SuperUserDep):
+    engine = database.async_engine.sync_engine if database.async_engine is not None else database.engine
+    return {
+        'database': {
+            'pool': database.get_pool_stats(engine),
+            'checkout_wait_seconds': metrics.db_checkout_wait_seconds.snapshot(),
+        },
+        'password_hasher': auth.password_hasher.stats(),
+    }
+
+
+@router.get(
+    path='/metrics/prometheus',
+    description='Request, database, password hashing and websocket metrics of this worker '
+                'in the prometheus text format, for the scraper holding the METRICS_SCRAPE_TOKEN.',
+    response_class=PlainTextResponse,
+)
+async def get_prometheus_metrics(_: ScrapeTokenDep):
+    return PlainTextResponse(
+        content=metrics.registry.render(),
+        media_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@router.get(
+    path='/event-loop',
+    description='Event loop lag of this worker, and the call sites that blocked it the longest, '
+                'for superusers only.',
+)
+async def get_event_loop_stats(_: SuperUserDep):
+    return loop_monitor.stats()
@@ -1,11 +1,14 @@
-from typing import Sequence, Annotated
+from typing import Annotated
 
-from fastapi import APIRouter, HTTPException, status, Query, Body
+from fastapi import APIRouter, HTTPException, Response, status, Query, Body
+from pydantic import TypeAdapter
 
-from app.deps import DatabaseDep, CurrentUserDep
-from app.models import AuthResponse, AuthResponseOut, User
+from app.deps import SessionDep, CurrentUserDep, PaginationDep
+from app.events import publisher, create_status_changed_event
+from app.models import AuthResponse, AuthResponseOut, Page, FriendCount
 from app.models.user_model import UserRegister, UserPublic, UserBase, CurrentUser
-from app.services import user_service, auth_service
+from app.serialization import json_response
+from app.services import async_user_service, auth_service
 
 
 router = APIRouter(
@@ -13,6 +16,9 @@ router = APIRouter(
     tags=['users'],
 )
 
+# list endpoints serialize the pages of UserPublic built by the services with this adapter
+_user_page_adapter = TypeAdapter(Page[UserPublic])
+
 
 @router.post(
     path='/register',
@@ -22,10 +28,13 @@ router = APIRouter(
     responses={
         status.HTTP_409_CONFLICT: {
             'description': 'Email conflict',
-        }
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            'description': 'Password hasher busy',
+        },
     }
 )
-async def register_user(db: DatabaseDep, data: UserRegister) -> AuthResponse:
+async def register_user(db: SessionDep, data: UserRegister) -> AuthResponse:
     """
     Register a new user.
     :param db: database session
@@ -33,7 +42,7 @@ async def register_user(db: DatabaseDep, data: UserRegister) -> AuthResponse:
     """
 
     # begin by validating email to make sure it can be used
-    user = user_service.get_user_by_email(
+    user = await async_user_service.get_user_by_email(
         db=db,
         email=data.email,
     )
@@ -46,7 +55,7 @@ async def register_user(db: DatabaseDep, data: UserRegister) -> AuthResponse:
 
     # all good, validate and create user
     data = UserRegister.model_validate(data)
-    user = user_service.create_user(
+    user = await async_user_service.create_user(
         db=db,
         data=data,
     )
@@ -93,13 +102,13 @@ async def get_current_user(
     }
 )
 async def update_current_user_bio(
-        db: DatabaseDep,
+        db: SessionDep,
         current_user: CurrentUserDep,
         bio: Annotated[str, Body(embed=True)]
 ) -> UserBase:
-    return user_service.update_user_bio(
+    return await async_user_service.update_user_bio(
         db=db,
-        user=current_user,
+        user_id=current_user.id,
         bio=bio,
     )
 
@@ -120,19 +129,21 @@ async def update_current_user_bio(
     }
 )
 async def update_current_user_status(
-        db: DatabaseDep,
+        db: SessionDep,
         current_user: CurrentUserDep,
         new_status: Annotated[str, Body(embed=True)]
 ) -> UserBase:
-    user = user_service.update_user_status(
+    user = await async_user_service.update_user_status(
         db=db,
-        user=current_user,
+        user_id=current_user.id,
         status=new_status,
     )
 
-    # TODO: Ideally we should broadcast the websocket event from the backend
-    #  but for the purpose of this task and as a proof of work,
-    #  the frontend will handle it by sending a message over the channel
+    # notify the friends of the user that are currently online
+    publisher.publish_to_friends(
+        event=create_status_changed_event(user),
+        user_id=user.id,
+    )
 
     return user
 
@@ -141,8 +152,11 @@ async def update_current_user_status(
     path='/list',
     name='Get all users',
     description='This endpoint returns all active users friends.',
-    response_model=list[UserPublic],
+    response_model=Page[UserPublic],
     responses={
+        status.HTTP_400_BAD_REQUEST: {
+            'description': 'Invalid cursor',
+        },
         status.HTTP_401_UNAUTHORIZED: {
             'description': 'Unauthorized',
         },
@@ -152,34 +166,42 @@ async def update_current_user_status(
     }
 )
 async def get_users(
-        db: DatabaseDep,
+        db: SessionDep,
         _: CurrentUserDep,
+        pagination: PaginationDep,
         query: str | None = Query(
             default=None,
-            description='Query to search users by name'
+            max_length=100,
+            description='Query to search users by name. Search results are ranked by relevance, '
+                        'their cursors are only valid with the same query'
         ),
+) -> Response:
+    if query:
+        page = await async_user_service.search_users(
+            db=db,
+            query=query,
+            cursor=pagination.cursor,
+            limit=pagination.limit,
+        )
+        return json_response(_user_page_adapter, page)
 
-        # using seek based pagination as it offers more performance benefits compared to offset
-        seek_id: int = Query(
-            0,
-            description='This value should be the last id of the most recent data that was fetched'
-        ),
-        limit: int = 50,
-) -> Sequence[UserBase]:
-    return user_service.get_active_users(
+    page = await async_user_service.get_active_users(
         db=db,
-        query=query,
-        seek_id=seek_id,
-        limit=limit,
+        cursor=pagination.cursor,
+        limit=pagination.limit,
     )
+    return json_response(_user_page_adapter, page)
 
 
 @router.get(
     path='/list-users-who-are-friends-with-current-user',
     name='Get all users who are friends with current user',
     description='This endpoint returns all users who are friends with current user.',
-    response_model=list[UserPublic],
+    response_model=Page[UserPublic],
     responses={
+        status.HTTP_400_BAD_REQUEST: {
+            'description': 'Invalid cursor',
+        },
         status.HTTP_401_UNAUTHORIZED: {
             'description': 'Unauthorized',
         },
@@ -189,17 +211,80 @@ async def get_users(
     }
 )
 async def get_users_who_are_friends_with_user(
-        db: DatabaseDep,
+        db: SessionDep,
         current_user: CurrentUserDep,
-        seek_id: int = Query(
-            0,
-            description='This value should be the last id of the most recent data that was fetched'
-        ),
-        limit: int = 50,
-) -> Sequence[User]:
-    return user_service.get_users_who_are_friends_with_user(
+        pagination: PaginationDep,
+) -> Response:
+    page = await async_user_service.get_users_who_are_friends_with_user(
+        db=db,
+        user_id=current_user.id,
+        cursor=pagination.cursor,
+        limit=pagination.limit,
+    )
+    return json_response(_user_page_adapter, page)
+
+
+@router.get(
+    path='/{user_id}/friend-count',
+    name='Get user friend count',
+    description='This endpoint returns the number of accepted friends of a user.',
+    response_model=FriendCount,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            'description': 'Unauthorized',
+        },
+        status.HTTP_403_FORBIDDEN: {
+            'description': 'Credentials validation failed',
+        },
+        status.HTTP_404_NOT_FOUND: {
+            'description': 'User not found',
+        },
+    }
+)
+async def get_user_friend_count(
+        db: SessionDep,
+        _: CurrentUserDep,
+        user_id: int,
+) -> FriendCount:
+    friend_count = await async_user_service.get_friend_count(db=db, user_id=user_id)
+
+    if friend_count is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='User not found',
+        )
+
+    return FriendCount(user_id=user_id, friend_count=friend_count)
+
+
+@router.get(
+    path='/{user_id}/mutual-friends',
+    name='Get mutual friends with user',
+    description='This endpoint returns the users who are friends with both current user and the user.',
+    response_model=Page[UserPublic],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            'description': 'Invalid cursor',
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            'description': 'Unauthorized',
+        },
+        status.HTTP_403_FORBIDDEN: {
+            'description': 'Credentials validation failed',
+        },
+    }
+)
+async def get_mutual_friends(
+        db: SessionDep,
+        current_user: CurrentUserDep,
+        pagination: PaginationDep,
+        user_id: int,
+) -> Response:
+    page = await async_user_service.get_mutual_friends(
         db=db,
         user_id=current_user.id,
-        seek_id=seek_id,
-        limit=limit,
+        other_user_id=user_id,
+        cursor=pagination.cursor,
+        limit=pagination.limit,
     )
+    return json_response(_user_page_adapter, page)
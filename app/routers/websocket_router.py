@@ -1,43 +1,63 @@
-from fastapi import APIRouter, WebSocket
+from fastapi import APIRouter, HTTPException, WebSocket, status
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.websockets import WebSocketDisconnect
 
+from app import metrics
+from app.deps import SessionDep, get_principal
+from app.models import CurrentUser
+from app.websocket import manager
 
-router = APIRouter()
-
-
-class WebsocketConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+router = APIRouter()
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
 
-    async def broadcast(self, message: str, path_params: dict):
-        for connection in self.active_connections:
-            if connection.path_params == path_params:
-                await connection.send_text(message)
+async def _get_client(db: Session | AsyncSession, token: str | None, client_id: int) -> CurrentUser | None:
+    """
+    Resolves the user of the access token like the http routes do, so a deactivated user
+    loses websocket access too, and checks that the token was issued to the client
+    :param db: database session
+    :param token: access token
+    :param client_id: client id of the connection
+    :return: the user if the token belongs to the active client else None
+    """
+    if not token:
+        return None
 
+    try:
+        principal = await get_principal(db=db, token=token)
+    except HTTPException:
+        return None
 
-manager = WebsocketConnectionManager()
+    return principal if principal.id == client_id else None
 
 
 @router.websocket('/ws/{client_id}')
 async def websocket_endpoint(
         websocket: WebSocket,
+        db: SessionDep,
         client_id: int,
+        token: str | None = None,
+        heartbeat: bool = False,
 ):
-   await manager.connect(websocket)
-   try:
-       while True:
-           data = await websocket.receive_text()
-           await manager.send_personal_message(data, websocket)
-           await manager.broadcast(data, websocket.path_params)
-   except WebSocketDisconnect:
-       manager.disconnect(websocket)
+    # browsers cannot set headers on websocket requests, so the access token comes as a query parameter
+    if not await _get_client(db, token, client_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # clients connecting with heartbeat=true are sent ping frames and reaped when they stop replying,
+    # other clients only listen and are kept alive by the protocol level pings of the server
+    connection = await manager.connect(client_id, websocket, heartbeat=heartbeat)
+    try:
+        while True:
+            # clients only send heartbeat replies, any text or binary frame counts as activity
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            connection.touch()
+            metrics.websocket_messages_received_total.inc()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect(connection)
+        await connection.close()
@@ -0,0 +1,253 @@
+"""
+Bulk imports users and friends from CSV or NDJSON files, e.g.
+python -m app.seed users users.csv
+python -m app.seed friends friends.ndjson
+
+Users have the columns name, email and either password or hashed_password, and optionally
+username, bio, status, is_active and is_superuser. Friends have the columns sender_email,
+recipient_email and optionally status, which defaults to Accepted.
+Files are streamed in batches, passwords are hashed on a process pool while the previous
+batch is written, and rows are written with COPY on postgres or executemany elsewhere.
+A file is imported in one transaction, so a failed import leaves nothing behind.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from sqlalchemy import Connection, Engine, Table, text
+from sqlmodel import select
+
+from app import auth, database
+from app.models import Friend, FriendStatus, Friendship, User
+
+# NULL marker of the COPY rows, so empty strings stay empty strings
+_COPY_NULL = '\\N'
+
+
+def read_rows(path: Path) -> Iterator[dict[str, Any]]:
+    """
+    Streams the rows of a CSV file with a header, or of a newline delimited JSON file
+    :param path: .csv, .ndjson or .jsonl file
+    :return: iterator of rows
+    """
+    with path.open(newline='') as file:
+        if path.suffix == '.csv':
+            yield from csv.DictReader(file)
+        elif path.suffix in ('.ndjson', '.jsonl'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError(f'Unsupported file type {path.suffix}, expected .csv, .ndjson or .jsonl')
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _to_bool(value: Any, default: bool) -> bool:
+    # CSV values are strings
+    if value is None or value == '':
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 't', 'yes')
+    return bool(value)
+
+
+def _copy_value(value: Any) -> Any:
+    if value is None:
+        return _COPY_NULL
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def insert_rows(connection: Connection, table: Table, rows: list[dict[str, Any]]) -> None:
+    """
+    Inserts rows with COPY when the connection is a psycopg2 one, else with executemany
+    :param connection: database connection
+    :param table: table to insert into
+    :param rows: rows, every one with the same columns
+    """
+    if not rows:
+        return
+
+    if connection.dialect.driver != 'psycopg2':
+        connection.execute(table.insert(), rows)
+        return
+
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[column]) for column in columns])
+    buffer.seek(0)
+
+    quoted_columns = ', '.join(f'"{column}"' for column in columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY "{table.name}" ({quoted_columns}) FROM STDIN WITH (FORMAT csv, NULL \'{_COPY_NULL}\')',
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def update_friend_counts(connection: Connection) -> None:
+    """
+    Recounts the friends of every user from the friendship table, after friendships were bulk inserted
+    :param connection: database connection
+    """
+    connection.execute(text(
+        'UPDATE "user" '
+        'SET friend_count = (SELECT count(*) FROM friendship WHERE friendship.user_id = "user".id)'
+    ))
+
+
+def _user_row(row: dict[str, Any], hashed_password: str, now: datetime) -> dict[str, Any]:
+    return {
+        'name': row['name'],
+        'username': row.get('username') or row['email'],
+        'email': row['email'],
+        'hashed_password': hashed_password,
+        'bio': row.get('bio') or None,
+        'status': row.get('status') or User.model_fields['status'].default,
+        'is_active': _to_bool(row.get('is_active'), default=True),
+        'is_superuser': _to_bool(row.get('is_superuser'), default=False),
+        'friend_count': 0,
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+def import_users(
+        engine: Engine,
+        rows: Iterable[dict[str, Any]],
+        batch_size: int = 5000,
+        executor: Executor | None = None,
+) -> int:
+    """
+    Imports users. The passwords of a batch are hashed on the executor while the previous batch is written
+    :param engine: database engine
+    :param rows: user rows
+    :param batch_size: users per insert
+    :param executor: executor hashing the passwords, they are hashed in process when None
+    :return: number of users imported
+    """
+    now = datetime.utcnow()
+    count = 0
+
+    def hash_batch(batch: list[dict]) -> tuple[list[dict], Iterator[str]]:
+        # rows that come with a hash keep it, only plain passwords are hashed
+        passwords = [row['password'] for row in batch if not row.get('hashed_password')]
+        if executor is None:
+            return batch, map(auth.get_password_hash, passwords)
+
+        # executor.map submits the whole batch right away, the hashes are collected on write
+        return batch, executor.map(auth.get_password_hash, passwords, chunksize=64)
+
+    def write_batch(connection: Connection, batch: list[dict], hashes: Iterator[str]) -> None:
+        insert_rows(connection, User.__table__, [
+            _user_row(row, row.get('hashed_password') or next(hashes), now)
+            for row in batch
+        ])
+
+    with engine.begin() as connection:
+        pending = None
+        for batch in _batches(rows, batch_size):
+            hashing = hash_batch(batch)
+            if pending is not None:
+                write_batch(connection, *pending)
+            pending = hashing
+            count += len(batch)
+
+        if pending is not None:
+            write_batch(connection, *pending)
+
+    return count
+
+
+def import_friends(engine: Engine, rows: Iterable[dict[str, Any]], batch_size: int = 5000) -> int:
+    """
+    Imports friends between existing users, with the friendships of the accepted ones,
+    then recounts the friends of every user. The ids of all users are held in memory
+    :param engine: database engine
+    :param rows: friend rows
+    :param batch_size: friends per insert
+    :return: number of friends imported
+    """
+    now = datetime.utcnow()
+    count = 0
+
+    with engine.begin() as connection:
+        user_ids = dict(connection.execute(select(User.email, User.id)).all())
+
+        for batch in _batches(rows, batch_size):
+            friends = []
+            friendships = []
+            for row in batch:
+                sender_id = user_ids[row['sender_email']]
+                recipient_id = user_ids[row['recipient_email']]
+                friend_status = FriendStatus(row.get('status') or FriendStatus.Accepted)
+                friends.append({
+                    'sender_id': sender_id,
+                    'recipient_id': recipient_id,
+                    'low_user_id': min(sender_id, recipient_id),
+                    'high_user_id': max(sender_id, recipient_id),
+                    'status': friend_status,
+                    'created_at': now,
+                    'updated_at': now,
+                })
+
+                if friend_status == FriendStatus.Accepted:
+                    friendships.append({'user_id': sender_id, 'friend_id': recipient_id, 'created_at': now})
+                    friendships.append({'user_id': recipient_id, 'friend_id': sender_id, 'created_at': now})
+
+            insert_rows(connection, Friend.__table__, friends)
+            insert_rows(connection, Friendship.__table__, friendships)
+            count += len(batch)
+
+        update_friend_counts(connection)
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=['users', 'friends'])
+    parser.add_argument('path', type=Path, help='.csv, .ndjson or .jsonl file')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='password hashing processes')
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    rows = read_rows(args.path)
+    if args.kind == 'users':
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            count = import_users(database.engine, rows, batch_size=args.batch_size, executor=executor)
+    else:
+        count = import_friends(database.engine, rows, batch_size=args.batch_size)
+
+    print(f'Imported {count} {args.kind} in {time.perf_counter() - started_at:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
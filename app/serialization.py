@@ -0,0 +1,23 @@
+from typing import TypeVar
+
+from fastapi import Response, status
+from pydantic import TypeAdapter
+
+T = TypeVar('T')
+
+
+def json_response(adapter: TypeAdapter[T], content: T, status_code: int = status.HTTP_200_OK) -> Response:
+    """
+    Serializes content straight to JSON with a precompiled type adapter. Returning content from
+    a handler instead would validate it against the response model again before encoding it,
+    so content must already be made of the response models, e.g. rows built by the list services
+    :param adapter: type adapter of the response model
+    :param content: response content
+    :param status_code: response status code
+    :return: JSON response
+    """
+    return Response(
+        content=adapter.dump_json(content),
+        status_code=status_code,
+        media_type='application/json',
+    )
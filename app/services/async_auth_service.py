@@ -0,0 +1,27 @@
+"""
+Async versions of the auth service functions, see async_user_service.
+"""
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import auth
+from app.database import run_in_session, wait_in_session
+from app.models import User
+from app.services import auth_service
+
+
+async def authenticate(db: Session | AsyncSession, username: str, password: str) -> User | None:
+    """
+    Authenticates a user. The password is verified on the password hasher pool
+    :param db: database session
+    :param username: username
+    :param password: user password
+    :return: user if success else None
+    """
+    return await run_in_session(
+        db,
+        auth_service.authenticate,
+        username=username,
+        password=password,
+        verify=wait_in_session(db, auth.password_hasher.verify),
+    )
@@ -0,0 +1,164 @@
+"""
+Async versions of the friend service functions. Each function runs its
+friend_service counterpart with run_in_session, so it works with both the
+sync Session and the AsyncSession selected by the DATABASE_ASYNC setting.
+"""
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import run_in_session
+from app.pagination import Cursor
+from app.models import (
+    CurrentUser, FriendRequest, Friend, FriendPublic, FriendRelationship, FriendSuggestion, User, Page,
+)
+from app.services import friend_service
+
+
+async def create_friend(
+        db: Session | AsyncSession,
+        current_user: User | CurrentUser,
+        data: FriendRequest,
+) -> Friend | None:
+    """
+    Creates a new friend object between current user and the recipient user
+    :param db: database session
+    :param current_user: current user
+    :param data: friend data
+    :return: friend object or None if friend object already exists between the two users
+    """
+    return await run_in_session(
+        db,
+        friend_service.create_friend,
+        current_user=current_user,
+        data=data,
+    )
+
+
+async def accept_friend(
+        db: Session | AsyncSession,
+        friend_id: int,
+        recipient_id: int,
+) -> tuple[Friend, bool]:
+    """
+    Accepts a pending friend request, see friend_service.accept_friend
+    :param db: database session
+    :param friend_id: friend id
+    :param recipient_id: id of the current user, who must be the recipient
+    :return: friend object, and True if it was accepted by this call or False if it already was
+    """
+    return await run_in_session(
+        db,
+        friend_service.accept_friend,
+        friend_id=friend_id,
+        recipient_id=recipient_id,
+    )
+
+
+async def decline_friend(
+        db: Session | AsyncSession,
+        friend_id: int,
+        recipient_id: int,
+) -> tuple[Friend, bool]:
+    """
+    Declines a pending friend request, see friend_service.decline_friend
+    :param db: database session
+    :param friend_id: friend id
+    :param recipient_id: id of the current user, who must be the recipient
+    :return: friend object, and True if it was declined by this call or False if it already was
+    """
+    return await run_in_session(
+        db,
+        friend_service.decline_friend,
+        friend_id=friend_id,
+        recipient_id=recipient_id,
+    )
+
+
+async def get_friend_between_users(
+        db: Session | AsyncSession,
+        user_a_id: int,
+        user_b_id: int,
+) -> Friend | None:
+    """
+    Gets a friend object between two users
+    :param db: database session
+    :param user_a_id: id of the first user
+    :param user_b_id: id of the second user
+    :return: friend if found else None
+    """
+    return await run_in_session(
+        db,
+        friend_service.get_friend_between_users,
+        user_a_id=user_a_id,
+        user_b_id=user_b_id,
+    )
+
+
+async def get_relationships_with_users(
+        db: Session | AsyncSession,
+        user_id: int,
+        other_user_ids: list[int],
+) -> list[FriendRelationship]:
+    """
+    Gets the relationship between a user and each of the other users
+    :param db: database session
+    :param user_id: id of the user
+    :param other_user_ids: ids of the other users
+    :return: relationship with each of the other users, in the order given
+    """
+    return await run_in_session(
+        db,
+        friend_service.get_relationships_with_users,
+        user_id=user_id,
+        other_user_ids=other_user_ids,
+    )
+
+
+async def get_friend_by_id(db: Session | AsyncSession, friend_id: int) -> Friend | None:
+    """
+    Gets a friend object by primary key id
+    :param db: database session
+    :param friend_id: friend id
+    :return: friend if found else None
+    """
+    return await run_in_session(db, friend_service.get_friend_by_id, friend_id=friend_id)
+
+
+async def get_user_friends(
+        db: Session | AsyncSession,
+        user: User | CurrentUser,
+        cursor: Cursor | None = None,
+        limit: int = 50,
+) -> Page[FriendPublic]:
+    """
+    Get friend objects belonging to the user provided.
+    This function only returns pending and accepted friends
+    :param db: database session
+    :param user: user
+    :param cursor: cursor of the last row of the previous page
+    :param limit: limit size
+    :return: sequence of friend objects
+    """
+    return await run_in_session(
+        db,
+        friend_service.get_user_friends,
+        user=user,
+        cursor=cursor,
+        limit=limit,
+    )
+
+
+async def get_friend_suggestions(
+        db: Session | AsyncSession,
+        user_id: int,
+        limit: int = 20,
+) -> list[FriendSuggestion]:
+    """
+    Gets friends of the friends of a user who have no friend object with the user,
+    the ones with the most mutual friends first
+    :param db: database session
+    :param user_id: user id
+    :param limit: limit
+    :return: friend suggestions
+    """
+    return await run_in_session(db, friend_service.get_friend_suggestions, user_id=user_id, limit=limit)
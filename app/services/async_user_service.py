@@ -0,0 +1,205 @@
+"""
+Async versions of the user service functions. Each function runs its
+user_service counterpart with run_in_session, so it works with both the
+sync Session and the AsyncSession selected by the DATABASE_ASYNC setting.
+"""
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import auth
+from app.cache import principal_cache
+from app.database import run_in_session
+from app.pagination import Cursor
+from app.models import Page
+from app.models.user_model import UserRegister, User, UserPublic
+from app.services import user_service
+
+
+async def create_user(db: Session | AsyncSession, data: UserRegister) -> User:
+    """
+    Creates a new user. The password is hashed on the password hasher pool
+    :param db: database session
+    :param data: user data
+    :return: created user
+    """
+    hashed_password = await auth.password_hasher.hash(data.password)
+
+    return await run_in_session(
+        db,
+        user_service.create_user,
+        data=data,
+        hashed_password=hashed_password,
+    )
+
+
+async def update_user_bio(db: Session | AsyncSession, user_id: int, bio: str) -> User:
+    """
+    Updates the bio of a user, and invalidates the cached copies of the user
+    :param db: database session
+    :param user_id: id of the user to update
+    :param bio: new bio
+    :return: updated user
+    """
+    user = await run_in_session(db, user_service.update_user_bio, user_id=user_id, bio=bio)
+    await principal_cache.invalidate_user(user_id)
+    return user
+
+
+async def update_user_status(db: Session | AsyncSession, user_id: int, status: str) -> User:
+    """
+    Updates the status of a user, and invalidates the cached copies of the user
+    :param db: database session
+    :param user_id: id of the user to update
+    :param status: user status
+    :return: updated user
+    """
+    user = await run_in_session(db, user_service.update_user_status, user_id=user_id, status=status)
+    await principal_cache.invalidate_user(user_id)
+    return user
+
+
+async def deactivate_user(db: Session | AsyncSession, user_id: int) -> User:
+    """
+    Deactivates a user, and invalidates the cached copies of the user so they can no longer authenticate
+    :param db: database session
+    :param user_id: id of the user to deactivate
+    :return: updated user
+    """
+    user = await run_in_session(db, user_service.deactivate_user, user_id=user_id)
+    await principal_cache.invalidate_user(user_id)
+    return user
+
+
+async def get_user_by_id(db: Session | AsyncSession, user_id: int) -> User | None:
+    """
+    Gets a user by their id
+    :param db: database session
+    :param user_id: user id
+    :return: user if found else None
+    """
+    return await run_in_session(db, user_service.get_user_by_id, user_id=user_id)
+
+
+async def get_user_by_email(db: Session | AsyncSession, email: str) -> User | None:
+    """
+    Gets a user by email
+    :param db: database session
+    :param email: user email
+    :return: user if found else None
+    """
+    return await run_in_session(db, user_service.get_user_by_email, email=email)
+
+
+async def get_user_by_username(db: Session | AsyncSession, username: str) -> User | None:
+    """
+    Gets a user by username
+    :param db: database session
+    :param username: user username
+    :return: user if found else None
+    """
+    return await run_in_session(db, user_service.get_user_by_username, username=username)
+
+
+async def get_active_users(
+        db: Session | AsyncSession,
+        cursor: Cursor | None = None,
+        limit: int = 50,
+) -> Page[UserPublic]:
+    """
+    Gets all active users
+    :param db: database session
+    :param cursor: cursor of the last row of the previous page
+    :param limit: limit
+    """
+    return await run_in_session(
+        db,
+        user_service.get_active_users,
+        cursor=cursor,
+        limit=limit,
+    )
+
+
+async def get_users_who_are_friends_with_user(
+        db: Session | AsyncSession,
+        user_id: int,
+        cursor: Cursor | None = None,
+        limit: int = 50,
+) -> Page[UserPublic]:
+    """
+    Gets all users who are friends with a user. It only returns those that friendship is accepted
+    :param db: database session
+    :param user_id: user id
+    :param cursor: cursor of the last row of the previous page
+    :param limit: limit
+    :return: users who are friends with a user
+    """
+    return await run_in_session(
+        db,
+        user_service.get_users_who_are_friends_with_user,
+        user_id=user_id,
+        cursor=cursor,
+        limit=limit,
+    )
+
+
+async def search_users(
+        db: Session | AsyncSession,
+        query: str,
+        cursor: Cursor | None = None,
+        limit: int = 50,
+) -> Page[UserPublic]:
+    """
+    Searches active users by name, best matches first
+    :param db: database session
+    :param query: text to search in user names
+    :param cursor: cursor of the last user of the previous page
+    :param limit: limit
+    :return: page of matching users
+    """
+    return await run_in_session(db, user_service.search_users, query=query, cursor=cursor, limit=limit)
+
+
+async def get_friend_ids(db: Session | AsyncSession, user_id: int) -> list[int]:
+    """
+    Gets the ids of the users who are friends with a user
+    :param db: database session
+    :param user_id: user id
+    :return: ids of the friends of the user
+    """
+    return await run_in_session(db, user_service.get_friend_ids, user_id=user_id)
+
+
+async def get_friend_count(db: Session | AsyncSession, user_id: int) -> int | None:
+    """
+    Gets the number of accepted friends of a user
+    :param db: database session
+    :param user_id: user id
+    :return: friend count or None if the user was not found
+    """
+    return await run_in_session(db, user_service.get_friend_count, user_id=user_id)
+
+
+async def get_mutual_friends(
+        db: Session | AsyncSession,
+        user_id: int,
+        other_user_id: int,
+        cursor: Cursor | None = None,
+        limit: int = 50,
+) -> Page[UserPublic]:
+    """
+    Gets the users who are friends with both users
+    :param db: database session
+    :param user_id: id of the first user
+    :param other_user_id: id of the second user
+    :param cursor: cursor of the last row of the previous page
+    :param limit: limit
+    :return: page of mutual friends
+    """
+    return await run_in_session(
+        db,
+        user_service.get_mutual_friends,
+        user_id=user_id,
+        other_user_id=other_user_id,
+        cursor=cursor,
+        limit=limit,
+    )
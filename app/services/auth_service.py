@@ -1,3 +1,5 @@
+from typing import Callable
+
 from sqlmodel import Session
 
 from app import auth
@@ -5,12 +7,18 @@ from app.models import User, Token
 from app.services import user_service
 
 
-def authenticate(db: Session, username: str, password: str) -> User | None:
+def authenticate(
+        db: Session,
+        username: str,
+        password: str,
+        verify: Callable[[str, str], bool] = auth.verify_password,
+) -> User | None:
     """
     Authenticates a user
     :param db: database session
     :param username: username
     :param password: user password
+    :param verify: function verifying a plain password against a hashed password
     :return: user if success else None
     """
     # first retrieve user by username
@@ -23,10 +31,7 @@ def authenticate(db: Session, username: str, password: str) -> User | None:
         return None
 
     # second, verify that the password is correct
-    if not auth.verify_password(
-            plain_password=password,
-            hashed_password=user.hashed_password,
-    ):
+    if not verify(password, user.hashed_password):
         # return None if password is not correct
         return None
 
@@ -1,9 +1,46 @@
 from datetime import datetime
-from typing import Sequence
 
-from sqlmodel import Session, select, or_, col
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Session, select, or_, and_, col, tuple_, update, func, exists
 
-from app.models import FriendRequest, Friend, User, FriendStatus
+from app.cache import friend_suggestion_cache
+from app.config import settings
+from app.models import (
+    CurrentUser, FriendRequest, Friend, FriendPublic, FriendRelationship, Friendship, FriendSuggestion, User,
+    FriendStatus, Page, get_pair_key,
+)
+from app.pagination import Cursor, after_cursor, build_page
+from app.services.user_service import user_public_columns, to_user_public
+
+
+class FriendNotFound(Exception):
+    """
+    Raised when a friend object to transition does not exist
+    """
+
+
+class FriendTransitionNotAllowed(Exception):
+    """
+    Raised when a friend object cannot be transitioned, because it is not pending
+    or the user transitioning it is not its recipient
+    """
+
+
+def _load_users(db: Session, friend: Friend) -> Friend:
+    """
+    Loads the sender and recipient of a friend object with one query, they are part of the
+    response when a single friend object is returned. The friend row itself is not reloaded
+    :param db: database session
+    :param friend: friend object
+    :return: the friend object
+    """
+    statement = select(User).where(col(User.id).in_([friend.sender_id, friend.recipient_id]))
+    users = {user.id: user for user in db.exec(statement)}
+    set_committed_value(friend, 'sender', users.get(friend.sender_id))
+    set_committed_value(friend, 'recipient', users.get(friend.recipient_id))
+    return friend
 
 
 def _validate_friend_conflict(
@@ -18,36 +55,21 @@ def _validate_friend_conflict(
     :param recipient_id: recipient id
     :returns True if no friend object exists else False
     """
-    # check if a friend object exists between current user and recipient
-    query = select(Friend).where(
-        Friend.sender_id == current_user_id,
-        Friend.recipient_id == recipient_id,
-    )
-
-    friend = db.exec(query).first()
-    if friend:
-        # friend object already exists
-        return False
-
-    # do other way round
-    # TODO: research into how to combine this in one query
-    query = select(Friend).where(
-        Friend.recipient_id == current_user_id,
-        Friend.sender_id == recipient_id,
+    # check if a friend object exists between current user and recipient in either direction,
+    # using the canonical pair key of the two users
+    low_user_id, high_user_id = get_pair_key(current_user_id, recipient_id)
+    query = select(Friend.id).where(
+        Friend.low_user_id == low_user_id,
+        Friend.high_user_id == high_user_id,
     )
 
-    friend = db.exec(query).first()
-    if friend:
-        # friend object already exists
-        return False
-
-    # no friend exists
-    return True
+    # True when no friend exists
+    return db.exec(query).first() is None
 
 
 def create_friend(
         db: Session,
-        current_user: User,
+        current_user: User | CurrentUser,
         data: FriendRequest,
 ) -> Friend | None:
     """
@@ -76,57 +98,156 @@ def create_friend(
 
     # add to db and commit
     db.add(friend)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # a concurrent request created a friend object between the two users
+        # after the validation above, the unique pair key rejected this one
+        db.rollback()
+        return None
 
-    return friend
+    # the two users are no longer suggested to each other
+    _invalidate_friend_suggestions(db=db, friend=friend, graph_changed=False)
+
+    # return friend with the sender and recipient
+    return _load_users(db=db, friend=friend)
+
+
+def _add_friendship(db: Session, friend: Friend) -> None:
+    """
+    Adds the friendship of the two users of an accepted friend object and counts it for both
+    :param db: database session
+    :param friend: accepted friend object
+    """
+    db.add(Friendship(user_id=friend.sender_id, friend_id=friend.recipient_id))
+    db.add(Friendship(user_id=friend.recipient_id, friend_id=friend.sender_id))
+
+    # incremented in the database, so concurrent accepts of the same user are all counted
+    db.exec(
+        update(User)
+        .where(col(User.id).in_([friend.sender_id, friend.recipient_id]))
+        .values(friend_count=User.friend_count + 1)
+    )
+
+
+def _invalidate_friend_suggestions(db: Session, friend: Friend, graph_changed: bool) -> None:
+    """
+    Drops the cached friend suggestions affected by a change of a friend object
+    :param db: database session
+    :param friend: changed friend object
+    :param graph_changed: True if the friendship of the two users was added or removed,
+    which also changes the suggestions of their friends
+    """
+    user_ids = {friend.sender_id, friend.recipient_id}
+    if graph_changed:
+        statement = select(Friendship.friend_id).where(col(Friendship.user_id).in_(user_ids))
+        user_ids.update(db.exec(statement).all())
+
+    for user_id in user_ids:
+        friend_suggestion_cache.delete(user_id)
+
+
+def _transition_friend(
+        db: Session,
+        friend_id: int,
+        recipient_id: int,
+        status: FriendStatus,
+) -> tuple[Friend, bool]:
+    """
+    Moves a pending friend object to status, if recipient_id is its recipient. The status is checked
+    and updated by one conditional UPDATE ... RETURNING, so of concurrent transitions only one
+    changes the friend object, the others see it is no longer pending
+    :param db: database session
+    :param friend_id: friend id
+    :param recipient_id: id of the user transitioning the friend object, who must be its recipient
+    :param status: new status
+    :return: friend object, and True if this call changed it or False if it was already in status
+    :raises FriendNotFound: if the friend object does not exist
+    :raises FriendTransitionNotAllowed: if the friend object is not pending or recipient_id is not its recipient
+    """
+    statement = update(Friend).where(
+        Friend.id == friend_id,
+        Friend.recipient_id == recipient_id,
+        Friend.status == FriendStatus.Pending,
+    ).values(
+        status=status,
+        updated_at=datetime.utcnow(),
+    ).returning(Friend)
+
+    friend = db.exec(statement).scalar_one_or_none()
+    if friend is not None:
+        return friend, True
+
+    # nothing was updated, find out why
+    friend = db.get(Friend, friend_id, populate_existing=True)
+    if friend is None:
+        raise FriendNotFound()
+
+    if friend.recipient_id == recipient_id and friend.status == status:
+        # a repeated transition, e.g. a double click, has nothing left to do
+        return friend, False
+
+    raise FriendTransitionNotAllowed()
 
 
 def accept_friend(
-        friend: Friend,
         db: Session,
-) -> Friend | None:
+        friend_id: int,
+        recipient_id: int,
+) -> tuple[Friend, bool]:
     """
-    Updates friend object status to accepted
-    :param friend: friend object to update
+    Accepts a pending friend request, and adds the friendship of the two users
     :param db: database session
-    :return: friend object after update or None if friend
-    object is not pending or recipient does not match current user
+    :param friend_id: friend id
+    :param recipient_id: id of the current user, who must be the recipient
+    :return: friend object, and True if it was accepted by this call or False if it already was
+    :raises FriendNotFound: if the friend object does not exist
+    :raises FriendTransitionNotAllowed: if the friend object is not pending or the user is not its recipient
     """
-    # all good, accept friend
-    friend.status = FriendStatus.Accepted
-    friend.updated_at = datetime.utcnow()
+    friend, changed = _transition_friend(
+        db=db,
+        friend_id=friend_id,
+        recipient_id=recipient_id,
+        status=FriendStatus.Accepted,
+    )
 
-    # add to db session and commit changes
-    db.add(friend)
-    db.commit()
+    if changed:
+        # the friendship is added in the same transaction as the status
+        _add_friendship(db=db, friend=friend)
+        db.commit()
 
-    # refresh and return friend
-    db.refresh(friend)
-    return friend
+        _invalidate_friend_suggestions(db=db, friend=friend, graph_changed=True)
+
+    # return friend with the sender and recipient
+    return _load_users(db=db, friend=friend), changed
 
 
 def decline_friend(
-        friend: Friend,
         db: Session,
-) -> Friend | None:
+        friend_id: int,
+        recipient_id: int,
+) -> tuple[Friend, bool]:
     """
-    Updates friend object status to declined
-    :param friend: friend object to decline
+    Declines a pending friend request
     :param db: database session
-    :return: friend object after update or None if friend
-    object is not pending or recipient does not match current user
+    :param friend_id: friend id
+    :param recipient_id: id of the current user, who must be the recipient
+    :return: friend object, and True if it was declined by this call or False if it already was
+    :raises FriendNotFound: if the friend object does not exist
+    :raises FriendTransitionNotAllowed: if the friend object is not pending or the user is not its recipient
     """
-    # all good, decline friend
-    friend.status = FriendStatus.Declined
-    friend.updated_at = datetime.utcnow()
+    friend, changed = _transition_friend(
+        db=db,
+        friend_id=friend_id,
+        recipient_id=recipient_id,
+        status=FriendStatus.Declined,
+    )
 
-    # add to db session and commit changes
-    db.add(friend)
-    db.commit()
+    if changed:
+        db.commit()
 
-    # refresh and return friend
-    db.refresh(friend)
-    return friend
+    # return friend with the sender and recipient
+    return _load_users(db=db, friend=friend), changed
 
 
 def get_friend_by_recipient_id(
@@ -155,26 +276,61 @@ def get_friend_between_users(
     :param user_b_id: id of the second user
     :return: friend if found else None
     """
-    # first query for when user_a is a sender and user_b recipient
+    # match both directions in one query using the canonical pair key of the two users
+    low_user_id, high_user_id = get_pair_key(user_a_id, user_b_id)
     query = select(Friend).where(
-        Friend.sender_id == user_a_id,
-        Friend.recipient_id == user_b_id,
+        Friend.low_user_id == low_user_id,
+        Friend.high_user_id == high_user_id,
+    ).options(
+        # the friend object is returned with both users, a single row so they are joined
+        joinedload(Friend.sender),
+        joinedload(Friend.recipient),
     )
 
-    friend = db.exec(query).first()
-    if friend:
-        # friend object exists, return
-        return friend
+    return db.exec(query).first()
+
 
-    # none found with first case, switch it around with user_a
-    # being recipient and user_b being sender
-    # TODO: research into how to combine this in one query
-    query = select(Friend).where(
-        Friend.sender_id == user_b_id,
-        Friend.recipient_id == user_a_id,
+def get_relationships_with_users(
+        db: Session,
+        user_id: int,
+        other_user_ids: list[int],
+) -> list[FriendRelationship]:
+    """
+    Gets the relationship between a user and each of the other users
+    :param db: database session
+    :param user_id: id of the user
+    :param other_user_ids: ids of the other users
+    :return: relationship with each of the other users, in the order given
+    """
+    pair_keys = {get_pair_key(user_id, other_user_id) for other_user_id in other_user_ids}
+    if not pair_keys:
+        return []
+
+    # one lookup on the unique pair key for every user, selecting only the columns
+    # needed so the sender and recipient are not loaded
+    query = select(
+        Friend.id,
+        Friend.sender_id,
+        Friend.recipient_id,
+        Friend.status,
+    ).where(
+        tuple_(Friend.low_user_id, Friend.high_user_id).in_(pair_keys)
     )
 
-    return db.exec(query).first()
+    friends = {}
+    for friend_id, sender_id, recipient_id, friend_status in db.exec(query):
+        other_user_id = recipient_id if sender_id == user_id else sender_id
+        friends[other_user_id] = FriendRelationship(
+            user_id=other_user_id,
+            friend_id=friend_id,
+            sender_id=sender_id,
+            status=friend_status,
+        )
+
+    return [
+        friends.get(other_user_id) or FriendRelationship(user_id=other_user_id)
+        for other_user_id in other_user_ids
+    ]
 
 
 def get_friend_by_id(
@@ -190,23 +346,50 @@ def get_friend_by_id(
     return db.get(Friend, friend_id)
 
 
+# fields of FriendPublic selected from the friend table, the users are selected with user_public_columns
+_FRIEND_PUBLIC_FIELDS = [name for name in FriendPublic.model_fields if name not in ('sender', 'recipient')]
+
+
+def _to_friend_public(row) -> FriendPublic:
+    return FriendPublic.model_validate({
+        **{name: getattr(row, name) for name in _FRIEND_PUBLIC_FIELDS},
+        'sender': to_user_public(row, prefix='sender_'),
+        'recipient': to_user_public(row, prefix='recipient_'),
+    })
+
+
 def get_user_friends(
         db: Session,
-        user: User,
-        seek_id: int = 0,
+        user: User | CurrentUser,
+        cursor: Cursor | None = None,
         limit: int = 50,
-) -> Sequence[Friend]:
+) -> Page[FriendPublic]:
     """
     Get friend objects belonging to the user provided.
     This function only returns pending and accepted friends
     :param db: database session
     :param user: user
-    :param seek_id: seek id
+    :param cursor: cursor of the last friend object of the previous page
     :param limit: limit size
-    :return: sequence of friend objects
+    :return: page of friend objects
     """
+    # the friend and both users are selected as columns of one row, only those of FriendPublic
+    sender = aliased(User)
+    recipient = aliased(User)
+    statement = select(
+        *[getattr(Friend, name) for name in _FRIEND_PUBLIC_FIELDS],
+        *user_public_columns(sender, prefix='sender_'),
+        *user_public_columns(recipient, prefix='recipient_'),
+    ).join(
+        sender,
+        sender.id == Friend.sender_id,
+    ).join(
+        recipient,
+        recipient.id == Friend.recipient_id,
+    )
+
     # query only accepted and pending friends
-    statement = select(Friend).where(
+    statement = statement.where(
         or_(
             Friend.sender_id == user.id,
             Friend.recipient_id == user.id,
@@ -215,13 +398,103 @@ def get_user_friends(
             Friend.status == FriendStatus.Pending,
             Friend.status == FriendStatus.Accepted,
         ),
-    ).order_by(col(Friend.created_at).desc())
+    )
 
     # seek data
-    if seek_id > 0:
-        # using seek based pagination as it offers more performance benefits compared to offset
-        statement = statement.where(User.id < seek_id)
+    if cursor:
+        # using keyset pagination as it offers more performance benefits compared to offset
+        statement = statement.where(after_cursor(Friend.created_at, Friend.id, cursor))
+
+    statement = statement.order_by(col(Friend.created_at).desc(), col(Friend.id).desc())
+
+    # paginate and return, the extra row tells if there is a next page
+    limit = min(limit, settings.PAGINATION_MAX_LIMIT)
+    statement = statement.limit(limit + 1)
+    return build_page(
+        rows=[_to_friend_public(row) for row in db.exec(statement)],
+        limit=limit,
+        cursor_of=lambda friend: (friend.created_at, friend.id),
+    )
+
+
+def _query_friend_suggestions(db: Session, user_id: int, limit: int) -> list[FriendSuggestion]:
+    # friends of friends, counted once per mutual friend, each hop a range of the friendship primary key
+    friendship = aliased(Friendship)
+    friend_friendship = aliased(Friendship)
+    candidate_id = friend_friendship.friend_id
+    mutual_friend_count = func.count().label('mutual_friend_count')
 
-    # paginate and return
-    statement = statement.limit(limit)
-    return db.exec(statement).all()
+    # users who already have a friend object with the user, in any status, are not suggested
+    has_friend = exists().where(
+        or_(
+            and_(Friend.low_user_id == user_id, Friend.high_user_id == candidate_id),
+            and_(Friend.low_user_id == candidate_id, Friend.high_user_id == user_id),
+        )
+    )
+
+    candidates = select(
+        candidate_id.label('user_id'),
+        mutual_friend_count,
+    ).select_from(
+        friendship,
+    ).join(
+        friend_friendship,
+        friend_friendship.user_id == friendship.friend_id,
+    ).join(
+        User,
+        User.id == candidate_id,
+    ).where(
+        friendship.user_id == user_id,
+        candidate_id != user_id,
+        ~has_friend,
+        # filtered before the limit, so inactive users do not take the place of active ones
+        User.is_active == True,
+    ).group_by(
+        candidate_id,
+    ).order_by(
+        mutual_friend_count.desc(),
+        candidate_id,
+    ).limit(limit).subquery()
+
+    statement = select(*user_public_columns(), candidates.c.mutual_friend_count).join(
+        candidates,
+        candidates.c.user_id == User.id,
+    ).order_by(
+        candidates.c.mutual_friend_count.desc(),
+        User.id,
+    )
+
+    return [
+        FriendSuggestion(
+            user=to_user_public(row),
+            mutual_friend_count=row.mutual_friend_count,
+        )
+        for row in db.exec(statement)
+    ]
+
+
+def get_friend_suggestions(
+        db: Session,
+        user_id: int,
+        limit: int = 20,
+) -> list[FriendSuggestion]:
+    """
+    Gets friends of the friends of a user who have no friend object with the user,
+    the ones with the most mutual friends first. Suggestions are cached per user,
+    and dropped when a friendship of the user or of one of their friends changes
+    :param db: database session
+    :param user_id: user id
+    :param limit: limit
+    :return: friend suggestions
+    """
+    suggestions = friend_suggestion_cache.get(user_id)
+    if suggestions is None:
+        # the longest list is cached, so any limit is served from it
+        suggestions = _query_friend_suggestions(
+            db=db,
+            user_id=user_id,
+            limit=settings.FRIEND_SUGGESTIONS_MAX_LIMIT,
+        )
+        friend_suggestion_cache.set(user_id, suggestions)
+
+    return suggestions[:limit]
@@ -1,28 +1,63 @@
 from datetime import datetime
-from typing import Sequence
 
-from sqlmodel import Session, select, col, or_
+from sqlalchemy import case, tuple_
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select, col, func, update
 
 from app import auth
-from app.models import FriendStatus
-from app.models.user_model import UserRegister, User
+from app.config import settings
+from app.models import Friendship, Page
+from app.pagination import Cursor, after_cursor, build_page, check_cursor
+from app.models.user_model import UserRegister, User, UserPublic
 
 
-def create_user(db: Session, data: UserRegister) -> User:
+def user_public_columns(user: type[User] = User, prefix: str = '') -> list:
+    """
+    Returns the columns of UserPublic. List queries select them instead of the User entity,
+    so their rows skip the identity map and never carry the password hash or the email
+    :param user: User or an alias of it
+    :param prefix: label prefix, to select the columns of several users in one row
+    :return: labeled columns
+    """
+    return [getattr(user, name).label(prefix + name) for name in UserPublic.model_fields]
+
+
+def to_user_public(row, prefix: str = '') -> UserPublic:
+    """
+    Builds a UserPublic out of a row selected with user_public_columns
+    :param row: row
+    :param prefix: label prefix the columns were selected with
+    :return: public user
+    """
+    if not prefix:
+        return UserPublic.model_validate(row._mapping)
+
+    return UserPublic.model_validate({name: getattr(row, prefix + name) for name in UserPublic.model_fields})
+
+
+def create_user(
+        db: Session,
+        data: UserRegister,
+        hashed_password: str | None = None,
+) -> User:
     """
     Creates a new user
     :param db: database session
     :param data: user data
+    :param hashed_password: password hash computed ahead, data.password is hashed when not provided
     :return: created user
     """
+    if hashed_password is None:
+        hashed_password = auth.get_password_hash(
+            password=data.password,
+        )
+
     # create user instance
     user = User.model_validate(
         data,
         update={
             'username': data.email,
-            'hashed_password': auth.get_password_hash(
-                password=data.password,
-            )
+            'hashed_password': hashed_password,
         }
     )
 
@@ -35,54 +70,66 @@ def create_user(db: Session, data: UserRegister) -> User:
     return user
 
 
+def _update_user(db: Session, user_id: int, **values) -> User:
+    """
+    Updates fields of a user with one UPDATE ... RETURNING, so the user does not have to be loaded first
+    :param db: database session
+    :param user_id: id of the user to update
+    :param values: new field values
+    :return: updated user
+    """
+    statement = update(User).where(User.id == user_id).values(
+        **values,
+        updated_at=datetime.utcnow(),
+    ).returning(User)
+
+    user = db.exec(statement).scalar_one()
+    db.commit()
+    return user
+
+
 def update_user_bio(
         db: Session,
-        user: User,
+        user_id: int,
         bio: str,
 ) -> User:
     """
-    Updates the bio of a user
+    Updates the bio of a user. Cached copies of the user must be invalidated, see async_user_service
     :param db: database session
-    :param user: user to update
+    :param user_id: id of the user to update
     :param bio: new bio
     :return: updated user
     """
-    # update user bio
-    user.bio = bio
-    user.updated_at = datetime.utcnow()
-
-    # add to db and commit changes
-    db.add(user)
-    db.commit()
-
-    # refresh and return user
-    db.refresh(user)
-    return user
+    return _update_user(db, user_id, bio=bio)
 
 
 def update_user_status(
         db: Session,
-        user: User,
+        user_id: int,
         status: str,
 ) -> User:
     """
-    Updates the status of a user
+    Updates the status of a user. Cached copies of the user must be invalidated, see async_user_service
     :param db: database session
-    :param user: user to update
+    :param user_id: id of the user to update
     :param status: user status
     :return: updated user
     """
-    # update user status
-    user.status = status
-    user.updated_at = datetime.utcnow()
+    return _update_user(db, user_id, status=status)
 
-    # add to db and commit changes
-    db.add(user)
-    db.commit()
 
-    # refresh and return user
-    db.refresh(user)
-    return user
+def deactivate_user(
+        db: Session,
+        user_id: int,
+) -> User:
+    """
+    Deactivates a user, who can no longer authenticate. Cached copies of the user must be
+    invalidated, see async_user_service
+    :param db: database session
+    :param user_id: id of the user to deactivate
+    :return: updated user
+    """
+    return _update_user(db, user_id, is_active=False)
 
 
 def get_user_by_id(db: Session, user_id: int) -> User | None:
@@ -121,64 +168,219 @@ def get_user_by_username(db: Session, username: str) -> User | None:
 
 def get_active_users(
         db: Session,
-        query: str = None,
-        seek_id: int = 0,
+        cursor: Cursor | None = None,
         limit: int = 50,
-) -> Sequence[User]:
+) -> Page[UserPublic]:
     """
     Gets all active users
     :param db: database session
-    :param query: query to filter
-    :param seek_id: seek id
+    :param cursor: cursor of the last user of the previous page
     :param limit: limit
+    :return: page of users
     """
-    statement = select(User).where(
+    statement = select(*user_public_columns()).where(
         User.is_active == True,
     )
 
-    if query:
-        # case-insensitive match
-        statement = statement.where(col(User.name).regexp_match(query, 'i'))
+    # seek data
+    if cursor:
+        # using keyset pagination as it offers more performance benefits compared to offset
+        statement = statement.where(after_cursor(User.created_at, User.id, cursor))
+
+    # order by created at in desc order, id breaks ties between users created at the same time
+    statement = statement.order_by(col(User.created_at).desc(), col(User.id).desc())
+
+    # paginate and return, the extra row tells if there is a next page
+    limit = min(limit, settings.PAGINATION_MAX_LIMIT)
+    statement = statement.limit(limit + 1)
+    return build_page(
+        rows=[to_user_public(row) for row in db.exec(statement)],
+        limit=limit,
+        cursor_of=lambda user: (user.created_at, user.id),
+    )
 
-    # order by created at in desc order
-    statement = statement.order_by(col(User.created_at).desc())
 
+def _friends_page(
+        statement,
+        friendship: type[Friendship],
+        db: Session,
+        cursor: Cursor | None,
+        limit: int,
+) -> Page[UserPublic]:
+    """
+    Paginates friends selected with the creation time of their friendship as friends_since.
+    Pages are keyed by the friendship, which never changes, unlike the friend rows,
+    so friends do not move between pages while a client pages through them
+    :param statement: select of the user public columns and friends_since
+    :param friendship: Friendship or the alias of it the friends were joined on
+    :param db: database session
+    :param cursor: cursor of the last friend of the previous page
+    :param limit: limit
+    :return: page of friends
+    """
     # seek data
-    if seek_id > 0:
-        # using seek based pagination as it offers more performance benefits compared to offset
-        statement = statement.where(User.id < seek_id)
+    if cursor:
+        # using keyset pagination as it offers more performance benefits compared to offset
+        statement = statement.where(after_cursor(friendship.created_at, friendship.friend_id, cursor))
 
-    # paginate and return
-    statement = statement.limit(limit)
-    return db.exec(statement).all()
+    # most recent friends first, served by the ix_friendship_user_id_created_at_friend_id index
+    statement = statement.order_by(col(friendship.created_at).desc(), col(friendship.friend_id).desc())
+
+    # paginate and return, the extra row tells if there is a next page
+    limit = min(limit, settings.PAGINATION_MAX_LIMIT)
+    statement = statement.limit(limit + 1)
+    page = build_page(
+        rows=db.exec(statement).all(),
+        limit=limit,
+        cursor_of=lambda row: (row.friends_since, row.id),
+    )
+    return Page(items=[to_user_public(row) for row in page.items], next_cursor=page.next_cursor)
 
 
 def get_users_who_are_friends_with_user(
         db: Session,
         user_id: int,
-        seek_id: int = 0,
+        cursor: Cursor | None = None,
         limit: int = 50,
-) -> Sequence[User]:
+) -> Page[UserPublic]:
     """
     Gets all users who are friends with a user. It only returns those that friendship is accepted
     :param db: database session
     :param user_id: user id
-    :param seek_id: seek id
+    :param cursor: cursor of the last user of the previous page
     :param limit: limit
-    :return: users who are friends with a user
+    :return: page of users who are friends with a user
     """
-    statement = select(User).where(
-        or_(
-            User.friends_sent.any(recipient_id=user_id, status=FriendStatus.Accepted),
-            User.friends_received.any(sender_id=user_id, status=FriendStatus.Accepted),
-        )
-    ).order_by(col(User.updated_at).desc())
+    # friends of the user are a range of the friendship index on user_id
+    statement = select(*user_public_columns(), Friendship.created_at.label('friends_since')).join(
+        Friendship,
+        (Friendship.friend_id == User.id) & (Friendship.user_id == user_id),
+    )
+
+    return _friends_page(statement, Friendship, db=db, cursor=cursor, limit=limit)
+
+
+def get_friend_ids(db: Session, user_id: int) -> list[int]:
+    """
+    Gets the ids of the users who are friends with a user. It only returns those that friendship is accepted
+    :param db: database session
+    :param user_id: user id
+    :return: ids of the friends of the user
+    """
+    statement = select(Friendship.friend_id).where(Friendship.user_id == user_id)
+    return list(db.exec(statement).all())
+
+
+def get_friend_count(db: Session, user_id: int) -> int | None:
+    """
+    Gets the number of accepted friends of a user
+    :param db: database session
+    :param user_id: user id
+    :return: friend count or None if the user was not found
+    """
+    statement = select(User.friend_count).where(User.id == user_id)
+    return db.exec(statement).first()
+
+
+def get_mutual_friends(
+        db: Session,
+        user_id: int,
+        other_user_id: int,
+        cursor: Cursor | None = None,
+        limit: int = 50,
+) -> Page[UserPublic]:
+    """
+    Gets the users who are friends with both users
+    :param db: database session
+    :param user_id: id of the first user
+    :param other_user_id: id of the second user
+    :param cursor: cursor of the last user of the previous page
+    :param limit: limit
+    :return: page of mutual friends
+    """
+    # intersection of the friends of both users, each a range of the friendship index on user_id
+    user_friendship = aliased(Friendship)
+    other_user_friendship = aliased(Friendship)
+    statement = select(*user_public_columns(), user_friendship.created_at.label('friends_since')).join(
+        user_friendship,
+        (user_friendship.friend_id == User.id) & (user_friendship.user_id == user_id),
+    ).join(
+        other_user_friendship,
+        (other_user_friendship.friend_id == User.id) & (other_user_friendship.user_id == other_user_id),
+    )
+
+    return _friends_page(statement, user_friendship, db=db, cursor=cursor, limit=limit)
+
+
+# escape character of LIKE patterns, a slash avoids backslash quoting differences between databases
+_LIKE_ESCAPE = '/'
+
+
+def _escape_like(value: str) -> str:
+    """
+    Escapes the LIKE wildcards in value, so it is matched literally
+    """
+    return value.replace('/', '//').replace('%', '/%').replace('_', '/_')
+
+
+def search_users(
+        db: Session,
+        query: str,
+        cursor: Cursor | None = None,
+        limit: int = 50,
+) -> Page[UserPublic]:
+    """
+    Searches active users by name. Users whose name starts with the query are ranked first,
+    then by trigram similarity to the query on postgres, or by name length on other databases,
+    then most recent first. Pages are keyed by the rank, created_at and id of the last user.
+    On postgres the name match is served by the ix_user_name_trgm GIN index
+    :param db: database session
+    :param query: text to search in user names
+    :param cursor: cursor of the last user of the previous page
+    :param limit: limit
+    :return: page of matching users
+    :raises InvalidCursor: if the cursor is not a cursor of the search
+    """
+    pattern = _escape_like(query)
+    name = col(User.name)
+
+    starts_with_query = case((name.ilike(f'{pattern}%', escape=_LIKE_ESCAPE), 1), else_=0)
+    if db.get_bind().dialect.name == 'postgresql':
+        # similarity comes with the pg_trgm extension
+        closeness = func.similarity(name, query)
+    else:
+        # negated, so the rank of every column is in descending order like the keyset
+        closeness = -func.length(name)
+
+    statement = select(
+        *user_public_columns(),
+        starts_with_query.label('starts_with_query'),
+        closeness.label('closeness'),
+    ).where(
+        User.is_active == True,
+        name.ilike(f'%{pattern}%', escape=_LIKE_ESCAPE),
+    )
 
     # seek data
-    if seek_id > 0:
-        # using seek based pagination as it offers more performance benefits compared to offset
-        statement = statement.where(User.id < seek_id)
+    if cursor:
+        cursor = check_cursor(cursor, int, (int, float), datetime, int)
+        statement = statement.where(
+            tuple_(starts_with_query, closeness, User.created_at, User.id) < tuple_(*cursor),
+        )
 
-    # paginate and return
-    statement = statement.limit(limit)
-    return db.exec(statement).all()
+    statement = statement.order_by(
+        starts_with_query.desc(),
+        closeness.desc(),
+        col(User.created_at).desc(),
+        col(User.id).desc(),
+    )
+
+    # paginate and return, the extra row tells if there is a next page
+    limit = min(limit, settings.PAGINATION_MAX_LIMIT)
+    statement = statement.limit(limit + 1)
+    page = build_page(
+        rows=db.exec(statement).all(),
+        limit=limit,
+        cursor_of=lambda row: (row.starts_with_query, row.closeness, row.created_at, row.id),
+    )
+    return Page(items=[to_user_public(row) for row in page.items], next_cursor=page.next_cursor)
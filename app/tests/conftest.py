@@ -0,0 +1,86 @@
+import os
+
+# settings are read when the app modules are imported, provide defaults so
+# the tests run without a .env file
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+
+from contextlib import contextmanager  # noqa: E402
+
+import pytest  # noqa: E402
+from fastapi.requests import HTTPConnection  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from sqlmodel import SQLModel, create_engine  # noqa: E402
+
+from app import profiler  # noqa: E402
+from app.cache import principal_cache  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.database import RequestSession  # noqa: E402
+from app.deps import get_db  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    # every test gets its own in-memory database, shared by the connections of the engine,
+    # also from the threads requests made with TestClient are served on
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    SQLModel.metadata.create_all(engine)
+    with RequestSession(engine) as session:
+        yield session
+
+
+@pytest.fixture
+def client(db):
+    """
+    Test client whose requests use the database of the db fixture
+    """
+    def get_test_db(request: HTTPConnection):
+        with RequestSession(db.get_bind()) as session:
+            request.state.db_stats = session.stats
+            yield session
+
+    app.dependency_overrides[get_db] = get_test_db
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+        # tokens of the same user issued in the same second are equal, so they must not outlive the test
+        principal_cache.clear()
+
+
+@pytest.fixture
+def query_budget(monkeypatch):
+    """
+    Fails the test when a request made in the block runs more statements than the budget, e.g.
+    with query_budget(2):
+        client.get('/users/list')
+    """
+    monkeypatch.setattr(settings, 'SQL_PROFILER', True)
+
+    @contextmanager
+    def budget(max_queries: int):
+        profiles = []
+
+        def listener(request: str, profile: profiler.QueryProfile):
+            profiles.append((request, profile))
+
+        profiler.add_listener(listener)
+        try:
+            yield
+        finally:
+            profiler.remove_listener(listener)
+
+        for request, profile in profiles:
+            if len(profile.queries) > max_queries:
+                pytest.fail(
+                    f'{request} ran {len(profile.queries)} queries, over the budget of {max_queries}:\n'
+                    + '\n'.join(query.statement for query in profile.queries)
+                    + ''.join(
+                        f'\nrepeated {count} times: {shape}'
+                        for shape, count in profile.repeated_queries().items()
+                    )
+                )
+
+    return budget
@@ -0,0 +1,59 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import auth
+from app.database import RequestSession
+from app.services import async_auth_service
+from app.tests.utils import create_user
+
+
+def create_user_with_password(db: Session, name: str, password: str):
+    user = create_user(db, name)
+    user.hashed_password = auth.get_password_hash(password)
+    db.commit()
+    return user
+
+
+def test_login_verifies_the_password_on_the_hasher(db, client):
+    user = create_user_with_password(db, 'user', 'password')
+    completed = auth.password_hasher.completed
+
+    response = client.post('/auth/login', data={'username': user.username, 'password': 'password'})
+    assert response.status_code == 200
+    assert response.json()['user']['id'] == user.id
+
+    response = client.post('/auth/login', data={'username': user.username, 'password': 'wrong'})
+    assert response.status_code == 400
+    assert auth.password_hasher.completed == completed + 2
+
+
+def test_login_is_rejected_while_the_hasher_is_busy(db, client, monkeypatch):
+    user = create_user_with_password(db, 'user', 'password')
+    hasher = auth.password_hasher
+    monkeypatch.setattr(hasher, 'in_flight', hasher.max_workers + hasher.max_queue_size)
+    rejected = hasher.rejected
+
+    response = client.post('/auth/access-token', data={'username': user.username, 'password': 'password'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(hasher.retry_after)
+    assert hasher.rejected == rejected + 1
+
+
+def test_authenticate_with_an_async_session(tmp_path):
+    # aiosqlite connections are bound to the event loop they were opened on, so they are not pooled
+    engine = create_engine(f'sqlite:///{tmp_path / "test.db"}')
+    SQLModel.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as session:
+        user = create_user_with_password(session, 'user', 'password')
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "test.db"}', poolclass=NullPool)
+
+    async def authenticate(password: str):
+        async with AsyncSession(async_engine, sync_session_class=RequestSession, expire_on_commit=False) as session:
+            return await async_auth_service.authenticate(db=session, username=user.username, password=password)
+
+    assert asyncio.run(authenticate('password')).id == user.id
+    assert asyncio.run(authenticate('wrong')) is None
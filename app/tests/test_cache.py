@@ -0,0 +1,100 @@
+import asyncio
+
+from app.cache import PrincipalCache, SharedCacheBackend
+from app.models import CurrentUser
+from app.services import async_user_service
+from app.tests.utils import auth_headers, create_user
+
+
+class FakeSharedCacheBackend(SharedCacheBackend):
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key: str) -> str | None:
+        return self.values.get(key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self.values[key] = value
+
+    async def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+
+def test_cached_user_is_returned_without_queries(db, client):
+    user = create_user(db, 'user', bio='bio')
+    headers = auth_headers(user)
+
+    assert 'desc="1 queries"' in client.get('/users/me', headers=headers).headers['Server-Timing']
+    response = client.get('/users/me', headers=headers)
+    assert 'desc="0 queries"' in response.headers['Server-Timing']
+    assert response.json()['bio'] == 'bio'
+    assert response.json()['is_superuser'] is False
+
+
+def test_cached_user_is_invalidated_on_update_and_deactivation(db, client):
+    user = create_user(db, 'user')
+    headers = auth_headers(user)
+    client.get('/users/me', headers=headers)
+
+    response = client.put('/users/me/update-status', headers=headers, json={'new_status': 'busy'})
+    assert response.json()['status'] == 'busy'
+    assert client.get('/users/me', headers=headers).json()['status'] == 'busy'
+
+    asyncio.run(async_user_service.deactivate_user(db=db, user_id=user.id))
+    response = client.get('/users/me', headers=headers)
+    assert response.status_code == 403
+    assert response.json() == {'detail': 'User is inactive'}
+
+
+def test_invalidation_reaches_the_caches_of_other_workers():
+    async def run():
+        # two workers sharing one backend
+        backend = FakeSharedCacheBackend()
+        cache_a = PrincipalCache(max_size=10, ttl=60, shared_backend=backend)
+        cache_b = PrincipalCache(max_size=10, ttl=60, shared_backend=backend)
+        principal = CurrentUser(
+            id=1,
+            name='user',
+            username='user@test.io',
+            email='user@test.io',
+            email_verified_at=None,
+            is_active=True,
+            is_superuser=False,
+        )
+
+        await cache_a.set('token', principal)
+        await cache_b.set('token', principal)
+        assert await cache_b.get_by_token('token') == principal
+
+        await cache_a.invalidate_user(1)
+        assert await cache_a.get_by_token('token') is None
+        assert await cache_b.get_by_token('token') is None
+
+    asyncio.run(run())
+
+
+def test_invalidations_of_many_users_do_not_revive_stale_entries():
+    async def run():
+        cache = PrincipalCache(max_size=2, ttl=60)
+        principal = CurrentUser(
+            id=1,
+            name='user',
+            username='user@test.io',
+            email='user@test.io',
+            email_verified_at=None,
+            is_active=True,
+            is_superuser=False,
+        )
+        await cache.set('token', principal)
+        await cache.invalidate_user(1)
+
+        # more invalidated users than max_size, the version of the first one must be kept
+        for user_id in range(2, 4):
+            await cache.invalidate_user(user_id)
+        assert await cache.get_by_token('token') is None
+
+        # cached again after the invalidation
+        await cache.set('token', principal)
+        assert await cache.get_by_token('token') == principal
+
+    asyncio.run(run())
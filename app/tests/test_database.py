@@ -0,0 +1,119 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import Request
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.cache import principal_cache
+from app.config import settings
+from app.database import RequestSession, get_engine_options, get_pool_stats, run_in_session
+from app.deps import get_db
+from app.main import app
+from app.models import User
+from app.services import user_service
+from app.tests.utils import auth_headers, create_user
+
+
+def test_request_session_releases_connection_after_reads():
+    engine = create_engine('sqlite://', poolclass=QueuePool)
+    SQLModel.metadata.create_all(engine)
+
+    with RequestSession(engine) as session:
+        # no connection is checked out before the first query
+        assert engine.pool.checkedout() == 0
+
+        session.exec(select(User)).all()
+        assert engine.pool.checkedout() == 1
+
+        session.release()
+        assert engine.pool.checkedout() == 0
+        assert session.stats.checkouts == 1
+        assert session.stats.queries == 1
+
+
+def test_engine_options_follow_settings(monkeypatch):
+    monkeypatch.setattr(settings, 'DATABASE_POOL_SIZE', 20)
+    monkeypatch.setattr(settings, 'DATABASE_STATEMENT_TIMEOUT', 5000)
+
+    # sqlite keeps the pools SQLAlchemy picks
+    assert get_engine_options('sqlite:///app.db') == {}
+
+    options = get_engine_options('postgresql://localhost/app')
+    assert options['pool_size'] == 20
+    assert options['pool_pre_ping'] is settings.DATABASE_POOL_PRE_PING
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+
+    options = get_engine_options('postgresql+asyncpg://localhost/app')
+    assert options['connect_args'] == {'server_settings': {'statement_timeout': '5000'}}
+
+    monkeypatch.setattr(settings, 'DATABASE_STATEMENT_TIMEOUT', 0)
+    assert 'connect_args' not in get_engine_options('postgresql://localhost/app')
+
+
+def test_pool_stats_of_pools_without_counts():
+    # in-memory sqlite databases use a SingletonThreadPool
+    assert get_pool_stats(create_engine('sqlite://')) == {'pool': 'SingletonThreadPool'}
+
+
+def test_run_in_session_runs_sync_sessions_off_the_event_loop(db):
+    user = create_user(db, 'user')
+
+    def get_user(db, user_id: int):
+        return threading.get_ident(), user_service.get_user_by_id(db=db, user_id=user_id)
+
+    async def run():
+        return threading.get_ident(), await run_in_session(db, get_user, user_id=user.id)
+
+    loop_thread, (service_thread, found_user) = asyncio.run(run())
+    assert service_thread != loop_thread
+    assert found_user.id == user.id
+    # the session released its connection once the function returned
+    assert not db.in_transaction()
+
+
+def test_run_in_session_rolls_back_when_the_function_fails(db):
+    def create_and_fail(db):
+        create_user(db, 'committed')
+        db.add(User(name='flushed', username='flushed@test.io', email='flushed@test.io', hashed_password='!'))
+        db.flush()
+        raise ValueError('failed after the flush')
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_in_session(db, create_and_fail))
+
+    # the flushed user is not committed by a later release of the session
+    db.release()
+    assert [user.name for user in db.exec(select(User))] == ['committed']
+
+
+def test_requests_work_with_sync_and_async_sessions(db, client, tmp_path):
+    user = create_user(db, 'user')
+    response = client.get('/users/me', headers=auth_headers(user))
+    assert response.status_code == 200
+    assert response.json()['email'] == user.email
+
+    # a database file, written with a sync engine and read with an async one. connections are not
+    # pooled, aiosqlite connections are bound to the event loop they were opened on
+    engine = create_engine(f'sqlite:///{tmp_path / "test.db"}')
+    SQLModel.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as session:
+        async_user = create_user(session, 'async')
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "test.db"}', poolclass=NullPool)
+
+    # the async session replaces the sync one, like with DATABASE_ASYNC enabled
+    async def get_test_async_db(request: Request):
+        async with AsyncSession(async_engine, sync_session_class=RequestSession, expire_on_commit=False) as session:
+            request.state.db_stats = session.sync_session.stats
+            yield session
+
+    app.dependency_overrides[get_db] = get_test_async_db
+    # both users have id 1, the user cached for the first request must not be returned
+    principal_cache.clear()
+    response = client.get('/users/me', headers=auth_headers(async_user))
+    assert response.status_code == 200
+    assert response.json()['email'] == async_user.email
+    assert 'desc="1 queries"' in response.headers['Server-Timing']
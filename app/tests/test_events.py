@@ -0,0 +1,105 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine
+
+from app import events
+from app.deps import get_db
+from app.database import RequestSession
+from app.events import EventPublisher, create_friend_event, create_status_changed_event
+from app.main import app
+from app.models import Event, EventType, Friend, FriendPublic, FriendRequest, UserPublic
+from app.services import friend_service
+from app.tests.test_websocket import FakeWebSocket
+from app.tests.utils import auth_headers, create_user
+from app.websocket import manager
+
+
+def test_events_are_delivered_off_the_request_path(db, monkeypatch):
+    sender_user = create_user(db, 'sender')
+    recipient_user = create_user(db, 'recipient')
+    friend = friend_service.create_friend(
+        db=db,
+        current_user=sender_user,
+        data=FriendRequest(recipient_id=recipient_user.id),
+    )
+
+    async def get_friend_ids(user_id: int) -> list[int]:
+        return [3] if user_id == sender_user.id else []
+
+    monkeypatch.setattr(events, '_get_friend_ids', get_friend_ids)
+
+    async def run():
+        publisher = EventPublisher(max_queue_size=10)
+        sender, recipient, friend_of_sender = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        connections = [
+            await manager.connect(sender_user.id, sender),
+            await manager.connect(recipient_user.id, recipient),
+            await manager.connect(3, friend_of_sender),
+        ]
+        try:
+            publisher.publish(
+                create_friend_event(EventType.FriendRequested, friend),
+                user_ids=[sender_user.id, recipient_user.id],
+            )
+            publisher.publish_to_friends(create_status_changed_event(sender_user), user_id=sender_user.id)
+
+            # publishing only queues the events
+            await asyncio.sleep(0.01)
+            assert sender.messages == recipient.messages == friend_of_sender.messages == []
+
+            await publisher.start()
+            await asyncio.sleep(0.01)
+            await publisher.stop()
+        finally:
+            for connection in connections:
+                manager.disconnect(connection)
+
+        for websocket in (sender, recipient):
+            event = Event.model_validate_json(websocket.messages[0])
+            assert event.type == EventType.FriendRequested
+            assert FriendPublic.model_validate(event.data) == FriendPublic.model_validate(friend)
+
+        assert len(sender.messages) == 1
+        [message] = friend_of_sender.messages
+        event = Event.model_validate_json(message)
+        assert event.type == EventType.StatusChanged
+        assert UserPublic.model_validate(event.data).status == sender_user.status
+
+    asyncio.run(run())
+
+
+def test_friend_request_is_published_once_committed(tmp_path, monkeypatch):
+    # a database file, so a second connection only sees committed rows
+    engine = create_engine(f'sqlite:///{tmp_path / "test.db"}', connect_args={'check_same_thread': False})
+    SQLModel.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as db:
+        sender = create_user(db, 'sender')
+        recipient = create_user(db, 'recipient')
+
+    published = []
+
+    def publish(event: Event, user_ids: list[int]):
+        with Session(engine) as other_db:
+            published.append((event, user_ids, other_db.get(Friend, event.data['id'])))
+
+    def get_test_db():
+        with RequestSession(engine) as session:
+            yield session
+
+    monkeypatch.setattr(events.publisher, 'publish', publish)
+    app.dependency_overrides[get_db] = get_test_db
+    try:
+        response = TestClient(app).post(
+            '/friends/request',
+            headers=auth_headers(sender),
+            json={'recipient_id': recipient.id},
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 201
+    [(event, user_ids, committed_friend)] = published
+    assert event.type == EventType.FriendRequested
+    assert user_ids == [sender.id, recipient.id]
+    assert committed_friend is not None
@@ -0,0 +1,235 @@
+import pytest
+from sqlmodel import select
+
+from app.config import settings
+from app.models import Friend, FriendRequest, FriendStatus, Friendship, User
+from app.services import friend_service, user_service
+from app.tests.utils import assert_num_queries, auth_headers, create_friendship, create_user
+
+
+def test_transition_does_not_join_users(db):
+    sender = create_user(db, 'sender')
+    recipient = create_user(db, 'recipient')
+    friend = friend_service.create_friend(
+        db=db,
+        current_user=sender,
+        data=FriendRequest(recipient_id=recipient.id),
+    )
+    db.expunge_all()
+
+    with assert_num_queries(db, 1) as statements:
+        friend = friend_service.get_friend_by_id(db=db, friend_id=friend.id)
+    assert 'JOIN' not in statements[0]
+
+    # conditional update returning the friend, friendship, friend counts, friends whose suggestions
+    # are dropped, then the sender and recipient
+    with assert_num_queries(db, 5) as statements:
+        friend, changed = friend_service.accept_friend(db=db, friend_id=friend.id, recipient_id=recipient.id)
+    assert changed
+    assert statements[0].startswith('UPDATE friend') and 'RETURNING' in statements[0]
+    assert not any('JOIN' in statement for statement in statements)
+    assert friend.sender.id == sender.id
+    assert friend.recipient.id == recipient.id
+
+
+def test_transition_is_conditional(db):
+    sender = create_user(db, 'sender')
+    recipient = create_user(db, 'recipient')
+    friend = friend_service.create_friend(
+        db=db,
+        current_user=sender,
+        data=FriendRequest(recipient_id=recipient.id),
+    )
+
+    with pytest.raises(friend_service.FriendNotFound):
+        friend_service.accept_friend(db=db, friend_id=friend.id + 1, recipient_id=recipient.id)
+
+    # only the recipient can accept
+    with pytest.raises(friend_service.FriendTransitionNotAllowed):
+        friend_service.accept_friend(db=db, friend_id=friend.id, recipient_id=sender.id)
+
+    friend, changed = friend_service.accept_friend(db=db, friend_id=friend.id, recipient_id=recipient.id)
+    assert changed
+
+    # accepting again changes nothing, declining an accepted friend is not allowed
+    friend, changed = friend_service.accept_friend(db=db, friend_id=friend.id, recipient_id=recipient.id)
+    assert not changed
+    assert friend.status == FriendStatus.Accepted
+    assert user_service.get_friend_count(db=db, user_id=sender.id) == 1
+    with pytest.raises(friend_service.FriendTransitionNotAllowed):
+        friend_service.decline_friend(db=db, friend_id=friend.id, recipient_id=recipient.id)
+
+
+def test_friends_list_query_count_does_not_grow_with_page(db):
+    user = create_user(db, 'user')
+    for index in range(5):
+        other = create_user(db, f'other{index}')
+        friend_service.create_friend(db=db, current_user=user, data=FriendRequest(recipient_id=other.id))
+    db.expunge_all()
+
+    # friends are selected with their senders and recipients as columns of one row
+    with assert_num_queries(db, 1) as statements:
+        page = friend_service.get_user_friends(db=db, user=user)
+    assert {friend.recipient.name for friend in page.items} == {f'other{index}' for index in range(5)}
+    assert 'hashed_password' not in statements[0]
+
+
+def test_friend_suggestions_rank_friends_of_friends_by_mutual_friends(db, monkeypatch):
+    monkeypatch.setattr(settings, 'FRIEND_SUGGESTIONS_MAX_LIMIT', 2)
+    user = create_user(db, 'user')
+    friend_a = create_user(db, 'friend_a')
+    friend_b = create_user(db, 'friend_b')
+    two_mutual = create_user(db, 'two_mutual')
+    one_mutual = create_user(db, 'one_mutual')
+    requested = create_user(db, 'requested')
+    inactive = create_user(db, 'inactive', is_active=False)
+    for friend in (friend_a, friend_b):
+        create_friendship(db, user, friend)
+        create_friendship(db, friend, two_mutual)
+        create_friendship(db, friend, inactive)
+        create_friendship(db, friend, requested)
+    create_friendship(db, friend_a, one_mutual)
+    # a pending request excludes the user like a friendship does
+    friend_service.create_friend(db=db, current_user=requested, data=FriendRequest(recipient_id=user.id))
+
+    # the inactive user has as many mutual friends as two_mutual, but takes no slot
+    suggestions = friend_service.get_friend_suggestions(db=db, user_id=user.id, limit=2)
+    assert [(suggestion.user.id, suggestion.mutual_friend_count) for suggestion in suggestions] == [
+        (two_mutual.id, 2),
+        (one_mutual.id, 1),
+    ]
+
+
+def test_friend_suggestions_are_invalidated_when_friendships_change(db):
+    user = create_user(db, 'user')
+    friend = create_user(db, 'friend')
+    friend_of_friend = create_user(db, 'friend_of_friend')
+    create_friendship(db, user, friend)
+    assert friend_service.get_friend_suggestions(db=db, user_id=user.id) == []
+
+    # a new friendship of a friend changes the suggestions of the user
+    create_friendship(db, friend, friend_of_friend)
+    assert [suggestion.user.id for suggestion in friend_service.get_friend_suggestions(db=db, user_id=user.id)] == [
+        friend_of_friend.id,
+    ]
+
+    # the suggested user sends a request, they are no longer suggested
+    friend_service.create_friend(db=db, current_user=friend_of_friend, data=FriendRequest(recipient_id=user.id))
+    assert friend_service.get_friend_suggestions(db=db, user_id=user.id) == []
+
+
+def test_accepting_a_friend_adds_the_friendship_once(db):
+    sender = create_user(db, 'sender')
+    recipient = create_user(db, 'recipient')
+    declined = friend_service.create_friend(
+        db=db,
+        current_user=create_user(db, 'declined'),
+        data=FriendRequest(recipient_id=recipient.id),
+    )
+    friend_service.decline_friend(db=db, friend_id=declined.id, recipient_id=recipient.id)
+
+    friend = create_friendship(db, sender, recipient)
+    # a repeated accept changes nothing
+    _, changed = friend_service.accept_friend(db=db, friend_id=friend.id, recipient_id=recipient.id)
+    assert not changed
+
+    # one row in each direction, and one friend counted for each user
+    assert sorted(db.exec(select(Friendship.user_id, Friendship.friend_id)).all()) == [
+        (sender.id, recipient.id),
+        (recipient.id, sender.id),
+    ]
+    friend_counts = db.exec(select(User.name, User.friend_count)).all()
+    assert sorted(friend_counts) == [('declined', 0), ('recipient', 1), ('sender', 1)]
+
+
+def test_friend_between_users_is_found_in_both_directions(db, client):
+    sender = create_user(db, 'sender')
+    recipient = create_user(db, 'recipient')
+    create_user(db, 'stranger')
+    friend = friend_service.create_friend(db=db, current_user=sender, data=FriendRequest(recipient_id=recipient.id))
+
+    for user_a, user_b in ((sender, recipient), (recipient, sender)):
+        found = friend_service.get_friend_between_users(db=db, user_a_id=user_a.id, user_b_id=user_b.id)
+        assert found.id == friend.id
+
+        response = client.get('/friends/get-with-other-user', headers=auth_headers(user_a), params={
+            'other_user_id': user_b.id,
+        })
+        assert response.status_code == 200
+        assert response.json()['id'] == friend.id
+
+    response = client.get('/friends/get-with-other-user', headers=auth_headers(sender), params={
+        'other_user_id': recipient.id + 1,
+    })
+    assert response.status_code == 404
+
+
+def test_concurrent_friend_requests_are_rejected_by_the_pair_key(db, monkeypatch):
+    sender = create_user(db, 'sender')
+    recipient = create_user(db, 'recipient')
+    friend = friend_service.create_friend(db=db, current_user=sender, data=FriendRequest(recipient_id=recipient.id))
+
+    # the request of the recipient raced the one of the sender, both passed the validation
+    monkeypatch.setattr(friend_service, '_validate_friend_conflict', lambda **_: True)
+    assert friend_service.create_friend(
+        db=db,
+        current_user=recipient,
+        data=FriendRequest(recipient_id=sender.id),
+    ) is None
+
+    # the session was rolled back and is still usable
+    assert db.exec(select(Friend.id)).all() == [friend.id]
+
+
+def test_relationships_with_users(db):
+    user = create_user(db, 'user')
+    friend = create_user(db, 'friend')
+    requester = create_user(db, 'requester')
+    stranger = create_user(db, 'stranger')
+    friendship = create_friendship(db, user, friend)
+    request = friend_service.create_friend(db=db, current_user=requester, data=FriendRequest(recipient_id=user.id))
+
+    with assert_num_queries(db, 1):
+        relationships = friend_service.get_relationships_with_users(
+            db=db,
+            user_id=user.id,
+            other_user_ids=[requester.id, stranger.id, friend.id, user.id, requester.id],
+        )
+
+    # in the order given, duplicates included. The user has no relationship with themselves
+    assert [relationship.model_dump() for relationship in relationships] == [
+        {'user_id': requester.id, 'friend_id': request.id, 'sender_id': requester.id, 'status': FriendStatus.Pending},
+        {'user_id': stranger.id, 'friend_id': None, 'sender_id': None, 'status': None},
+        {'user_id': friend.id, 'friend_id': friendship.id, 'sender_id': user.id, 'status': FriendStatus.Accepted},
+        {'user_id': user.id, 'friend_id': None, 'sender_id': None, 'status': None},
+        {'user_id': requester.id, 'friend_id': request.id, 'sender_id': requester.id, 'status': FriendStatus.Pending},
+    ]
+
+    with assert_num_queries(db, 0):
+        assert friend_service.get_relationships_with_users(db=db, user_id=user.id, other_user_ids=[]) == []
+
+
+def test_relationships_endpoint(db, client, query_budget):
+    user = create_user(db, 'user')
+    friend = create_user(db, 'friend')
+    friendship = create_friendship(db, friend, user)
+    headers = auth_headers(user)
+
+    # the current user, then one query for all the users
+    with query_budget(2):
+        response = client.get('/friends/relationships', headers=headers, params={
+            'user_ids': [friend.id, friend.id + 1],
+        })
+    assert response.status_code == 200
+    assert response.json() == [
+        {'user_id': friend.id, 'friend_id': friendship.id, 'sender_id': friend.id, 'status': 'Accepted'},
+        {'user_id': friend.id + 1, 'friend_id': None, 'sender_id': None, 'status': None},
+    ]
+
+    # at most FRIEND_RELATIONSHIPS_MAX_IDS users per request
+    user_ids = list(range(1, settings.FRIEND_RELATIONSHIPS_MAX_IDS + 1))
+    response = client.get('/friends/relationships', headers=headers, params={'user_ids': user_ids})
+    assert response.status_code == 200
+    assert len(response.json()) == settings.FRIEND_RELATIONSHIPS_MAX_IDS
+    response = client.get('/friends/relationships', headers=headers, params={'user_ids': user_ids + [0]})
+    assert response.status_code == 422
@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+from app.loop_monitor import LoopMonitor
+
+
+def block_loop():
+    time.sleep(0.2)
+
+
+def test_stall_is_attributed_to_blocking_call_site():
+    monitor = LoopMonitor(interval=0.01, threshold=0.05)
+
+    async def run():
+        await monitor.start()
+        await asyncio.sleep(0.05)
+        block_loop()
+        # let the monitor task measure the stall
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(run())
+
+    stats = monitor.stats()
+    assert stats['stalls'] == 1
+    assert stats['max_lag_seconds'] >= 0.15
+
+    site = stats['sites'][0]
+    assert site['site'].startswith('app/tests/test_loop_monitor.py:') and site['site'].endswith('in block_loop')
+    assert site['blocked_in'] == site['site']
+    assert site['total_seconds'] >= 0.15
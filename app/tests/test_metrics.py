@@ -0,0 +1,63 @@
+from sqlalchemy.pool import QueuePool
+from sqlmodel import create_engine
+
+from app import database
+from app.config import settings
+from app.metrics import Counter, LabeledHistogram, Registry
+from app.tests.utils import auth_headers, create_user
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.register(Counter('requests_total', 'Requests', label_names=('route',)))
+    duration = registry.register(LabeledHistogram('duration_seconds', 'Duration', buckets=(0.1, 1), label_names=('route',)))
+
+    requests.inc('/users/{user_id}')
+    requests.inc('/users/{user_id}')
+    duration.observe(0.05, '/a"b')
+    duration.observe(0.5, '/a"b')
+    duration.observe(5, '/a"b')
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{route="/users/{user_id}"} 2.0',
+        '# HELP duration_seconds Duration',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+        'duration_seconds_bucket{route="/a\\"b",le="1.0"} 2',
+        'duration_seconds_bucket{route="/a\\"b",le="+Inf"} 3',
+        'duration_seconds_sum{route="/a\\"b"} 5.55',
+        'duration_seconds_count{route="/a\\"b"} 3',
+    ]
+
+
+def test_pool_metrics_are_for_superusers_only(db, client, monkeypatch):
+    monkeypatch.setattr(database, 'engine', create_engine('sqlite://', poolclass=QueuePool, pool_size=3))
+    user = create_user(db, 'user')
+    superuser = create_user(db, 'superuser', is_superuser=True)
+
+    assert client.get('/internal/metrics', headers=auth_headers(user)).status_code == 403
+
+    response = client.get('/internal/metrics', headers=auth_headers(superuser))
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats['database']['pool'] == {'pool': 'QueuePool', 'size': 3, 'checkedin': 0, 'checkedout': 0, 'overflow': -3}
+    assert set(stats['database']['checkout_wait_seconds']) == {'buckets', 'count', 'sum'}
+    assert 'in_flight' in stats['password_hasher']
+
+
+def test_prometheus_metrics_require_the_scrape_token(db, client, monkeypatch):
+    superuser = create_user(db, 'superuser', is_superuser=True)
+
+    # disabled until a scrape token is set, even for superusers
+    response = client.get('/internal/metrics/prometheus', headers=auth_headers(superuser))
+    assert response.status_code == 404
+
+    monkeypatch.setattr(settings, 'METRICS_SCRAPE_TOKEN', 'scrape-token')
+    response = client.get('/internal/metrics/prometheus', headers=auth_headers(superuser))
+    assert response.status_code == 403
+
+    response = client.get('/internal/metrics/prometheus', headers={'Authorization': 'Bearer scrape-token'})
+    assert response.status_code == 200
+    assert '# TYPE http_requests_total counter' in response.text
@@ -0,0 +1,36 @@
+import pytest
+
+from app.profiler import QueryProfile, statement_shape
+from app.tests.utils import auth_headers, create_user
+
+
+def test_statement_shape_ignores_parameters():
+    assert statement_shape('SELECT * FROM user WHERE id IN (?, ?, ?)') == statement_shape(
+        'SELECT *\n FROM user WHERE id IN (?)'
+    )
+    assert statement_shape('SELECT * FROM "user" WHERE id = %(id_1)s') == 'SELECT * FROM "user" WHERE id = ?'
+
+
+def test_profile_flags_repeated_and_explains_slow_queries(db):
+    profile = QueryProfile(slow_query_seconds=0, repeated_query_threshold=3)
+    connection = db.connection()
+    for user_id in range(3):
+        profile.record(connection, 'SELECT * FROM user WHERE id = ?', (user_id,), duration=0.001)
+
+    assert profile.repeated_queries() == {'SELECT * FROM user WHERE id = ?': 3}
+    assert 'user' in profile.queries[0].plan
+    assert profile.summary() == 'queries=3; time=3.0ms; slow=3; repeated=1'
+
+
+def test_query_budget_fails_requests_over_budget(db, client, query_budget):
+    user = create_user(db, 'user')
+    headers = auth_headers(user)
+
+    # the current user, then the page of users
+    with query_budget(2):
+        response = client.get('/users/list', headers=headers)
+    assert response.headers['X-Query-Profile'].startswith('queries=')
+
+    with pytest.raises(pytest.fail.Exception, match='over the budget of 0'):
+        with query_budget(0):
+            client.get(f'/users/{user.id}/friend-count', headers=headers)
@@ -0,0 +1,36 @@
+import json
+
+from app import auth
+from app.models import FriendStatus, User
+from app.seed import import_friends, import_users, read_rows
+from app.services import user_service
+
+
+def test_import_users_and_friends(db, tmp_path):
+    users_path = tmp_path / 'users.csv'
+    users_path.write_text(
+        'name,email,password,hashed_password,is_superuser\n'
+        'Ann,ann@test.io,AnnPassword,,true\n'
+        'Ben,ben@test.io,,!,\n'
+        'Cat,cat@test.io,,!,\n'
+    )
+    friends_path = tmp_path / 'friends.ndjson'
+    friends_path.write_text('\n'.join(json.dumps(row) for row in [
+        {'sender_email': 'ann@test.io', 'recipient_email': 'ben@test.io'},
+        {'sender_email': 'cat@test.io', 'recipient_email': 'ann@test.io', 'status': FriendStatus.Pending},
+    ]))
+
+    engine = db.get_bind()
+    # batches of one user, so a batch is hashed while the previous one is written
+    assert import_users(engine, read_rows(users_path), batch_size=1) == 3
+    assert import_friends(engine, read_rows(friends_path)) == 2
+
+    users = {user.email: user for user in db.query(User)}
+    assert auth.verify_password('AnnPassword', users['ann@test.io'].hashed_password)
+    assert users['ann@test.io'].is_superuser
+    assert users['ben@test.io'].hashed_password == '!'
+
+    # only the accepted friend is a friendship
+    assert users['ann@test.io'].friend_count == 1
+    assert users['cat@test.io'].friend_count == 0
+    assert user_service.get_friend_ids(db=db, user_id=users['ben@test.io'].id) == [users['ann@test.io'].id]
@@ -0,0 +1,159 @@
+import pytest
+
+from app.config import settings
+from app.pagination import decode_cursor
+from app.services import user_service
+from app.tests.utils import auth_headers, create_friendship, create_user
+
+
+def test_friends_pages_are_stable_while_friends_change(db, client):
+    user = create_user(db, 'user')
+    friends = [create_user(db, f'friend{index}') for index in range(5)]
+    for friend in friends:
+        create_friendship(db, friend, user)
+
+    headers = auth_headers(user)
+    seen = []
+    cursor = None
+    while True:
+        params = {'limit': 2} if cursor is None else {'limit': 2, 'cursor': cursor}
+        response = client.get('/users/list-users-who-are-friends-with-current-user', headers=headers, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        seen.extend(friend['id'] for friend in page['items'])
+
+        # friends updating their status between pages do not move between pages
+        for friend in friends:
+            user_service.update_user_status(db=db, user_id=friend.id, status=f'{friend.name} at page {len(seen)}')
+
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    # most recent friends first
+    assert seen == [friend.id for friend in reversed(friends)]
+
+
+def test_mutual_friends_are_paged_by_friendship(db):
+    user = create_user(db, 'user')
+    other_user = create_user(db, 'other')
+    mutual_friends = [create_user(db, f'mutual{index}') for index in range(3)]
+    for friend in mutual_friends:
+        create_friendship(db, user, friend)
+        create_friendship(db, other_user, friend)
+    create_friendship(db, user, create_user(db, 'only_user'))
+
+    first_page = user_service.get_mutual_friends(db=db, user_id=user.id, other_user_id=other_user.id, limit=2)
+    user_service.update_user_status(db=db, user_id=mutual_friends[0].id, status='moved')
+    second_page = user_service.get_mutual_friends(
+        db=db,
+        user_id=user.id,
+        other_user_id=other_user.id,
+        cursor=decode_cursor(first_page.next_cursor),
+        limit=2,
+    )
+
+    assert [friend.id for friend in first_page.items + second_page.items] == [
+        friend.id for friend in reversed(mutual_friends)
+    ]
+    assert second_page.next_cursor is None
+
+
+def test_page_size_is_clamped(db, monkeypatch):
+    user = create_user(db, 'user')
+    for index in range(3):
+        create_friendship(db, user, create_user(db, f'friend{index}'))
+
+    monkeypatch.setattr(settings, 'PAGINATION_MAX_LIMIT', 2)
+    page = user_service.get_users_who_are_friends_with_user(db=db, user_id=user.id, limit=100)
+    assert len(page.items) == 2
+    assert page.next_cursor is not None
+
+
+def test_malformed_cursor_is_rejected(db, client):
+    headers = auth_headers(create_user(db, 'user'))
+    for cursor in ('not-a-cursor', 'W10', 'WyJub3QgYSBkYXRlIiwxXQ'):
+        response = client.get('/users/list-users-who-are-friends-with-current-user', headers=headers, params={
+            'cursor': cursor,
+        })
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Invalid cursor'}
+
+    response = client.get('/users/list', headers=headers, params={'limit': settings.PAGINATION_MAX_LIMIT + 1})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize('query, matching, not_matching', [
+    ('100%', '100% sure', '1000 sure'),
+    ('snake_', 'snake_case', 'snakecase'),
+    ('back\\', 'back\\slash', 'backslash'),
+    ('a/b', 'a/b testing', 'ab testing'),
+])
+def test_search_users_matches_wildcards_literally(db, query, matching, not_matching):
+    user = create_user(db, matching)
+    create_user(db, not_matching)
+
+    page = user_service.search_users(db=db, query=query)
+    assert [found.id for found in page.items] == [user.id]
+
+
+def test_search_users_ranks_prefix_matches_first(db):
+    contains = create_user(db, 'Joann')
+    long_prefix = create_user(db, 'Annabelle')
+    short_prefix = create_user(db, 'ann')
+    create_user(db, 'Anne', is_active=False)
+
+    page = user_service.search_users(db=db, query='Ann')
+    # prefix matches first, shortest names first on sqlite
+    assert [found.id for found in page.items] == [short_prefix.id, long_prefix.id, contains.id]
+    assert page.next_cursor is None
+
+
+def test_mutual_friends_and_friend_count_endpoints(db, client):
+    user = create_user(db, 'user')
+    other_user = create_user(db, 'other')
+    mutual_friend = create_user(db, 'mutual')
+    for friend in (user, other_user):
+        create_friendship(db, friend, mutual_friend)
+    create_friendship(db, user, create_user(db, 'only_user'))
+    create_friendship(db, create_user(db, 'only_other'), other_user)
+    # friends with each other, but not mutual friends of themselves
+    create_friendship(db, user, other_user)
+
+    headers = auth_headers(user)
+    response = client.get(f'/users/{other_user.id}/mutual-friends', headers=headers)
+    assert response.status_code == 200
+    assert [friend['id'] for friend in response.json()['items']] == [mutual_friend.id]
+
+    response = client.get(f'/users/{user.id}/friend-count', headers=headers)
+    assert response.json() == {'user_id': user.id, 'friend_count': 3}
+    response = client.get('/users/0/friend-count', headers=headers)
+    assert response.status_code == 404
+
+
+def test_search_users_is_paged(db, client):
+    # names of the same length tie on the rank, and are ordered by created_at and id
+    users = [create_user(db, name) for name in ('ann', 'Anna', 'Anne', 'Annabelle', 'Joann', 'Joanne')]
+    headers = auth_headers(users[0])
+
+    seen = []
+    cursor = None
+    while True:
+        params = {'query': 'ann', 'limit': 2} if cursor is None else {'query': 'ann', 'limit': 2, 'cursor': cursor}
+        response = client.get('/users/list', headers=headers, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        seen.extend(user['name'] for user in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert seen == ['ann', 'Anne', 'Anna', 'Annabelle', 'Joann', 'Joanne']
+
+    # a search cursor is not a cursor of the users list, and the other way round
+    first_page = client.get('/users/list', headers=headers, params={'query': 'ann', 'limit': 2}).json()
+    response = client.get('/users/list', headers=headers, params={'cursor': first_page['next_cursor']})
+    assert response.status_code == 400
+    first_page = client.get('/users/list', headers=headers, params={'limit': 2}).json()
+    response = client.get('/users/list', headers=headers, params={'query': 'ann', 'cursor': first_page['next_cursor']})
+    assert response.status_code == 400
@@ -0,0 +1,238 @@
+import asyncio
+import json
+
+import asyncpg
+import pytest
+from fastapi import status
+from starlette.websockets import WebSocketDisconnect
+
+from app import auth, metrics
+from app.broadcast import InMemoryBroadcastBackend, PostgresBroadcastBackend, split_payload
+from app.services import async_user_service
+from app.tests.utils import create_user
+from app.websocket import WebsocketConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self, blocked: bool = False):
+        self.messages = []
+        self.close_code = None
+        # a blocked socket never completes a send, like a client that stopped reading
+        self._blocked = blocked
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+    async def send_text(self, message: str):
+        if self._blocked:
+            await asyncio.Event().wait()
+        self.messages.append(message)
+
+
+def test_broadcast_reaches_sockets_of_other_managers():
+    async def run():
+        # two managers sharing one backend, like two workers sharing postgres
+        backend = InMemoryBroadcastBackend()
+        manager_a = WebsocketConnectionManager(backend=backend, send_timeout=1)
+        manager_b = WebsocketConnectionManager(backend=backend, send_timeout=1)
+
+        socket_a = FakeWebSocket()
+        socket_b = FakeWebSocket()
+        other_socket = FakeWebSocket()
+        await manager_a.connect(1, socket_a)
+        await manager_b.connect(1, socket_b)
+        await manager_b.connect(2, other_socket)
+
+        await manager_a.broadcast(1, 'hello')
+        # let the connection writers flush their send buffers
+        await asyncio.sleep(0.01)
+
+        assert socket_a.messages == ['hello']
+        assert socket_b.messages == ['hello']
+        assert other_socket.messages == []
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('token', [None, 'not-a-jwt', auth.create_access_token(subject=2)])
+def test_connect_rejects_invalid_token(db, client, token):
+    user = create_user(db, 'user')
+    create_user(db, 'other')
+    url = f'/ws/{user.id}' if token is None else f'/ws/{user.id}?token={token}'
+
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect(url) as websocket:
+            websocket.receive_text()
+    assert e.value.code == status.WS_1008_POLICY_VIOLATION
+
+
+def test_connect_rejects_inactive_user(db, client):
+    user = create_user(db, 'user')
+    token = auth.create_access_token(subject=user.id)
+    with client.websocket_connect(f'/ws/{user.id}?token={token}'):
+        pass
+
+    # the token is still valid, but the user was deactivated since
+    asyncio.run(async_user_service.deactivate_user(db=db, user_id=user.id))
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect(f'/ws/{user.id}?token={token}') as websocket:
+            websocket.receive_text()
+    assert e.value.code == status.WS_1008_POLICY_VIOLATION
+
+
+def test_text_and_binary_frames_count_as_activity(db, client):
+    user = create_user(db, 'user')
+    received = metrics.websocket_messages_received_total._values.get((), 0)
+
+    token = auth.create_access_token(subject=user.id)
+    with client.websocket_connect(f'/ws/{user.id}?token={token}&heartbeat=true') as websocket:
+        websocket.send_text('pong')
+        websocket.send_bytes(b'pong')
+
+    assert metrics.websocket_messages_received_total._values.get((), 0) == received + 2
+
+
+def test_connect_closes_oldest_socket_over_limit():
+    async def run():
+        manager = WebsocketConnectionManager(
+            backend=InMemoryBroadcastBackend(),
+            send_timeout=1,
+            max_connections_per_client=2,
+        )
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for websocket in sockets:
+            await manager.connect(1, websocket)
+
+        assert sockets[0].close_code == status.WS_1008_POLICY_VIOLATION
+        assert {connection.websocket for connection in manager.active_connections[1]} == set(sockets[1:])
+
+    asyncio.run(run())
+
+
+def test_client_with_full_send_buffer_is_dropped():
+    async def run():
+        manager = WebsocketConnectionManager(backend=InMemoryBroadcastBackend(), send_timeout=10, send_buffer_size=2)
+        websocket = FakeWebSocket(blocked=True)
+        await manager.connect(1, websocket)
+
+        # the writer holds the first message, the buffer the next two, the fourth overflows it
+        for index in range(4):
+            await manager.deliver([1], f'message {index}')
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+
+        assert websocket.close_code == status.WS_1013_TRY_AGAIN_LATER
+        assert manager.connection_count() == 0
+
+    asyncio.run(run())
+
+
+def test_only_idle_heartbeat_clients_are_reaped():
+    async def run():
+        manager = WebsocketConnectionManager(backend=InMemoryBroadcastBackend(), send_timeout=1, idle_timeout=60)
+        listener = FakeWebSocket()
+        idle = FakeWebSocket()
+        active = FakeWebSocket()
+        listener_connection = await manager.connect(1, listener)
+        idle_connection = await manager.connect(2, idle, heartbeat=True)
+        await manager.connect(3, active, heartbeat=True)
+
+        # clients that did not opt into heartbeats never send a frame, and are not reaped for it
+        listener_connection.last_seen_at -= 120
+        idle_connection.last_seen_at -= 120
+        manager.reap_idle_connections()
+        await asyncio.sleep(0.01)
+
+        assert idle.close_code == status.WS_1001_GOING_AWAY
+        assert listener.close_code is None
+        assert active.close_code is None
+        assert set(manager.active_connections) == {1, 3}
+
+    asyncio.run(run())
+
+
+def test_postgres_payloads_over_the_notification_limit_are_split():
+    async def run():
+        backend = PostgresBroadcastBackend(dsn='', channel='broadcast')
+        received = []
+
+        async def handler(client_ids, message):
+            received.append((client_ids, message))
+
+        backend.subscribe(handler)
+
+        client_ids = list(range(2000))
+        message = 'é' * 5000
+        payload = json.dumps({'client_ids': client_ids, 'message': message})
+        notifications = split_payload(payload)
+        assert len(notifications) > 1
+        assert all(len(notification.encode()) < 8000 for notification in notifications)
+
+        for notification in notifications:
+            backend._on_notification(None, 0, 'broadcast', notification)
+        await asyncio.sleep(0.01)
+
+        assert received == [(client_ids, message)]
+        assert backend._parts == {}
+
+    asyncio.run(run())
+
+
+class FakePostgresConnection:
+    def __init__(self):
+        self.listeners = {}
+        self.termination_listeners = []
+        self.closed = False
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    async def close(self):
+        self.closed = True
+        for callback in self.termination_listeners:
+            callback(self)
+
+    def lose(self):
+        for callback in self.termination_listeners:
+            callback(self)
+
+
+def test_postgres_listen_connection_is_reopened_when_lost(monkeypatch):
+    connections = []
+    failures = [OSError('connection refused')]
+
+    async def connect(_dsn):
+        if len(connections) == 1 and failures:
+            raise failures.pop()
+        connections.append(FakePostgresConnection())
+        return connections[-1]
+
+    async def create_pool(_dsn, **_kwargs):
+        return FakePostgresConnection()
+
+    monkeypatch.setattr(asyncpg, 'connect', connect)
+    monkeypatch.setattr(asyncpg, 'create_pool', create_pool)
+
+    async def run():
+        backend = PostgresBroadcastBackend(dsn='', channel='broadcast', reconnect_delay=0.01)
+        await backend.connect()
+
+        connections[0].lose()
+        # one failed attempt, then the connection is reopened and listens again
+        await asyncio.sleep(0.05)
+        assert len(connections) == 2
+        assert 'broadcast' in connections[1].listeners
+
+        # closing it on disconnect does not reconnect
+        await backend.disconnect()
+        await asyncio.sleep(0.05)
+        assert connections[1].closed
+        assert len(connections) == 2
+
+    asyncio.run(run())
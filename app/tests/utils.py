@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app import auth
+from app.models import Friend, FriendRequest, User
+from app.services import friend_service
+
+
+def create_user(db: Session, name: str, **fields) -> User:
+    """
+    Creates a user with an unusable password
+    :param db: database session
+    :param name: name of the user, its email is derived from it
+    :return: the user
+    """
+    user = User(name=name, username=f'{name}@test.io', email=f'{name}@test.io', hashed_password='!', **fields)
+    db.add(user)
+    db.commit()
+    return user
+
+
+def create_friendship(db: Session, sender: User, recipient: User) -> Friend:
+    """
+    Sends a friend request from sender to recipient, and accepts it
+    :param db: database session
+    :param sender: user sending the request
+    :param recipient: user accepting it
+    :return: the accepted friend
+    """
+    friend = friend_service.create_friend(db=db, current_user=sender, data=FriendRequest(recipient_id=recipient.id))
+    friend, _ = friend_service.accept_friend(db=db, friend_id=friend.id, recipient_id=recipient.id)
+    return friend
+
+
+def auth_headers(user: User) -> dict[str, str]:
+    """
+    Returns the headers authenticating requests as the user
+    :param user: user
+    :return: headers
+    """
+    return {'Authorization': f'Bearer {auth.create_access_token(subject=user.id)}'}
+
+
+@contextmanager
+def assert_num_queries(db: Session, expected: int) -> Iterator[list[str]]:
+    """
+    Asserts that the block executes the expected number of statements on the session
+    :param db: database session
+    :param expected: expected number of statements
+    :return: a context manager yielding the list of executed statements
+    """
+    statements = []
+
+    def record(_conn, _cursor, statement, _parameters, _context, _executemany):
+        statements.append(statement)
+
+    engine = db.get_bind()
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert len(statements) == expected, (
+        f'Expected {expected} queries, got {len(statements)}:\n' + '\n'.join(statements)
+    )
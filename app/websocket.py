@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Sequence
+
+from fastapi import WebSocket, status
+
+from . import metrics
+from .broadcast import BroadcastBackend, create_broadcast_backend
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# heartbeat frame sent to the clients that opted into app level heartbeats,
+# they are expected to reply with any frame
+PING_MESSAGE = json.dumps({'type': 'ping'})
+
+
+class WebsocketConnection:
+    """
+    Open websocket connection of a client. Messages are queued in a bounded
+    send buffer and written by a dedicated task, so a slow client never holds
+    up the sender, and is closed instead once its buffer is full
+    """
+
+    def __init__(self, client_id: int, websocket: WebSocket, send_buffer_size: int, heartbeat: bool = False):
+        self.client_id = client_id
+        self.websocket = websocket
+        # whether the client opted into ping frames, only those clients are reaped when idle
+        self.heartbeat = heartbeat
+        self.connected_at = time.monotonic()
+        self.last_seen_at = self.connected_at
+        self.closed = False
+        self._send_buffer: asyncio.Queue[str] = asyncio.Queue(maxsize=send_buffer_size)
+        self._writer: asyncio.Task | None = None
+
+    def start(self, send_timeout: float, on_error: Callable[['WebsocketConnection'], None]):
+        """
+        Starts writing queued messages to the client
+        :param send_timeout: seconds to wait for a send to complete
+        :param on_error: called when a send fails or times out
+        """
+        self._writer = asyncio.create_task(self._write(send_timeout, on_error))
+
+    def touch(self):
+        """
+        Records activity from the client
+        """
+        self.last_seen_at = time.monotonic()
+
+    def send(self, message: str) -> bool:
+        """
+        Queues a message for the client
+        :param message: message
+        :return: False if the send buffer is full
+        """
+        try:
+            self._send_buffer.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self, send_timeout: float, on_error: Callable[['WebsocketConnection'], None]):
+        try:
+            while True:
+                message = await self._send_buffer.get()
+                await asyncio.wait_for(self.websocket.send_text(message), timeout=send_timeout)
+                metrics.websocket_messages_sent_total.inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info('Websocket send to client %s failed: %r', self.client_id, e)
+            on_error(self)
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        if self.closed:
+            return
+
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            # the connection is already gone
+            pass
+
+
+class WebsocketConnectionManager:
+    """
+    Registry of the open websocket connections, indexed by client id
+    so connecting, disconnecting and sending to a client do not depend
+    on the number of other connected clients.
+    Messages are published on the broadcast backend, and every manager
+    subscribed to it delivers them to the sockets it holds.
+    Dead peers are detected by the protocol level pings of the server, see app.worker.
+    Clients that opted into app level heartbeats are also sent a ping frame every
+    heartbeat_interval seconds, and reaped when they have not sent a frame for idle_timeout seconds
+    """
+
+    def __init__(
+            self,
+            backend: BroadcastBackend,
+            send_timeout: float,
+            send_buffer_size: int = 100,
+            max_connections_per_client: int = 5,
+            heartbeat_interval: float = 20,
+            idle_timeout: float = 60,
+    ):
+        self.backend = backend
+        self.send_timeout = send_timeout
+        self.send_buffer_size = send_buffer_size
+        self.max_connections_per_client = max_connections_per_client
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.active_connections: dict[int, set[WebsocketConnection]] = {}
+        self._heartbeat: asyncio.Task | None = None
+        # keeps a reference to close tasks until they are done
+        self._closing: set[asyncio.Task] = set()
+        backend.subscribe(self.deliver)
+
+    async def start(self):
+        await self.backend.connect()
+        self._heartbeat = asyncio.create_task(self._run_heartbeat())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+        await self.backend.disconnect()
+
+    async def connect(self, client_id: int, websocket: WebSocket, heartbeat: bool = False) -> WebsocketConnection:
+        await websocket.accept()
+
+        connections = self.active_connections.setdefault(client_id, set())
+        if len(connections) >= self.max_connections_per_client:
+            # make room by closing the oldest connection of the client
+            oldest = min(connections, key=lambda c: c.connected_at)
+            self.disconnect(oldest)
+            await oldest.close(code=status.WS_1008_POLICY_VIOLATION)
+
+        connection = WebsocketConnection(
+            client_id=client_id,
+            websocket=websocket,
+            send_buffer_size=self.send_buffer_size,
+            heartbeat=heartbeat,
+        )
+        connection.start(
+            send_timeout=self.send_timeout,
+            on_error=lambda c: self._drop(c, code=status.WS_1011_INTERNAL_ERROR),
+        )
+        self.active_connections.setdefault(client_id, set()).add(connection)
+        metrics.websocket_connections_opened_total.inc()
+        return connection
+
+    def disconnect(self, connection: WebsocketConnection):
+        connections = self.active_connections.get(connection.client_id)
+        if connections is None:
+            return
+
+        connections.discard(connection)
+        if not connections:
+            del self.active_connections[connection.client_id]
+
+    def _drop(self, connection: WebsocketConnection, code: int):
+        # removes the connection right away, closing it may take until the close timeout
+        self.disconnect(connection)
+        metrics.websocket_connections_dropped_total.inc(str(code))
+        task = asyncio.create_task(connection.close(code=code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _send(self, connection: WebsocketConnection, message: str):
+        if not connection.send(message):
+            # the client is not keeping up, drop it so its buffer does not grow
+            logger.info('Dropping websocket of client %s with a full send buffer', connection.client_id)
+            self._drop(connection, code=status.WS_1013_TRY_AGAIN_LATER)
+
+    async def broadcast(self, client_id: int, message: str):
+        """
+        Sends the message to every connection of the client, on every worker
+        :param client_id: id of the client to send to
+        :param message: message to send
+        """
+        await self.backend.publish([client_id], message)
+
+    async def broadcast_many(self, client_ids: Sequence[int], message: str):
+        """
+        Sends the message to every connection of the clients, on every worker
+        :param client_ids: ids of the clients to send to
+        :param message: message to send
+        """
+        if client_ids:
+            await self.backend.publish(client_ids, message)
+
+    async def deliver(self, client_ids: Sequence[int], message: str):
+        """
+        Queues the message on every connection of the clients held by this manager
+        :param client_ids: ids of the clients to send to
+        :param message: message to send
+        """
+        for client_id in client_ids:
+            for connection in list(self.active_connections.get(client_id, ())):
+                self._send(connection, message)
+
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+    def reap_idle_connections(self):
+        """
+        Drops the heartbeat connections the client has not been active on for idle_timeout seconds
+        """
+        idle_since = time.monotonic() - self.idle_timeout
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                if connection.heartbeat and connection.last_seen_at < idle_since:
+                    logger.info('Reaping idle websocket of client %s', connection.client_id)
+                    self._drop(connection, code=status.WS_1001_GOING_AWAY)
+
+    async def _run_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.reap_idle_connections()
+            for connections in list(self.active_connections.values()):
+                for connection in list(connections):
+                    if connection.heartbeat:
+                        self._send(connection, PING_MESSAGE)
+
+
+manager = WebsocketConnectionManager(
+    backend=create_broadcast_backend(),
+    send_timeout=settings.WEBSOCKET_SEND_TIMEOUT,
+    send_buffer_size=settings.WEBSOCKET_SEND_BUFFER_SIZE,
+    max_connections_per_client=settings.WEBSOCKET_MAX_CONNECTIONS_PER_USER,
+    heartbeat_interval=settings.WEBSOCKET_HEARTBEAT_INTERVAL,
+    idle_timeout=settings.WEBSOCKET_IDLE_TIMEOUT,
+)
+# open connections are counted when the metrics are rendered
+metrics.websocket_connections.set_function(manager.connection_count)
@@ -0,0 +1,16 @@
+from uvicorn.workers import UvicornWorker as BaseUvicornWorker
+
+from .config import settings
+
+
+class UvicornWorker(BaseUvicornWorker):
+    """
+    Gunicorn worker of the Procfile. Websocket clients are pinged at the protocol level,
+    which browsers answer on their own, so dead peers are closed without the clients
+    having to send anything
+    """
+    CONFIG_KWARGS = {
+        **BaseUvicornWorker.CONFIG_KWARGS,
+        'ws_ping_interval': settings.WEBSOCKET_PING_INTERVAL,
+        'ws_ping_timeout': settings.WEBSOCKET_PING_TIMEOUT,
+    }